@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Microbenchmark del filtro de idioma (is_latin_channel)
+
+Compara la implementación original (un `in` por palabra clave y un f-string
+por código de país) con la versión compilada de check_m3u.py sobre las
+listas de categorías de cine y música de iptv-org. Verifica además que ambas
+clasifiquen cada canal igual.
+
+Uso:
+    python benchmarks/bench_latin_filter.py [--local] [--repeat N]
+
+Con --local (o si no hay red) se usan cine.m3u y musica.m3u del
+repositorio en lugar de descargar las listas.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import check_m3u  # noqa: E402
+
+LEGACY_SPANISH_COUNTRIES = ['es', 'mx', 'ar', 'co', 'cl', 'pe', 've', 'ec',
+                            'uy', 'py', 'bo', 'cr', 'pa', 'gt', 'hn', 'sv',
+                            'ni', 'cu', 'pr', 'do']
+
+def legacy_is_latin_channel(extinf_line, url_line):
+    """Implementación original, conservada como referencia."""
+    full_text = (extinf_line + " " + url_line).lower()
+    for exclude_word in check_m3u.EXCLUDE_KEYWORDS:
+        if exclude_word in full_text:
+            return False
+    for keyword in check_m3u.LATIN_KEYWORDS:
+        if keyword in full_text:
+            return True
+    for country_code in LEGACY_SPANISH_COUNTRIES:
+        if f'tvg-country="{country_code}"' in full_text:
+            return True
+        if f'tvg-language="{country_code}"' in full_text:
+            return True
+    return False
+
+def load_channels(local):
+    """Retorna una lista de pares (extinf, url) de las listas de cine y música."""
+    if local:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        texts = []
+        for filename in (check_m3u.CINE_FILENAME, check_m3u.MUSIC_FILENAME):
+            with open(os.path.join(root, filename), 'r', encoding='utf-8') as f:
+                texts.append(f.read())
+    else:
+        try:
+            texts = [
+                check_m3u.get_session().get(url, timeout=check_m3u.DOWNLOAD_TIMEOUT).text
+                for url in (check_m3u.MOVIES_SOURCE_URL, check_m3u.MUSIC_SOURCE_URL)
+            ]
+        except check_m3u.requests.exceptions.RequestException as e:
+            print(f"⚠️  No se pudieron descargar las listas ({e.__class__.__name__}), usando las locales")
+            return load_channels(local=True)
+
+    channels = []
+    for text in texts:
+        lines = [line.strip() for line in text.split('\n')]
+        for i, line in enumerate(lines):
+            if line.startswith('#EXTINF') and i + 1 < len(lines):
+                channels.append((line, lines[i + 1]))
+    return channels
+
+def bench(function, channels, repeat):
+    """Retorna el mejor tiempo (en segundos) de `repeat` pasadas completas."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for extinf, url in channels:
+            function(extinf, url)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark de is_latin_channel")
+    parser.add_argument('--local', action='store_true', help="usar las listas locales")
+    parser.add_argument('--repeat', type=int, default=20, help="pasadas por implementación")
+    args = parser.parse_args()
+
+    channels = load_channels(args.local)
+    if not channels:
+        print("⚠️  No se encontraron canales para medir")
+        return 1
+
+    mismatches = [
+        extinf for extinf, url in channels
+        if legacy_is_latin_channel(extinf, url) != check_m3u.is_latin_channel(extinf, url)
+    ]
+
+    legacy = bench(legacy_is_latin_channel, channels, args.repeat)
+    compiled = bench(check_m3u.is_latin_channel, channels, args.repeat)
+
+    print(f"📊 Canales: {len(channels)} (mejor de {args.repeat} pasadas)")
+    print(f"   • Original:  {legacy * 1000:8.2f} ms  ({legacy / len(channels) * 1e6:6.2f} µs/canal)")
+    print(f"   • Compilado: {compiled * 1000:8.2f} ms  ({compiled / len(channels) * 1e6:6.2f} µs/canal)")
+    print(f"   • Mejora: x{legacy / compiled:.1f}")
+    if mismatches:
+        print(f"❌ {len(mismatches)} canales clasificados distinto, p. ej.: {mismatches[0][:80]}")
+        return 1
+    print("✅ Ambas implementaciones clasifican igual")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
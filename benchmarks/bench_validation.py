@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark de las fases de validación contra un origen IPTV falso local
+
+Genera listas de 1k/10k/100k canales servidas por benchmarks/fake_origin.py
+(latencia, timeouts, rechazo de HEAD y redirecciones configurables) y mide,
+para cada tamaño, la Fase 1 (process_remote_list sobre la lista remota) y la
+Fase 2 (clean_local_m3u_files sobre la lista completa y el resultado de la
+Fase 1) de check_m3u.py:
+
+    • tiempo total
+    • pico de memoria residente (RSS) del proceso
+    • pico de hilos activos
+    • verificaciones por segundo
+
+Cada tamaño se mide en un proceso nuevo y en un directorio temporal, sin
+caché persistente, para que los resultados sean comparables entre cambios.
+
+Uso:
+    python benchmarks/bench_validation.py [--sizes 1000,10000,100000] [--json salida.json]
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_origin import FakeOrigin, add_origin_arguments, origin_config  # noqa: E402
+
+class ThreadSampler:
+    """Muestrea el número de hilos activos para registrar el pico."""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            # Sin contar al propio muestreador
+            self.peak = max(self.peak, threading.active_count() - 1)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+def peak_rss_mb():
+    """Pico de memoria residente del proceso en MB (ru_maxrss está en KB en Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def measure(phase, function, check_m3u):
+    """Ejecuta una fase sin su salida por consola y retorna sus métricas."""
+    check_m3u.host_scheduler.reset()
+    with ThreadSampler() as sampler, open(os.devnull, 'w') as devnull:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(devnull):
+            function()
+        elapsed = time.perf_counter() - start
+    probes = sum(stats['probes'] for stats in check_m3u.host_scheduler.stats.values())
+    return {
+        'phase': phase,
+        'wall_s': round(elapsed, 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'peak_threads': sampler.peak,
+        'probes': probes,
+        'probes_per_s': round(probes / elapsed, 1) if elapsed else None,
+    }
+
+def run_scenario(size, playlist_url, settings, results):
+    """Mide ambas fases para una lista de `size` canales (en un proceso hijo)."""
+    os.environ['IPTV_MAX_WORKERS'] = str(settings['workers'])
+    os.environ['IPTV_RETRY_BACKOFF'] = str(settings['retry_backoff'])
+    import check_m3u
+    check_m3u.TIMEOUT = settings['timeout']
+    check_m3u.DEEP_PROBE = settings['deep']
+
+    workdir = tempfile.mkdtemp(prefix='bench_iptv_')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        source = check_m3u.get_session().get(playlist_url, timeout=check_m3u.DOWNLOAD_TIMEOUT)
+        with open('origen.m3u', 'w', encoding='utf-8') as f:
+            f.write(source.text)
+
+        metrics = [
+            measure('process_remote_list',
+                    lambda: check_m3u.process_remote_list(playlist_url, 'remota.m3u'), check_m3u),
+            measure('clean_local_m3u_files', check_m3u.clean_local_m3u_files, check_m3u),
+        ]
+        for entry in metrics:
+            entry['size'] = size
+        results.put(metrics)
+    except Exception as e:
+        results.put(f"{e.__class__.__name__}: {e}")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de validación con un origen IPTV falso")
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help="tamaños de lista separados por comas")
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('IPTV_MAX_WORKERS', '50')),
+                        help="hilos de validación (IPTV_MAX_WORKERS)")
+    parser.add_argument('--timeout', type=float, default=3,
+                        help="timeout de verificación en segundos (TIMEOUT)")
+    parser.add_argument('--retry-backoff', type=float, default=0,
+                        help="espera de la cola de reintentos (IPTV_RETRY_BACKOFF); 0 mide solo las verificaciones")
+    parser.add_argument('--deep', action='store_true', help="usar la verificación profunda HLS")
+    parser.add_argument('--json', help="guardar los resultados en este archivo JSON")
+    add_origin_arguments(parser)
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    settings = {'workers': args.workers, 'timeout': args.timeout, 'deep': args.deep,
+                'retry_backoff': args.retry_backoff}
+    context = multiprocessing.get_context('spawn')
+    rows = []
+
+    with FakeOrigin(**origin_config(args)) as origin:
+        print(f"📡 Origen falso: {args.hosts} hosts, {args.latency_ms:g}±{args.jitter_ms:g} ms, "
+              f"timeouts {args.timeout_rate:.0%}, HEAD 405 {args.head_reject_rate:.0%}, "
+              f"redirecciones {args.redirect_rate:.0%} x{args.redirect_hops}, caídos {args.dead_rate:.0%}")
+        print(f"⚙️  Workers: {args.workers}, timeout: {args.timeout:g}s, "
+              f"modo: {'profundo' if args.deep else 'HEAD'}\n")
+        print(f"{'canales':>8}  {'fase':<22} {'tiempo':>9} {'RSS pico':>9} {'hilos':>6} {'verif/s':>9}")
+
+        for size in sizes:
+            results = context.Queue()
+            process = context.Process(target=run_scenario,
+                                      args=(size, origin.playlist_url(size), settings, results))
+            process.start()
+            metrics = results.get()
+            process.join()
+            if isinstance(metrics, str):
+                print(f"{size:>8}  ❌ {metrics}")
+                continue
+            for entry in metrics:
+                rows.append(entry)
+                print(f"{size:>8}  {entry['phase']:<22} {entry['wall_s']:>8.2f}s "
+                      f"{entry['peak_rss_mb']:>7.1f}MB {entry['peak_threads']:>6} "
+                      f"{entry['probes_per_s']:>9.1f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'settings': {**settings, **origin_config(args)}, 'results': rows}, f, indent=4)
+        print(f"\n💾 Resultados guardados en {args.json}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
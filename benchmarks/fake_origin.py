@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Origen IPTV falso para los benchmarks (sin red)
+
+Levanta varios servidores HTTP locales (un puerto por "host", para que el
+límite por host de check_m3u se comporte como con orígenes reales) que
+emulan miles de endpoints HLS. El comportamiento de cada canal se decide de
+forma determinista a partir de su número:
+
+    • latencia configurable (con variación) en cada respuesta
+    • una fracción de canales que no responde antes del timeout
+    • una fracción que rechaza HEAD (405) y solo responde a GET
+    • una fracción con una cadena de redirecciones antes del manifiesto
+    • una fracción de canales caídos (404)
+
+Rutas:
+    /playlist/<n>.m3u            lista con los canales 0..n-1 repartidos entre los hosts
+    /live/<i>/index.m3u8?hop=<k> manifiesto del canal i (tras las redirecciones)
+    /live/<i>/seg0.ts            primer segmento (para la verificación profunda)
+
+Uso directo (deja el origen corriendo hasta Ctrl+C):
+    python benchmarks/fake_origin.py [--hosts N] [--latency-ms MS] ...
+"""
+
+import argparse
+import multiprocessing
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+DEFAULTS = {
+    'hosts': 16,
+    'latency_ms': 20,
+    'jitter_ms': 10,
+    'timeout_rate': 0.02,
+    'timeout_s': 4.0,
+    'head_reject_rate': 0.10,
+    'redirect_rate': 0.10,
+    'redirect_hops': 2,
+    'dead_rate': 0.05,
+}
+
+SEGMENT_BYTES = b'\x47' * 188 * 16  # Paquetes TS vacíos
+
+def fraction(channel, salt):
+    """Valor determinista en [0, 1) para decidir el comportamiento de un canal."""
+    return (zlib.crc32(f'{salt}:{channel}'.encode()) & 0xffffffff) / 2 ** 32
+
+def channel_behaviour(channel, config):
+    """Comportamiento del canal: 'timeout', 'dead' u 'ok' (más rechazo de HEAD y saltos)."""
+    if fraction(channel, 'timeout') < config['timeout_rate']:
+        kind = 'timeout'
+    elif fraction(channel, 'dead') < config['dead_rate']:
+        kind = 'dead'
+    else:
+        kind = 'ok'
+    return {
+        'kind': kind,
+        'rejects_head': fraction(channel, 'head') < config['head_reject_rate'],
+        'hops': config['redirect_hops'] if fraction(channel, 'redirect') < config['redirect_rate'] else 0,
+    }
+
+def make_handler(config, base_urls):
+    """Crea la clase manejadora con la configuración y los hosts del origen."""
+
+    class FakeOriginHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def respond(self, status, body=b'', content_type='application/vnd.apple.mpegurl',
+                    headers=None):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(body)
+
+        def delay(self):
+            jitter = config['jitter_ms']
+            latency = config['latency_ms'] + (fraction(self.path, 'jitter') * 2 - 1) * jitter
+            time.sleep(max(0, latency) / 1000)
+
+        def do_HEAD(self):
+            self.handle_request()
+
+        def do_GET(self):
+            self.handle_request()
+
+        def handle_request(self):
+            parts = urlsplit(self.path)
+            segments = parts.path.strip('/').split('/')
+
+            if segments[0] == 'playlist' and len(segments) == 2:
+                size = int(segments[1].split('.')[0])
+                lines = ['#EXTM3U']
+                for channel in range(size):
+                    base = base_urls[channel % len(base_urls)]
+                    lines.append(f'#EXTINF:-1 tvg-id="Bench{channel}.bench" '
+                                 f'group-title="Grupo {channel % 20}",Canal {channel}')
+                    lines.append(f'{base}/live/{channel}/index.m3u8')
+                self.respond(200, '\n'.join(lines).encode(), 'audio/x-mpegurl')
+                return
+
+            if segments[0] != 'live' or len(segments) != 3 or not segments[1].isdigit():
+                self.respond(404)
+                return
+
+            channel = int(segments[1])
+            behaviour = channel_behaviour(channel, config)
+            self.delay()
+
+            if behaviour['kind'] == 'timeout':
+                time.sleep(config['timeout_s'])
+                self.respond(504)
+                return
+            if behaviour['kind'] == 'dead':
+                self.respond(404)
+                return
+            if self.command == 'HEAD' and behaviour['rejects_head']:
+                self.respond(405)
+                return
+
+            hop = int(parse_qs(parts.query).get('hop', ['0'])[0])
+            if segments[2] == 'index.m3u8' and hop < behaviour['hops']:
+                self.respond(302, headers={'Location': f'/live/{channel}/index.m3u8?hop={hop + 1}'})
+            elif segments[2] == 'index.m3u8':
+                manifest = ('#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-TARGETDURATION:6\n'
+                            '#EXTINF:6.0,\nseg0.ts\n')
+                self.respond(200, manifest.encode())
+            else:
+                self.respond(200, SEGMENT_BYTES, 'video/mp2t')
+
+    return FakeOriginHandler
+
+class OriginServer(ThreadingHTTPServer):
+    """Servidor que no imprime los cortes de conexión de clientes que ya hicieron timeout."""
+    daemon_threads = True
+    request_queue_size = 256
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+def serve(config, ready):
+    """Arranca un servidor por host y envía sus URLs base por `ready` (Pipe)."""
+    servers = []
+    for _ in range(config['hosts']):
+        servers.append(OriginServer(('127.0.0.1', 0), BaseHTTPRequestHandler))
+
+    base_urls = [f'http://127.0.0.1:{server.server_address[1]}' for server in servers]
+    handler = make_handler(config, base_urls)
+    for server in servers:
+        server.RequestHandlerClass = handler
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    ready.send(base_urls)
+    ready.close()
+    threading.Event().wait()
+
+class FakeOrigin:
+    """
+    Origen falso en un proceso aparte, para que sus hilos no cuenten en las
+    mediciones de hilos y memoria del proceso medido. Se usa como contexto:
+
+        with FakeOrigin(latency_ms=50) as origin:
+            origin.playlist_url(1000)
+    """
+
+    def __init__(self, **overrides):
+        self.config = {**DEFAULTS, **overrides}
+        self.base_urls = []
+        self.process = None
+
+    def __enter__(self):
+        context = multiprocessing.get_context('spawn')
+        parent, child = context.Pipe(duplex=False)
+        self.process = context.Process(target=serve, args=(self.config, child), daemon=True)
+        self.process.start()
+        self.base_urls = parent.recv()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.join()
+
+    def playlist_url(self, size):
+        return f'{self.base_urls[0]}/playlist/{size}.m3u'
+
+def add_origin_arguments(parser):
+    """Opciones de comportamiento del origen (compartidas con el benchmark)."""
+    group = parser.add_argument_group('origen falso')
+    group.add_argument('--hosts', type=int, default=DEFAULTS['hosts'], help="hosts (puertos) emulados")
+    group.add_argument('--latency-ms', type=float, default=DEFAULTS['latency_ms'], help="latencia por respuesta")
+    group.add_argument('--jitter-ms', type=float, default=DEFAULTS['jitter_ms'], help="variación de la latencia")
+    group.add_argument('--timeout-rate', type=float, default=DEFAULTS['timeout_rate'],
+                       help="fracción de canales que no responden a tiempo")
+    group.add_argument('--timeout-s', type=float, default=DEFAULTS['timeout_s'],
+                       help="espera de los canales que hacen timeout")
+    group.add_argument('--head-reject-rate', type=float, default=DEFAULTS['head_reject_rate'],
+                       help="fracción de canales que responden 405 a HEAD")
+    group.add_argument('--redirect-rate', type=float, default=DEFAULTS['redirect_rate'],
+                       help="fracción de canales con redirecciones")
+    group.add_argument('--redirect-hops', type=int, default=DEFAULTS['redirect_hops'],
+                       help="saltos de cada cadena de redirecciones")
+    group.add_argument('--dead-rate', type=float, default=DEFAULTS['dead_rate'],
+                       help="fracción de canales caídos (404)")
+
+def origin_config(args):
+    """Configuración del origen a partir de los argumentos parseados."""
+    return {key: getattr(args, key) for key in DEFAULTS}
+
+def main():
+    parser = argparse.ArgumentParser(description="Origen IPTV falso para benchmarks")
+    add_origin_arguments(parser)
+    args = parser.parse_args()
+
+    with FakeOrigin(**origin_config(args)) as origin:
+        print(f"📡 Origen falso en {len(origin.base_urls)} hosts, p. ej.: {origin.playlist_url(1000)}")
+        try:
+            origin.process.join()
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == "__main__":
+    main()
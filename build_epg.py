@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Generador de guías EPG (XMLTV) para las listas M3U
+
+Lee en streaming una o más guías XMLTV completas (pueden pesar cientos de MB
+y venir comprimidas con gzip) y conserva solo los canales y programas cuyo
+id aparece como tvg-id en las listas validadas. Por cada lista escribe una
+guía comprimida junto a ella (chile.m3u → chile.xml.gz).
+
+La memoria está acotada: las guías se recorren con iterparse liberando cada
+elemento después de procesarlo, y los programas se vuelcan a disco a medida
+que llegan. Las guías se toman de IPTV_EPG_SOURCES (URLs o rutas separadas
+por espacios o comas) o de los argumentos.
+
+Uso:
+    python build_epg.py [guia1.xml.gz https://.../guia2.xml ...]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+import zlib
+
+import urllib3
+
+import check_m3u
+from check_m3u import (
+    CHANGED_FILES_FILE, DOWNLOAD_TIMEOUT, changed_files, get_session,
+    iter_m3u_channels, local_playlists, make_temp_path, replace_if_changed,
+)
+
+EPG_SOURCES = os.environ.get('IPTV_EPG_SOURCES', '').replace(',', ' ').split()
+EPG_SUFFIX = '.xml.gz'
+GZIP_MAGIC = b'\x1f\x8b'
+# Errores de una guía que solo invalidan esa guía: XML mal formado, gzip
+# truncado o corrupto, y cortes de red a mitad de la descarga (response.raw)
+GUIDE_ERRORS = (ET.ParseError, OSError, EOFError, zlib.error,
+                check_m3u.requests.exceptions.RequestException, urllib3.exceptions.HTTPError)
+
+def epg_path(playlist):
+    """Ruta de la guía que corresponde a una lista (chile.m3u → chile.xml.gz)."""
+    return os.path.splitext(playlist)[0] + EPG_SUFFIX
+
+def build_channel_index(playlists):
+    """
+    Índice {id XMLTV: {listas}} a partir de los tvg-id de las listas. Se
+    indexa el tvg-id completo y también sin el sufijo de señal ("24Horas.cl@SD"
+    → "24Horas.cl"), que es como lo publican la mayoría de las guías.
+    """
+    index = {}
+    for playlist in playlists:
+        with open(playlist, 'r', encoding='utf-8') as f:
+            for channel in iter_m3u_channels(f):
+                if not channel.tvg_id:
+                    continue
+                for channel_id in {channel.tvg_id, channel.tvg_id.split('@')[0]}:
+                    index.setdefault(channel_id, set()).add(playlist)
+    return index
+
+def open_guide(source):
+    """Abre una guía (URL o ruta local) como flujo binario, descomprimiendo gzip si hace falta."""
+    if source.startswith(('http://', 'https://')):
+        response = get_session().get(source, timeout=DOWNLOAD_TIMEOUT, stream=True)
+        response.raise_for_status()
+        response.raw.decode_content = True  # Content-Encoding del servidor
+        stream = response.raw
+    else:
+        stream = open(source, 'rb')
+
+    # Las guías .gz se detectan por contenido, no por extensión
+    buffered = stream if hasattr(stream, 'peek') else _PeekableStream(stream)
+    if buffered.peek(2)[:2] == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=buffered)
+    return buffered
+
+class _PeekableStream:
+    """Envoltorio mínimo que permite mirar los primeros bytes de un flujo sin consumirlos."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._head = b''
+
+    def peek(self, size):
+        if len(self._head) < size:
+            self._head += self._stream.read(size - len(self._head))
+        return self._head
+
+    def read(self, size=-1):
+        if not self._head:
+            return self._stream.read(size)
+        if size is None or size < 0:
+            data, self._head = self._head + self._stream.read(), b''
+            return data
+        data, self._head = self._head[:size], self._head[size:]
+        if len(data) < size:
+            data += self._stream.read(size - len(data))
+        return data
+
+    def close(self):
+        self._stream.close()
+
+class GuideWriter:
+    """
+    Guía de salida de una lista: los <channel> se guardan en memoria (son
+    pocos) y los <programme> se vuelcan a un temporal en disco, porque en
+    XMLTV todos los canales deben ir antes que los programas.
+    """
+
+    def __init__(self, playlist, workdir):
+        self.path = epg_path(playlist)
+        self.channels = []
+        self.channel_ids = set()
+        self.programmes = 0
+        self.sources = set()  # Guías que aportaron canales o programas
+        self._programme_file = tempfile.NamedTemporaryFile(
+            'w+', encoding='utf-8', dir=workdir, suffix='.xml', delete=False
+        )
+
+    def add_channel(self, channel_id, xml):
+        if channel_id not in self.channel_ids:
+            self.channel_ids.add(channel_id)
+            self.channels.append(xml)
+
+    def add_programme(self, xml):
+        self._programme_file.write(xml)
+        self.programmes += 1
+
+    def discard(self):
+        """Descarta lo acumulado sin tocar la guía existente."""
+        self._programme_file.close()
+        os.remove(self._programme_file.name)
+
+    def finish(self):
+        """Escribe la guía comprimida (atómica y solo si cambió). Retorna True si cambió."""
+        self._programme_file.seek(0)
+        temp_path = make_temp_path(self.path)
+        try:
+            # mtime=0: el mismo contenido produce el mismo .gz y no se reescribe
+            with open(temp_path, 'wb') as raw, \
+                    gzip.GzipFile(filename='', mode='wb', fileobj=raw, mtime=0) as gz:
+                gz.write(b'<?xml version="1.0" encoding="UTF-8"?>\n<tv>\n')
+                for xml in self.channels:
+                    gz.write(xml.encode('utf-8'))
+                for chunk in iter(lambda: self._programme_file.read(1 << 16), ''):
+                    gz.write(chunk.encode('utf-8'))
+                gz.write(b'</tv>\n')
+            return replace_if_changed(temp_path, self.path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        finally:
+            self._programme_file.close()
+            os.remove(self._programme_file.name)
+
+def filter_guide(source, index, writers, served_by):
+    """
+    Recorre una guía con iterparse y reparte los canales y programas cuyo id
+    está en `index` entre los `writers` de sus listas. Si un canal ya recibió
+    programas de una guía anterior (`served_by`), se ignoran los de esta para
+    no duplicarlos. Retorna (canales, programas) conservados.
+    """
+    kept_channels = kept_programmes = 0
+    stream = open_guide(source)
+    try:
+        root = None
+        for event, element in ET.iterparse(stream, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = element
+                continue
+            if element.tag == 'channel':
+                channel_id = element.get('id')
+                if channel_id in index:
+                    xml = ET.tostring(element, encoding='unicode')
+                    for playlist in index[channel_id]:
+                        writers[playlist].add_channel(channel_id, xml)
+                        writers[playlist].sources.add(source)
+                    kept_channels += 1
+            elif element.tag == 'programme':
+                channel_id = element.get('channel')
+                if channel_id in index and served_by.setdefault(channel_id, source) == source:
+                    xml = ET.tostring(element, encoding='unicode')
+                    for playlist in index[channel_id]:
+                        writers[playlist].add_programme(xml)
+                        writers[playlist].sources.add(source)
+                    kept_programmes += 1
+            else:
+                continue
+            # Liberar lo ya procesado para mantener la memoria acotada
+            root.clear()
+    finally:
+        stream.close()
+    return kept_channels, kept_programmes
+
+def record_changed_files():
+    """Agrega las guías modificadas a changed_files.json (para el commit del workflow)."""
+    previous = []
+    if os.path.exists(CHANGED_FILES_FILE):
+        with open(CHANGED_FILES_FILE, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+    merged = previous + [path for path in changed_files if path not in previous]
+    with open(CHANGED_FILES_FILE, 'w', encoding='utf-8') as f:
+        json.dump(merged, f, indent=4, ensure_ascii=False)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera guías EPG por lista a partir de guías XMLTV")
+    parser.add_argument('sources', nargs='*', default=EPG_SOURCES,
+                        help="guías XMLTV (URL o ruta, .xml o .xml.gz); por defecto IPTV_EPG_SOURCES")
+    args = parser.parse_args(argv)
+
+    print("=" * 60)
+    print("📅 GENERACIÓN DE GUÍAS EPG")
+    print("=" * 60)
+
+    if not args.sources:
+        print("⚠️  No hay guías configuradas (IPTV_EPG_SOURCES), no se genera EPG")
+        return 0
+
+    playlists = local_playlists()
+    index = build_channel_index(playlists)
+    print(f"📺 {len(index)} ids de canal en {len(playlists)} listas")
+
+    workdir = tempfile.mkdtemp(prefix='epg_')
+    writers = {playlist: GuideWriter(playlist, workdir) for playlist in playlists}
+    served_by = {}
+    failed = set()
+    try:
+        for source in args.sources:
+            print(f"\n🔗 Guía: {source}")
+            try:
+                channels, programmes = filter_guide(source, index, writers, served_by)
+                print(f"   ✅ {channels} canales y {programmes} programas coinciden con las listas")
+            except GUIDE_ERRORS as e:
+                failed.add(source)
+                print(f"   ❌ Error leyendo la guía: {e}")
+
+        print()
+        for playlist, writer in writers.items():
+            if not writer.channel_ids:
+                writer.discard()
+                continue
+            # Una guía cortada a mitad dejaría incompleta la de la lista: se conserva la anterior
+            if writer.sources & failed:
+                writer.discard()
+                print(f"⚠️  {writer.path}: guía de origen incompleta, se conserva la anterior")
+                continue
+            status = "actualizada" if writer.finish() else "sin cambios"
+            print(f"💾 {writer.path}: {len(writer.channel_ids)} canales, "
+                  f"{writer.programmes} programas ({status})")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    record_changed_files()
+    # Los errores de EPG no deben detener la actualización de las listas
+    if failed:
+        print(f"⚠️  {len(failed)} de {len(args.sources)} guías no se pudieron leer")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,37 +1,69 @@
+import argparse
+import gzip
 import os
 import requests
+import hashlib
+import io
 import json
+import queue
+import re
+import sqlite3
+import tempfile
 import threading
+import time
+import unicodedata
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from itertools import zip_longest
+from urllib.parse import parse_qsl, urljoin, urlsplit
 import urllib3
 
+try:
+    from PIL import Image  # Opcional: miniaturas de la caché de logos
+except ImportError:
+    Image = None
+
+try:
+    import brotli  # Opcional: variantes .m3u.br de las listas
+except ImportError:
+    brotli = None
+
 # Silenciar warnings SSL
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 # --- CONFIGURACIÓN Y CONSTANTES ---
 
+# 📌 Listas de países: código ISO (sufijo del tvg-id en iptv-org) → archivo.
+# Agregar un país es agregar una entrada aquí
+COUNTRY_FILES = {
+    'es': 'espana.m3u',
+    'ar': 'Argentina.m3u',
+    'mx': 'mexico.m3u',
+    'co': 'colombia.m3u',
+    'cl': 'chile.m3u',
+    'pe': 'peru.m3u',
+    've': 'venezuela.m3u',
+    'ec': 'ecuador.m3u',
+    'do': 'republicadominicana.m3u',
+    'cu': 'cuba.m3u',
+    'gt': 'guatemala.m3u',
+    'hn': 'honduras.m3u',
+    'sv': 'elsalvador.m3u',
+    'ni': 'nicaragua.m3u',
+    'cr': 'costarica.m3u',
+    'pa': 'panama.m3u',
+    'pr': 'puertorico.m3u',
+    'py': 'paraguay.m3u',
+    'uy': 'uruguay.m3u',
+    'bo': 'bolivia.m3u',
+}
+
 # 📌 Fuentes Remotas de IPTV-ORG para la actualización de listas de países
+COUNTRY_SOURCE_TEMPLATE = 'https://iptv-org.github.io/iptv/countries/{}.m3u'
 COUNTRY_SOURCES = {
-    'https://iptv-org.github.io/iptv/countries/es.m3u': 'espana.m3u',
-    'https://iptv-org.github.io/iptv/countries/ar.m3u': 'Argentina.m3u',
-    'https://iptv-org.github.io/iptv/countries/mx.m3u': 'mexico.m3u',
-    'https://iptv-org.github.io/iptv/countries/co.m3u': 'colombia.m3u',
-    'https://iptv-org.github.io/iptv/countries/cl.m3u': 'chile.m3u',
-    'https://iptv-org.github.io/iptv/countries/pe.m3u': 'peru.m3u',
-    'https://iptv-org.github.io/iptv/countries/ve.m3u': 'venezuela.m3u',
-    'https://iptv-org.github.io/iptv/countries/ec.m3u': 'ecuador.m3u',
-    'https://iptv-org.github.io/iptv/countries/do.m3u': 'republicadominicana.m3u',
-    'https://iptv-org.github.io/iptv/countries/cu.m3u': 'cuba.m3u',
-    'https://iptv-org.github.io/iptv/countries/gt.m3u': 'guatemala.m3u',
-    'https://iptv-org.github.io/iptv/countries/hn.m3u': 'honduras.m3u',
-    'https://iptv-org.github.io/iptv/countries/sv.m3u': 'elsalvador.m3u',
-    'https://iptv-org.github.io/iptv/countries/ni.m3u': 'nicaragua.m3u',
-    'https://iptv-org.github.io/iptv/countries/cr.m3u': 'costarica.m3u',
-    'https://iptv-org.github.io/iptv/countries/pa.m3u': 'panama.m3u',
-    'https://iptv-org.github.io/iptv/countries/pr.m3u': 'puertorico.m3u',
-    'https://iptv-org.github.io/iptv/countries/py.m3u': 'paraguay.m3u',
-    'https://iptv-org.github.io/iptv/countries/uy.m3u': 'uruguay.m3u',
-    'https://iptv-org.github.io/iptv/countries/bo.m3u': 'bolivia.m3u',
+    COUNTRY_SOURCE_TEMPLATE.format(code): filename for code, filename in COUNTRY_FILES.items()
 }
 
 # 📌 Fuente Específica para Cine (Requiere filtro de idioma)
@@ -46,6 +78,18 @@ MUSIC_FILENAME = "musica.m3u"
 RELIGION_SOURCE_URL = "https://iptv-org.github.io/iptv/categories/religion.m3u"
 RELIGION_FILENAME = "religion.m3u"
 
+# 📌 Modo índice único (opcional): en lugar de una descarga por país y por
+# categoría se descarga una sola vez el índice completo de iptv-org y cada
+# canal se reparte por el sufijo de país de su tvg-id (p. ej. "13Rec.cl@SD"
+# → chile.m3u) o su tvg-country, y por categoría según su group-title
+INDEX_SOURCE_URL = "https://iptv-org.github.io/iptv/index.m3u"
+FANOUT_MODE = os.environ.get('IPTV_FANOUT', '0') == '1'
+CATEGORY_SOURCES = {
+    'movies': MOVIES_SOURCE_URL,
+    'music': MUSIC_SOURCE_URL,
+    'religious': RELIGION_SOURCE_URL,
+}
+
 # 📌 Palabras clave MEJORADAS para el filtrado de idioma
 LATIN_KEYWORDS = [
     # Idioma explícito
@@ -78,80 +122,1833 @@ EXCLUDE_KEYWORDS = [
     'tvg-language="en"', 'tvg-language="fr"', 'tvg-language="de"',
 ]
 
+# Códigos de países hispanohablantes para tvg-country / tvg-language
+SPANISH_COUNTRY_CODES = frozenset([
+    'es', 'mx', 'ar', 'co', 'cl', 'pe', 've', 'ec', 'uy', 'py',
+    'bo', 'cr', 'pa', 'gt', 'hn', 'sv', 'ni', 'cu', 'pr', 'do',
+])
+
+def keyword_trie_pattern(keywords):
+    """
+    Expresión regular (sin compilar) con forma de trie para una lista de
+    palabras (prefijos comunes factorizados): coincide con cualquiera.
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{pattern})?' if '' in node else pattern
+    
+    return build(trie)
+
+# Ambas listas de palabras en un solo trie, compilado una vez y recorrido
+# en una sola pasada (ver is_latin_channel); la palabra encontrada dice a
+# qué lista pertenece. Ninguna palabra de una lista contiene a una de la
+# otra, así la coincidencia más larga en una posición no oculta otra
+KEYWORD_PATTERN = re.compile(keyword_trie_pattern(EXCLUDE_KEYWORDS + LATIN_KEYWORDS))
+EXCLUDE_KEYWORD_SET = frozenset(EXCLUDE_KEYWORDS)
+EXTINF_ATTRIBUTE_PATTERN = re.compile(r'([\w-]+)="([^"]*)"')
+# Todo lo anterior a la primera coma fuera de comillas (duración y atributos)
+EXTINF_PREFIX_PATTERN = re.compile(r'(?:[^",]|"[^"]*")*,')
+TVG_ID_COUNTRY_PATTERN = re.compile(r'\.([a-z]{2})(?:@|$)')
+
 TIMEOUT = 3
 HISTORY_FILE = 'channels_history.json'
 CLEANING_HISTORY_FILE = 'cleaning_history.json'
 
-# Variables globales para el multithreading
-url_status_cache = {}
-lock = threading.Lock()
+# Lista de archivos realmente modificados en la ejecución (para Telegram y git)
+CHANGED_FILES_FILE = 'changed_files.json'
+changed_files = []
+
+# Reporte de URLs repetidas entre listas (trabajo y espacio redundante)
+DUPLICATES_REPORT_FILE = 'duplicates_report.json'
+
+# Límite global de validaciones simultáneas (tamaño fijo del pool de hilos).
+# Se puede ajustar con la variable de entorno IPTV_MAX_WORKERS.
+MAX_WORKERS = int(os.environ.get('IPTV_MAX_WORKERS', '50'))
+
+# 📌 Caché persistente del estado de las URLs (entre fases y entre ejecuciones)
+STATE_DB_FILE = os.environ.get('IPTV_STATE_DB', 'iptv_state.db')
+CACHE_TTL_ALIVE = int(os.environ.get('IPTV_CACHE_TTL_ALIVE', str(6 * 3600)))  # segundos
+CACHE_TTL_DEAD = int(os.environ.get('IPTV_CACHE_TTL_DEAD', str(3600)))        # segundos
+CACHE_MAX_AGE = 7 * 24 * 3600  # Entradas más antiguas se eliminan del archivo
+
+# 📌 Descargas de las fuentes remotas (en paralelo y condicionales)
+DOWNLOAD_TIMEOUT = 10
+DOWNLOAD_WORKERS = int(os.environ.get('IPTV_DOWNLOAD_WORKERS', '8'))
+
+# 📌 Modo de verificación profunda HLS (opcional): GET acotado del manifiesto,
+# de la playlist de medios y de un rango de bytes del primer segmento
+DEEP_PROBE = os.environ.get('IPTV_DEEP_PROBE', '0') == '1'
+DEEP_PROBE_BUDGET = float(os.environ.get('IPTV_DEEP_PROBE_BUDGET', '8'))  # segundos por canal
+MANIFEST_MAX_BYTES = 256 * 1024
+SEGMENT_PROBE_BYTES = 64 * 1024
+
+# 📌 Límite de peticiones simultáneas por host y circuit breaker: tras
+# BREAKER_THRESHOLD fallos de conexión seguidos, el resto de URLs del host
+# se marcan como caídas sin verificarlas
+MAX_PER_HOST = int(os.environ.get('IPTV_MAX_PER_HOST', '4'))
+BREAKER_THRESHOLD = int(os.environ.get('IPTV_BREAKER_THRESHOLD', '5'))
+
+# 📌 Modo pipeline (opcional): las fuentes remotas se leen en streaming y
+# cada canal que pasa el filtro entra a validación mientras se sigue
+# descargando el resto de la lista
+STREAMING_PIPELINE = os.environ.get('IPTV_STREAMING', '0') == '1'
+
+# 📌 Latencia: ordenar cada lista (dentro de su group-title) por el tiempo
+# hasta el primer byte medido, y/o descartar canales por encima de un umbral
+SORT_BY_LATENCY = os.environ.get('IPTV_SORT_BY_LATENCY', '0') == '1'
+MAX_LATENCY_MS = int(os.environ.get('IPTV_MAX_LATENCY_MS', '0'))  # 0 = sin límite
+LATENCY_STATS_FILE = 'latency_stats.json'
+
+# 📌 Histéresis de fallos: un canal que estuvo vivo solo se elimina tras
+# FAILURE_THRESHOLD ejecuciones seguidas caído (conteos en STATE_DB_FILE).
+# Las URLs caídas se reintentan al final de la ejecución con espera creciente
+FAILURE_THRESHOLD = int(os.environ.get('IPTV_FAILURE_THRESHOLD', '3'))
+RETRY_ATTEMPTS = int(os.environ.get('IPTV_RETRY_ATTEMPTS', '2'))
+RETRY_BACKOFF = float(os.environ.get('IPTV_RETRY_BACKOFF', '5'))  # segundos, se duplica en cada intento
+
+# 📌 Presupuesto de tiempo de la ejecución (segundos, 0 = sin límite). Al
+# agotarse, las URLs pendientes no se verifican y conservan su estado previo
+RUN_BUDGET = int(os.environ.get('IPTV_RUN_BUDGET', '0'))
+
+# 📌 Métricas de la ejecución (tiempos por fase, archivo y host; contadores)
+METRICS_FILE = 'run_metrics.json'
+PROMETHEUS_FILE = os.environ.get('IPTV_PROMETHEUS_FILE', 'iptv_metrics.prom')
+PROMETHEUS_MAX_HOSTS = 20  # Solo los hosts más lentos, para acotar las series
+
+# 📌 Redirecciones: de cada URL que redirige se guarda la cadena y el destino
+# final, vigente REDIRECT_TTL segundos. Con IPTV_REWRITE_REDIRECTS=1 las listas
+# se escriben con el destino final si es estable (el mismo en dos
+# verificaciones seguidas y sin parámetros de token/firma); la URL original
+# queda en STATE_DB_FILE y es la que se vuelve a verificar
+REWRITE_REDIRECTS = os.environ.get('IPTV_REWRITE_REDIRECTS', '0') == '1'
+REDIRECT_TTL = int(os.environ.get('IPTV_REDIRECT_TTL', str(24 * 3600)))  # segundos
+TOKEN_QUERY_KEYS = frozenset([
+    'token', 'access_token', 'auth', 'auth_key', 'key', 'sig', 'signature', 'hash',
+    'expires', 'exp', 'e', 'st', 'md5', 'hdnts', 'hdnea', 'wmsauthsign', 'policy',
+    'key-pair-id', 'session', 'sessionid', 'sid', 'uid', 'acl',
+])
+TOKEN_SEGMENT_PATTERN = re.compile(r'^[A-Za-z0-9_\-=.~]{32,}$')
+
+# 📌 Streams equivalentes (opcional): las URLs que apuntan al mismo stream
+# (misma URL normalizada, mismo destino de redirección o misma huella del
+# manifiesto maestro) se verifican a través de un solo representante y cada
+# lista conserva solo el miembro vivo más rápido. No aplica al modo pipeline
+STREAM_DEDUP = os.environ.get('IPTV_STREAM_DEDUP', '0') == '1'
+STREAM_GROUP_FALLBACKS = 2  # Miembros extra a probar si el representante está caído
+# Nombres de manifiesto intercambiables (…/canal/index.m3u8 ≡ …/canal/playlist.m3u8)
+STREAM_ALIAS_NAMES = frozenset(['index.m3u8', 'playlist.m3u8', 'master.m3u8', 'chunklist.m3u8'])
+
+# 📌 Salidas derivadas (opcional): junto a cada lista se escriben sus variantes
+# comprimidas (.m3u.gz y .m3u.br si está instalado brotli), una lista por
+# group-title en GROUPS_DIR/<lista>/ y un índice JSON compacto de todos los
+# canales con su posición en bytes dentro de la lista (CHANNEL_INDEX_FILE)
+DERIVED_OUTPUTS = os.environ.get('IPTV_DERIVED_OUTPUTS', '0') == '1'
+CHANNEL_INDEX_FILE = 'channels_index.json'
+GROUPS_DIR = 'groups'
+
+# 📌 Historial por canal (tablas runs/observations en STATE_DB_FILE)
+HISTORY_RUNS_KEPT = int(os.environ.get('IPTV_HISTORY_RUNS', '60'))  # ~30 días a 2 ejecuciones/día
+
+# 📌 Caché de logos (opcional): cada tvg-logo se descarga una vez (luego con
+# peticiones condicionales), se guarda en LOGO_DIR con el hash de su
+# contenido como nombre (reducido a LOGO_SIZE px si Pillow está instalado) y
+# el tvg-logo se reescribe hacia esa copia: LOGO_BASE_URL + ruta (p. ej. la
+# URL raw del repositorio) o la ruta relativa si no hay URL base
+LOGO_CACHE = os.environ.get('IPTV_LOGO_CACHE', '0') == '1'
+LOGO_DIR = os.environ.get('IPTV_LOGO_DIR', 'logos')
+LOGO_BASE_URL = os.environ.get('IPTV_LOGO_BASE_URL', '')
+LOGO_SIZE = int(os.environ.get('IPTV_LOGO_SIZE', '256'))
+LOGO_MAX_BYTES = 2 * 1024 * 1024
+
+# Una sesión HTTP por hilo del pool para reutilizar conexiones
+_thread_local = threading.local()
 
 # --- FUNCIONES DE UTILIDAD Y VALIDACIÓN ---
 
+def get_session():
+    """Retorna la sesión HTTP del hilo actual (la crea si no existe)."""
+    session = getattr(_thread_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        session.verify = False  # Evitar errores SSL
+        _thread_local.session = session
+    return session
+
+class ProbeResult:
+    """
+    Resultado de verificar una URL.
+    
+    `stage` es la última etapa que respondió bien ('head', 'manifest',
+    'playlist' o 'segment') y `timings` guarda la latencia en milisegundos
+    de cada etapa intentada. `ttfb_ms` es el tiempo hasta recibir la
+    respuesta final (incluidas las redirecciones), `redirects` cuántas hubo,
+    `redirect_chain` las URLs recorridas tras la original (la última es el
+    destino final) y `status_code` el código final. `fingerprint` es la
+    huella del manifiesto maestro (verificación profunda) y
+    `equivalent_of`, si no es None, indica que la URL no se verificó: el
+    resultado es el de ese representante equivalente (ver STREAM_DEDUP).
+    """
+    __slots__ = ('url', 'alive', 'status_code', 'stage', 'error', 'timings',
+                 'ttfb_ms', 'redirects', 'redirect_chain', 'fingerprint', 'equivalent_of')
+    
+    def __init__(self, url, alive=False, status_code=None, stage=None, error=None, timings=None,
+                 ttfb_ms=None, redirects=0, redirect_chain=None, fingerprint=None,
+                 equivalent_of=None):
+        self.url = url
+        self.alive = alive
+        self.status_code = status_code
+        self.stage = stage
+        self.error = error
+        self.timings = timings if timings is not None else {}
+        self.ttfb_ms = ttfb_ms
+        self.redirects = redirects
+        self.redirect_chain = redirect_chain if redirect_chain is not None else []
+        self.fingerprint = fingerprint
+        self.equivalent_of = equivalent_of
+    
+    @property
+    def final_url(self):
+        """URL a la que terminó respondiendo la verificación (la original si no hubo redirecciones)."""
+        return self.redirect_chain[-1] if self.redirect_chain else self.url
+    
+    def __repr__(self):
+        return f"ProbeResult({self.url!r}, alive={self.alive}, stage={self.stage!r}, error={self.error!r})"
+    
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+def read_bounded(response, max_bytes, deadline=None):
+    """Lee como máximo `max_bytes` del cuerpo, cortando si se pasa `deadline`."""
+    data = bytearray()
+    try:
+        for chunk in response.iter_content(chunk_size=8192):
+            data.extend(chunk)
+            if len(data) >= max_bytes or (deadline and time.monotonic() > deadline):
+                break
+    finally:
+        response.close()
+        run_metrics.count('bytes_downloaded', len(data))
+    return bytes(data[:max_bytes])
+
+def redirect_chain(response):
+    """URLs recorridas tras la petición original hasta la respuesta final ([] sin redirecciones)."""
+    if not response.history:
+        return []
+    return [hop.url for hop in response.history[1:]] + [response.url]
+
+def is_token_url(url):
+    """
+    True si la URL parece firmada o de sesión (parámetros como token,
+    expires o hdnts, o segmentos largos aleatorios): esos destinos caducan y
+    no deben escribirse en las listas.
+    """
+    parts = urlsplit(url)
+    if any(key.lower() in TOKEN_QUERY_KEYS for key, _ in parse_qsl(parts.query, keep_blank_values=True)):
+        return True
+    return any(TOKEN_SEGMENT_PATTERN.match(segment) for segment in parts.path.split('/'))
+
 def check_url_status(url):
     """
     Verifica el estado de una URL usando timeout de 3 segundos.
-    Utiliza caché para no verificar la misma URL varias veces.
-    """
-    with lock:
-        if url in url_status_cache:
-            return url_status_cache[url]
     
+    Usa HEAD; si el servidor lo rechaza (405/501) se intenta un GET
+    acotado, porque muchos orígenes HLS no implementan HEAD.
+    """
+    result = ProbeResult(url, stage=None)
+    start = time.monotonic()
     try:
-        response = requests.head(
+        response = get_session().head(
             url, 
             timeout=TIMEOUT, 
-            allow_redirects=True,
-            verify=False  # Evitar errores SSL
+            allow_redirects=True
         )
-        is_valid = response.status_code < 400
+        if response.status_code in (405, 501):
+            response = get_session().get(url, timeout=TIMEOUT, stream=True)
+            result.ttfb_ms = round((time.monotonic() - start) * 1000)
+            read_bounded(response, 1024)
+        else:
+            result.ttfb_ms = round((time.monotonic() - start) * 1000)
+        result.redirects = len(response.history)
+        result.redirect_chain = redirect_chain(response)
+        result.status_code = response.status_code
+        result.alive = response.status_code < 400
+        if result.alive:
+            result.stage = 'head'
+        else:
+            result.error = 'http'
+    except requests.exceptions.Timeout:
+        result.error = 'timeout'
+    except requests.exceptions.RequestException:
+        result.error = 'connection'
+    result.timings['head'] = round((time.monotonic() - start) * 1000)
+    return result
+
+def parse_hls_playlist(text, base_url):
+    """
+    Analiza una playlist HLS y retorna (tipo, uri) donde tipo es 'master'
+    (uri = variante de menor ancho de banda), 'media' (uri = primer segmento)
+    o None si el contenido no es HLS.
+    """
+    lines = [line.strip() for line in text.splitlines()]
+    if not lines or not lines[0].startswith('#EXTM3U'):
+        return None, None
+    
+    variants = []
+    first_segment = None
+    bandwidth = None
+    for line in lines:
+        if line.startswith('#EXT-X-STREAM-INF'):
+            bandwidth = 0
+            for attribute in line.split(':', 1)[-1].split(','):
+                if attribute.startswith('BANDWIDTH='):
+                    try:
+                        bandwidth = int(attribute.split('=', 1)[1])
+                    except ValueError:
+                        pass
+        elif line and not line.startswith('#'):
+            if bandwidth is not None:
+                variants.append((bandwidth, urljoin(base_url, line)))
+                bandwidth = None
+            elif first_segment is None:
+                first_segment = urljoin(base_url, line)
+    
+    if variants:
+        return 'master', min(variants)[1]
+    if first_segment:
+        return 'media', first_segment
+    return 'media', None
+
+def deep_probe_url(url):
+    """
+    Verificación profunda de un canal HLS con lecturas acotadas.
+    
+    1. GET del manifiesto (máximo MANIFEST_MAX_BYTES).
+    2. Si es una playlist maestra, GET de la variante de menor bitrate.
+    3. GET con Range de los primeros SEGMENT_PROBE_BYTES del primer segmento.
+    
+    Todo el canal comparte un presupuesto de DEEP_PROBE_BUDGET segundos. El
+    canal solo se considera vivo si el segmento responde; `stage` permite
+    distinguir "manifiesto vivo, segmentos caídos" de un stream sano.
+    """
+    result = ProbeResult(url)
+    deadline = time.monotonic() + DEEP_PROBE_BUDGET
+    session = get_session()
+    
+    def fetch(stage, target, max_bytes, headers=None):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise requests.exceptions.Timeout(f"presupuesto agotado en {stage}")
+        start = time.monotonic()
+        try:
+            response = session.get(target, timeout=min(TIMEOUT, remaining),
+                                   stream=True, headers=headers)
+            if stage == 'manifest':
+                result.ttfb_ms = round((time.monotonic() - start) * 1000)
+                result.redirects = len(response.history)
+                result.redirect_chain = redirect_chain(response)
+            result.status_code = response.status_code
+            if response.status_code >= 400:
+                response.close()
+                return None, response.url
+            return read_bounded(response, max_bytes, deadline), response.url
+        finally:
+            result.timings[stage] = round((time.monotonic() - start) * 1000)
+    
+    try:
+        body, final_url = fetch('manifest', url, MANIFEST_MAX_BYTES)
+        if body is None:
+            result.error = 'http'
+            return result
+        result.stage = 'manifest'
+        
+        kind, next_uri = parse_hls_playlist(body.decode('utf-8', 'replace'), final_url)
+        if kind is None:
+            # No es HLS (p. ej. un stream directo): basta con haber recibido datos
+            result.alive = bool(body)
+            if not body:
+                result.error = 'empty'
+            return result
+        
+        if kind == 'master':
+            result.fingerprint = manifest_fingerprint(body.decode('utf-8', 'replace'), final_url)
+            body, final_url = fetch('playlist', next_uri, MANIFEST_MAX_BYTES)
+            if body is None:
+                result.error = 'http'
+                return result
+            result.stage = 'playlist'
+            kind, next_uri = parse_hls_playlist(body.decode('utf-8', 'replace'), final_url)
+        
+        if not next_uri:
+            result.error = 'no_segments'
+            return result
+        
+        range_header = {'Range': f"bytes=0-{SEGMENT_PROBE_BYTES - 1}"}
+        body, _ = fetch('segment', next_uri, SEGMENT_PROBE_BYTES, headers=range_header)
+        if not body:
+            result.error = 'segment'
+            return result
+        result.stage = 'segment'
+        result.alive = True
+    except requests.exceptions.Timeout:
+        result.error = 'timeout'
     except requests.exceptions.RequestException:
-        is_valid = False
+        result.error = 'connection'
+    return result
+
+def probe_url(url):
+    """Verifica una URL con el modo configurado (HEAD o verificación profunda)."""
+    return deep_probe_url(url) if DEEP_PROBE else check_url_status(url)
+
+# --- STREAMS EQUIVALENTES ---
+
+def normalize_stream_url(url):
+    """
+    Forma canónica de una URL de stream para detectar equivalentes: sin
+    esquema ni puerto por defecto, host en minúsculas, sin parámetros de
+    token (TOKEN_QUERY_KEYS) y sin el nombre del manifiesto si es uno de
+    los intercambiables (STREAM_ALIAS_NAMES).
+    """
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or '').lower()
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if port and port not in (80, 443):
+        host = f"{host}:{port}"
+    path = re.sub(r'/{2,}', '/', parts.path) or '/'
+    directory, _, name = path.rpartition('/')
+    if name.lower() in STREAM_ALIAS_NAMES:
+        path = directory + '/'
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if key.lower() not in TOKEN_QUERY_KEYS)
+    return host + path + ('?' + '&'.join(f"{key}={value}" for key, value in query) if query else '')
+
+def manifest_fingerprint(text, base_url):
+    """
+    Huella de una playlist HLS maestra: hash de sus variantes resueltas y
+    normalizadas. Dos URLs cuyo maestro lleva a las mismas variantes sirven
+    el mismo stream. Retorna None si no hay variantes.
+    """
+    variants = set()
+    expect_uri = False
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-STREAM-INF'):
+            expect_uri = True
+        elif expect_uri and line and not line.startswith('#'):
+            variants.add(normalize_stream_url(urljoin(base_url, line)))
+            expect_uri = False
+    if not variants:
+        return None
+    return hashlib.sha1('\n'.join(sorted(variants)).encode('utf-8')).hexdigest()[:16]
+
+def stream_keys(url, cache=None, url_status=None):
+    """
+    Claves de identidad de una URL: normalizada, destino de redirección y
+    huella del manifiesto. Una URL caída solo tiene su clave normalizada:
+    canales distintos pueden caer en la misma página o stream de "fuera
+    de línea" sin ser el mismo stream.
+    """
+    result = url_status.get(url) if url_status else None
+    keys = [normalize_stream_url(url)]
+    if result is not None and not result.alive:
+        return keys
+    
+    target = None
+    if result is not None and result.redirect_chain:
+        target = result.final_url
+    elif cache and url in cache.redirects:
+        target = cache.redirects[url][0]
+    if target:
+        keys.append(normalize_stream_url(target))
+    
+    fingerprint = result.fingerprint if result is not None else None
+    if not fingerprint and cache:
+        fingerprint = cache.fingerprints.get(url)
+    if fingerprint:
+        keys.append('manifest:' + fingerprint)
+    return keys
+
+def stream_groups(urls, cache=None, url_status=None):
+    """
+    Agrupa las URLs equivalentes (comparten alguna clave de stream_keys,
+    de forma transitiva). Retorna listas de URLs en orden de aparición.
+    """
+    urls = list(dict.fromkeys(urls))
+    parent = list(range(len(urls)))
+    
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    
+    owners = {}
+    for i, url in enumerate(urls):
+        for key in stream_keys(url, cache, url_status):
+            if key not in owners:
+                owners[key] = i
+                continue
+            a, b = find(i), find(owners[key])
+            parent[max(a, b)] = min(a, b)
+    
+    groups = {}
+    for i, url in enumerate(urls):
+        groups.setdefault(find(i), []).append(url)
+    return list(groups.values())
+
+def equivalent_result(url, representative):
+    """Resultado de una URL no verificada, tomado de su representante equivalente."""
+    data = representative.to_dict()
+    data.update(url=url, timings={}, ttfb_ms=None, redirects=0, redirect_chain=[],
+                fingerprint=None, equivalent_of=representative.url)
+    return ProbeResult.from_dict(data)
+
+# --- PLANIFICADOR POR HOST ---
+
+def url_host(url):
+    """Retorna 'host[:puerto]' (en minúsculas) de una URL, o '' si no es válida."""
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or '').lower()
+        return f"{host}:{parts.port}" if parts.port else host
+    except ValueError:
+        return ''
+
+def interleave_by_host(urls):
+    """
+    Reordena las URLs alternando hosts (round-robin), para que los hilos del
+    pool no queden todos esperando el límite de un mismo host.
+    """
+    buckets = {}
+    for url in urls:
+        buckets.setdefault(url_host(url), []).append(url)
+    ordered = []
+    for group in zip_longest(*buckets.values()):
+        ordered.extend(url for url in group if url is not None)
+    return ordered
+
+def probe_order(urls, cache=None):
+    """
+    Orden de verificación: por nivel de prioridad (UrlStatusCache.priority_tiers)
+    y, solo dentro de cada nivel, alternando hosts; así alternar hosts no
+    adelanta URLs de poco valor a las nunca verificadas o que están fallando.
+    """
+    if not cache:
+        return interleave_by_host(urls)
+    return [url for tier in cache.priority_tiers(urls) for url in interleave_by_host(tier)]
+
+class HostScheduler:
+    """
+    Limita las peticiones en curso por host y aplica un circuit breaker.
+    
+    Tras `failure_threshold` fallos de conexión o timeouts consecutivos en un
+    host, el breaker se abre y el resto de URLs de ese host fallan de
+    inmediato con error 'circuit_open'. Lleva además estadísticas por host
+    para el resumen de la ejecución.
+    """
+    
+    def __init__(self, max_per_host=MAX_PER_HOST, failure_threshold=BREAKER_THRESHOLD):
+        self.max_per_host = max_per_host
+        self.failure_threshold = failure_threshold
+        self.reset()
+    
+    def reset(self):
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self.stats = {}
+    
+    def _host_state(self, host):
+        with self._lock:
+            if host not in self.stats:
+                self._semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+                self.stats[host] = {
+                    'probes': 0,
+                    'alive': 0,
+                    'dead': 0,
+                    'skipped': 0,
+                    'consecutive_failures': 0,
+                    'tripped': False,
+                    'timeouts': 0,
+                    'probe_seconds': 0.0,
+                    'max_ms': 0,
+                }
+            return self._semaphores[host], self.stats[host]
+    
+    def run(self, url, probe):
+        """Ejecuta `probe(url)` respetando el límite y el breaker del host."""
+        host = url_host(url)
+        semaphore, stats = self._host_state(host)
+        
+        with semaphore:
+            if stats['tripped']:
+                with self._lock:
+                    stats['skipped'] += 1
+                return ProbeResult(url, error='circuit_open')
+            if run_deadline.expired():
+                return ProbeResult(url, error='deadline')
+            start = time.monotonic()
+            result = probe(url)
+            elapsed = time.monotonic() - start
+        
+        with self._lock:
+            stats['probes'] += 1
+            stats['alive' if result.alive else 'dead'] += 1
+            stats['probe_seconds'] += elapsed
+            stats['max_ms'] = max(stats['max_ms'], int(elapsed * 1000))
+            if result.error == 'timeout':
+                stats['timeouts'] += 1
+            if result.error in ('timeout', 'connection'):
+                stats['consecutive_failures'] += 1
+                if stats['consecutive_failures'] >= self.failure_threshold:
+                    stats['tripped'] = True
+            else:
+                stats['consecutive_failures'] = 0
+        return result
+    
+    def add_stats(self, stats):
+        """
+        Suma las estadísticas por host de otro planificador (los shards) a
+        las de esta ejecución, solo para el resumen y las métricas: el
+        estado de los breakers no se copia.
+        """
+        for host, other in stats.items():
+            _, own = self._host_state(host)
+            with self._lock:
+                for key in ('probes', 'alive', 'dead', 'skipped', 'timeouts', 'probe_seconds'):
+                    own[key] += other[key]
+                own['max_ms'] = max(own['max_ms'], other['max_ms'])
+    
+    def half_open(self):
+        """Rearma los breakers abiertos para dar otra oportunidad a sus hosts (reintentos)."""
+        with self._lock:
+            for stats in self.stats.values():
+                stats['tripped'] = False
+                stats['consecutive_failures'] = 0
+    
+    def unhealthy_hosts(self, limit=10):
+        """Hosts con breaker abierto o con fallos, ordenados por gravedad."""
+        hosts = [
+            (host, stats) for host, stats in self.stats.items()
+            if stats['tripped'] or stats['dead']
+        ]
+        hosts.sort(key=lambda item: (not item[1]['tripped'], -(item[1]['dead'] + item[1]['skipped'])))
+        return hosts[:limit]
+
+# Planificador compartido por todas las validaciones de la ejecución
+host_scheduler = HostScheduler()
+
+class RunDeadline:
+    """Fecha límite global de la ejecución (RUN_BUDGET segundos desde start())."""
+    
+    def __init__(self):
+        self.start(0)
+    
+    def start(self, budget):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget if budget else None
+    
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+    
+    def remaining(self):
+        """Segundos restantes, o None si no hay límite."""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+run_deadline = RunDeadline()
+
+def keep_previous_status(result, cache=None):
+    """
+    Si la URL quedó sin verificar por la fecha límite, conserva su último
+    estado conocido en `cache` (aunque esté vencido). Sin estado previo se
+    conserva solo si ya estaba publicada en una lista local (un canal no se
+    elimina por falta de tiempo); una URL nueva espera a ser verificada.
+    """
+    if result.error == 'deadline':
+        previous = cache.last_known.get(result.url) if cache else None
+        if previous is not None:
+            result.alive = previous[0]
+        else:
+            result.alive = bool(cache) and result.url in cache.local_urls
+    return result
+
+# --- MÉTRICAS DE LA EJECUCIÓN ---
+
+def prometheus_label(value):
+    """Escapa un valor de etiqueta para el formato de texto de Prometheus."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class RunMetrics:
+    """
+    Instrumentación de una ejecución: duración de cada fase y de cada
+    archivo, contadores (aciertos de caché, bytes descargados, ...) y, al
+    exportar, las estadísticas por host del planificador. Se guarda como
+    JSON (METRICS_FILE) y como textfile de Prometheus (PROMETHEUS_FILE).
+    """
+    
+    def __init__(self):
+        self.reset()
+    
+    def reset(self):
+        self._lock = threading.Lock()
+        self.started_at = datetime.now()
+        self._start = time.monotonic()
+        self.phases = {}
+        self.files = {}
+        self.counters = {'cache_hits': 0, 'bytes_downloaded': 0}
+    
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+    
+    def record_phase(self, name, seconds):
+        """Suma la duración de una fase (se acumula si se repite)."""
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0) + seconds
+    
+    @contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_phase(name, time.monotonic() - start)
+    
+    def record_file(self, filename, phase, seconds):
+        with self._lock:
+            self.files.setdefault(filename, {})[phase] = round(seconds, 3)
+    
+    @contextmanager
+    def file(self, filename, phase):
+        """Mide el tiempo dedicado a un archivo dentro de una fase."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_file(filename, phase, time.monotonic() - start)
+    
+    def host_summary(self, scheduler):
+        """Estadísticas por host con latencia media, de más lento a más rápido."""
+        hosts = {}
+        for host, stats in scheduler.stats.items():
+            probes = stats['probes']
+            hosts[host] = {
+                'probes': probes,
+                'alive': stats['alive'],
+                'dead': stats['dead'],
+                'skipped': stats['skipped'],
+                'timeouts': stats['timeouts'],
+                'avg_ms': int(stats['probe_seconds'] * 1000 / probes) if probes else None,
+                'max_ms': stats['max_ms'],
+                'tripped': stats['tripped'],
+            }
+        return dict(sorted(hosts.items(), key=lambda item: -(item[1]['avg_ms'] or 0)))
+    
+    def snapshot(self, scheduler):
+        hosts = self.host_summary(scheduler)
+        return {
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'duration_s': round(time.monotonic() - self._start, 3),
+            'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            'files': self.files,
+            'counters': {
+                **self.counters,
+                'probes': sum(h['probes'] for h in hosts.values()),
+                'timeouts': sum(h['timeouts'] for h in hosts.values()),
+                'circuit_open': sum(h['skipped'] for h in hosts.values()),
+                'hosts': len(hosts),
+            },
+            'hosts': hosts,
+        }
+    
+    def to_prometheus(self, snapshot, max_hosts=PROMETHEUS_MAX_HOSTS):
+        """Formato de texto de Prometheus (para el textfile collector de node_exporter)."""
+        lines = []
+        
+        def metric(name, help_text, samples):
+            lines.append(f"# HELP iptv_{name} {help_text}")
+            lines.append(f"# TYPE iptv_{name} gauge")
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{prometheus_label(v)}"' for k, v in labels.items())
+                lines.append(f"iptv_{name}{{{label_text}}} {value}" if label_text else f"iptv_{name} {value}")
+        
+        metric('run_start_timestamp_seconds', "Inicio de la última ejecución",
+               [({}, int(self.started_at.timestamp()))])
+        metric('run_duration_seconds', "Duración total de la ejecución",
+               [({}, snapshot['duration_s'])])
+        metric('phase_duration_seconds', "Duración de cada fase",
+               [({'phase': name}, seconds) for name, seconds in snapshot['phases'].items()])
+        metric('file_duration_seconds', "Tiempo dedicado a cada archivo por fase",
+               [({'file': filename, 'phase': phase}, seconds)
+                for filename, phases in snapshot['files'].items() for phase, seconds in phases.items()])
+        for name, value in snapshot['counters'].items():
+            metric(f'run_{name}', f"Contador '{name}' de la ejecución", [({}, value)])
+        slowest = [(host, h) for host, h in snapshot['hosts'].items() if h['avg_ms'] is not None][:max_hosts]
+        metric('host_probe_avg_milliseconds', "Latencia media de verificación (hosts más lentos)",
+               [({'host': host}, h['avg_ms']) for host, h in slowest])
+        metric('host_probes', "Verificaciones por host (hosts más lentos)",
+               [({'host': host}, h['probes']) for host, h in slowest])
+        metric('host_timeouts', "Timeouts por host (hosts más lentos)",
+               [({'host': host}, h['timeouts']) for host, h in slowest])
+        return '\n'.join(lines) + '\n'
+    
+    def save(self, scheduler, json_path=METRICS_FILE, prometheus_path=PROMETHEUS_FILE):
+        """Escribe las métricas en JSON y en formato Prometheus; retorna el resumen."""
+        snapshot = self.snapshot(scheduler)
+        try:
+            # Archivos ignorados por git: no deben llegar a changed_files.json
+            write_file_atomic(json_path, json.dumps(snapshot, indent=4, ensure_ascii=False), track=False)
+            if prometheus_path:
+                write_file_atomic(prometheus_path, self.to_prometheus(snapshot), track=False)
+        except Exception as e:
+            print(f"❌ Error al guardar las métricas: {e}")
+        return snapshot
+
+# Métricas compartidas por toda la ejecución
+run_metrics = RunMetrics()
+
+def validate_urls(urls, cache=None, max_workers=None):
+    """
+    Valida un conjunto de URLs con un pool fijo de hilos.
+    
+    Cada URL única se verifica una sola vez y nunca hay más de
+    `max_workers` peticiones en curso, sin importar el tamaño de la lista,
+    ni más de MAX_PER_HOST sobre un mismo host (ver HostScheduler).
+    Si se pasa un `UrlStatusCache`, solo se verifican las URLs cuyo
+    resultado guardado está vencido, y los nuevos resultados se persisten.
+    
+    Las pendientes se verifican por orden de valor (ver probe_order),
+    así, si se alcanza la fecha límite de la ejecución, lo que quede sin
+    verificar es lo menos urgente; esas URLs
+    conservan su estado previo (keep_previous_status).
+    Retorna un diccionario {url: ProbeResult}.
+    """
+    unique_urls = list(dict.fromkeys(urls))
+    if not unique_urls:
+        return {}
+    
+    results = cache.get_fresh(unique_urls) if cache else {}
+    run_metrics.count('cache_hits', len(results))
+    pending = probe_order([url for url in unique_urls if url not in results], cache)
+    if results:
+        print(f"   ♻️  {len(results)} URLs desde caché, {len(pending)} por verificar")
+    if not pending:
+        # También cuentan para la histéresis (p. ej. todo viene de los shards)
+        if cache:
+            cache.note_run_results(results)
+        return results
+    
+    if STREAM_DEDUP:
+        probed = probe_representatives(unique_urls, pending, results, cache, max_workers)
+    else:
+        probed = probe_batch(pending, max_workers)
+    
+    record_probe_results({url: r for url, r in probed.items() if r.equivalent_of is None}, cache)
+    for result in probed.values():
+        keep_previous_status(result, cache)
+    results.update(probed)
+    if cache:
+        cache.note_run_results(results)
+    return results
+
+def probe_batch(urls, max_workers=None):
+    """Verifica `urls` con un pool fijo de hilos a través del planificador por host."""
+    workers = min(max_workers or MAX_WORKERS, len(urls))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(urls, executor.map(scheduled_probe, urls)))
+
+def stream_speed(result):
+    """Clave de orden de un resultado: primero los vivos y medidos, de menor a mayor latencia."""
+    return (not result.alive, result.equivalent_of is not None, result.ttfb_ms is None,
+            result.ttfb_ms or 0)
+
+def probe_representatives(unique_urls, pending, results, cache=None, max_workers=None):
+    """
+    Verifica las URLs pendientes por grupo de streams equivalentes
+    (stream_groups): si un miembro ya tiene un resultado vivo vigente no se
+    verifica ninguno; si no, se verifica un representante (el que estuvo
+    vivo la última vez) y, solo si está caído, hasta STREAM_GROUP_FALLBACKS
+    miembros más, de a uno por grupo en cada ronda. El resto de miembros
+    recibe el resultado del mejor verificado (equivalent_result).
+    `pending` debe venir ordenada por prioridad. Retorna {url: ProbeResult}.
+    """
+    priority = {url: i for i, url in enumerate(pending)}
+    last_known = cache.last_known if cache else {}
+    probed = {}
+    contested = []
+    for group in stream_groups(unique_urls, cache, results):
+        members = [url for url in group if url in priority]
+        if not members:
+            continue
+        alive = [results[url] for url in group if url in results and results[url].alive]
+        if alive:
+            best = min(alive, key=stream_speed)
+            probed.update((url, equivalent_result(url, best)) for url in members)
+        else:
+            members.sort(key=lambda url: (not last_known.get(url, (False,))[0], priority[url]))
+            contested.append(members)
+    
+    unresolved = contested
+    for attempt in range(1 + STREAM_GROUP_FALLBACKS):
+        batch = [members[attempt] for members in unresolved if attempt < len(members)]
+        if not batch:
+            break
+        probed.update(probe_batch(probe_order(batch, cache), max_workers))
+        unresolved = [members for members in unresolved
+                      if attempt + 1 < len(members) and not probed[members[attempt]].alive]
+    
+    for members in contested:
+        measured = [probed[url] for url in members if url in probed]
+        alive = [result for result in measured if result.alive]
+        best = min(alive, key=stream_speed) if alive else measured[-1]
+        for url in members:
+            if url not in probed:
+                probed[url] = equivalent_result(url, best)
+    skipped = sum(1 for result in probed.values() if result.equivalent_of)
+    if skipped:
+        run_metrics.count('equivalent_skipped', skipped)
+        print(f"   👥 {skipped} URLs equivalentes a otras no se verifican")
+    return probed
+
+def retry_failed_urls(url_status, cache=None, attempts=RETRY_ATTEMPTS, backoff=RETRY_BACKOFF):
+    """
+    Cola de reintentos de fin de ejecución: vuelve a verificar, sin pasar
+    por la caché, las URLs caídas de `url_status`, esperando `backoff`
+    segundos (el doble en cada intento) para superar fallos transitorios.
+    Actualiza `url_status` en el lugar y retorna cuántas URLs se recuperaron.
+    """
+    recovered = 0
+    for attempt in range(attempts):
+        failed = [url for url, result in url_status.items() if not result.alive]
+        if not failed or run_deadline.expired():
+            break
+        delay = backoff * 2 ** attempt
+        print(f"   🔁 Reintento {attempt + 1}/{attempts}: {len(failed)} URLs caídas (espera {delay:g}s)")
+        time.sleep(delay)
+        host_scheduler.half_open()
+        
+        retried = {url: result for url, result in validate_urls(failed).items()
+                   if result.error != 'deadline'}
+        alive = {url: result for url, result in retried.items() if result.alive}
+        recovered += len(alive)
+        url_status.update(retried)
+        if cache:
+            cache.store(alive)
+            cache.note_run_results(retried)
+    if recovered:
+        print(f"   ✅ {recovered} URLs recuperadas en los reintentos")
+    return recovered
+
+def scheduled_probe(url):
+    """Verifica una URL a través del planificador por host."""
+    return host_scheduler.run(url, probe_url)
+
+def record_probe_results(probed, cache=None):
+    """Muestra el resumen de un lote de verificaciones y lo guarda en caché."""
+    skipped = [url for url, r in probed.items() if r.error == 'circuit_open']
+    if skipped:
+        print(f"   ⛔ {len(skipped)} URLs descartadas por hosts con circuit breaker abierto")
+    unprobed = sum(1 for r in probed.values() if r.error == 'deadline')
+    if unprobed:
+        run_metrics.count('deadline_skipped', unprobed)
+        print(f"   ⌛ {unprobed} URLs sin verificar por la fecha límite (conservan su estado previo)")
+    
+    if DEEP_PROBE:
+        segments_dead = sum(1 for r in probed.values() if not r.alive and r.stage in ('manifest', 'playlist'))
+        if segments_dead:
+            print(f"   ⚠️  {segments_dead} canales con manifiesto vivo pero segmentos caídos")
+    
+    if cache:
+        # Los descartes del breaker y de la fecha límite no son verificaciones reales
+        cache.store({url: r for url, r in probed.items() if r.error not in ('circuit_open', 'deadline')})
+
+# --- CACHÉ PERSISTENTE DE ESTADO DE URLS ---
+
+def ensure_columns(conn, table, columns):
+    """Agrega a `table` las columnas que falten (bases creadas por versiones anteriores)."""
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for name, definition in columns.items():
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+class UrlStatusCache:
+    """
+    Caché en SQLite del último estado conocido de cada URL.
+    
+    Cada entrada guarda si la URL estaba viva y cuándo se verificó. Un
+    resultado se considera vigente durante CACHE_TTL_ALIVE segundos si la
+    URL estaba viva, o CACHE_TTL_DEAD segundos si estaba caída.
+    
+    Guarda además, para las URLs que alguna vez estuvieron vivas, cuántas
+    ejecuciones seguidas llevan caídas (tabla url_failures), base de la
+    histéresis de fallos (ver in_grace), y el destino final de las URLs
+    que redirigen (tabla redirects, ver stable_target).
+    """
+    
+    # Campos de ProbeResult que se guardan además de alive/checked_at
+    COLUMNS = {
+        'stage': 'TEXT',
+        'error': 'TEXT',
+        'timings': 'TEXT',
+        'status_code': 'INTEGER',
+        'ttfb_ms': 'INTEGER',
+        'redirects': 'INTEGER',
+        'redirect_chain': 'TEXT',
+        'fingerprint': 'TEXT',
+    }
+    JSON_COLUMNS = {'timings': dict, 'redirect_chain': list}
+    
+    def __init__(self, path=STATE_DB_FILE, ttl_alive=CACHE_TTL_ALIVE, ttl_dead=CACHE_TTL_DEAD):
+        self.path = path
+        self.ttl_alive = ttl_alive
+        self.ttl_dead = ttl_dead
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS url_status ("
+            " url TEXT PRIMARY KEY,"
+            " alive INTEGER NOT NULL,"
+            " checked_at REAL NOT NULL)"
+        )
+        ensure_columns(self.conn, 'url_status', self.COLUMNS)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS url_failures ("
+            " url TEXT PRIMARY KEY,"
+            " failures INTEGER NOT NULL,"
+            " last_alive REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS redirects ("
+            " url TEXT PRIMARY KEY,"
+            " final_url TEXT NOT NULL,"
+            " chain TEXT NOT NULL,"
+            " confirmations INTEGER NOT NULL,"
+            " resolved_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+        # Se cargan en memoria: se consultan desde los hilos del pipeline
+        self.failures = dict(self.conn.execute("SELECT url, failures FROM url_failures"))
+        self.last_known = {
+            url: (bool(alive), checked_at)
+            for url, alive, checked_at in self.conn.execute("SELECT url, alive, checked_at FROM url_status")
+        }
+        self.redirects = {
+            url: (final_url, confirmations, resolved_at)
+            for url, final_url, confirmations, resolved_at
+            in self.conn.execute("SELECT url, final_url, confirmations, resolved_at FROM redirects")
+        }
+        self.originals = {final_url: url for url, (final_url, _, _) in self.redirects.items()}
+        self.fingerprints = dict(self.conn.execute(
+            "SELECT url, fingerprint FROM url_status WHERE fingerprint IS NOT NULL"
+        ))
+        self.run_results = {}
+        self.preset = {}
+        self.local_urls = set()
+    
+    def load_local_urls(self, filenames):
+        """
+        Registra las URLs ya publicadas en las listas locales (con su URL
+        original si fueron reescritas); ver keep_previous_status. Debe
+        llamarse antes de que la ejecución reescriba las listas.
+        """
+        for filename in filenames:
+            try:
+                with open(filename, 'r', encoding='utf-8') as f:
+                    for channel in iter_m3u_channels(f):
+                        self.local_urls.add(channel.url)
+                        self.local_urls.add(self.original_url(channel.url))
+            except FileNotFoundError:
+                continue
+    
+    def add_preset(self, results):
+        """
+        Resultados ya verificados en esta ejecución por otro proceso (los
+        shards): get_fresh los retorna como vigentes sin consultar la base.
+        """
+        self.preset.update(results)
+    
+    def get_fresh(self, urls, now=None):
+        """Retorna {url: ProbeResult} solo para las URLs con resultado vigente."""
+        now = now or time.time()
+        fresh = {url: self.preset[url] for url in urls if url in self.preset}
+        urls = [url for url in urls if url not in fresh]
+        # SQLite limita el número de parámetros por consulta
+        for start in range(0, len(urls), 500):
+            chunk = urls[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT url, alive, checked_at, {', '.join(self.COLUMNS)}"
+                f" FROM url_status WHERE url IN ({placeholders})",
+                chunk
+            )
+            for url, alive, checked_at, *values in rows:
+                ttl = self.ttl_alive if alive else self.ttl_dead
+                if now - checked_at < ttl:
+                    fields = dict(zip(self.COLUMNS, values))
+                    for column, empty in self.JSON_COLUMNS.items():
+                        fields[column] = json.loads(fields[column]) if fields[column] else empty()
+                    fields['redirects'] = fields['redirects'] or 0
+                    fresh[url] = ProbeResult(url, bool(alive), **fields)
+        return fresh
+    
+    def store(self, results, now=None):
+        """
+        Guarda (o reemplaza) el resultado de cada URL con la hora actual. Los
+        resultados tomados de un equivalente no se guardan: no son verificaciones.
+        """
+        now = now or time.time()
+        results = {url: r for url, r in results.items() if r.equivalent_of is None}
+        self.fingerprints.update((url, r.fingerprint) for url, r in results.items() if r.fingerprint)
+        columns = ', '.join(self.COLUMNS)
+        placeholders = ', '.join('?' * (len(self.COLUMNS) + 3))
+        self.conn.executemany(
+            f"INSERT OR REPLACE INTO url_status (url, alive, checked_at, {columns})"
+            f" VALUES ({placeholders})",
+            [
+                (url, int(r.alive), now,
+                 *(json.dumps(getattr(r, column)) if column in self.JSON_COLUMNS else getattr(r, column)
+                   for column in self.COLUMNS))
+                for url, r in results.items()
+            ]
+        )
+        self.conn.commit()
+        self.store_redirects(results, now)
+    
+    def store_redirects(self, results, now=None):
+        """
+        Registra la cadena de redirecciones de las URLs vivas. Cada vez que
+        una URL vuelve a resolver al mismo destino suma una confirmación; si
+        el destino cambia, el contador vuelve a 1. Las URLs vivas que ya no
+        redirigen se olvidan.
+        """
+        now = now or time.time()
+        alive = {url: r for url, r in results.items() if r.alive}
+        resolved = {url: r for url, r in alive.items() if r.redirect_chain}
+        self.conn.executemany(
+            "INSERT INTO redirects (url, final_url, chain, confirmations, resolved_at)"
+            " VALUES (?, ?, ?, 1, ?)"
+            " ON CONFLICT(url) DO UPDATE SET"
+            "  confirmations = CASE WHEN final_url = excluded.final_url"
+            "                  THEN confirmations + 1 ELSE 1 END,"
+            "  final_url = excluded.final_url, chain = excluded.chain,"
+            "  resolved_at = excluded.resolved_at",
+            [(url, r.final_url, json.dumps(r.redirect_chain), now) for url, r in resolved.items()]
+        )
+        direct = [url for url in alive if url not in resolved and url in self.redirects]
+        self.conn.executemany("DELETE FROM redirects WHERE url = ?", [(url,) for url in direct])
+        self.conn.commit()
+        
+        for url, r in resolved.items():
+            previous = self.redirects.get(url)
+            confirmations = previous[1] + 1 if previous and previous[0] == r.final_url else 1
+            self.redirects[url] = (r.final_url, confirmations, now)
+            self.originals[r.final_url] = url
+        for url in direct:
+            self.originals.pop(self.redirects.pop(url)[0], None)
+    
+    def stable_target(self, url, now=None):
+        """
+        Destino final con el que puede reescribirse `url`, o None: debe estar
+        vigente (REDIRECT_TTL), confirmado en dos verificaciones seguidas y
+        no llevar token (ver is_token_url), porque esos caducan.
+        """
+        entry = self.redirects.get(url)
+        if not entry:
+            return None
+        final_url, confirmations, resolved_at = entry
+        now = now or time.time()
+        if confirmations < 2 or now - resolved_at > REDIRECT_TTL or is_token_url(final_url):
+            return None
+        return final_url
+    
+    def original_url(self, url):
+        """URL original de un destino reescrito (o la misma URL)."""
+        return self.originals.get(url, url)
+    
+    def prune(self, max_age=CACHE_MAX_AGE, now=None):
+        """Elimina entradas demasiado antiguas para mantener el archivo compacto."""
+        now = now or time.time()
+        self.conn.execute("DELETE FROM url_status WHERE checked_at < ?", (now - max_age,))
+        self.conn.execute("DELETE FROM url_failures WHERE last_alive < ?", (now - max_age,))
+        self.conn.execute("DELETE FROM redirects WHERE resolved_at < ?", (now - max_age,))
+        self.conn.commit()
+    
+    def priority_tiers(self, urls, now=None):
+        """
+        Agrupa las URLs por valor de verificarlas: primero las nunca
+        verificadas, luego las que están fallando y al final el resto. Dentro
+        de cada nivel, primero las que llevan más tiempo sin verificarse,
+        ponderado por sus fallos recientes (las inestables suben).
+        Retorna la lista de niveles no vacíos.
+        """
+        now = now or time.time()
+        
+        def value(url):
+            age = now - self.last_known[url][1]
+            return age * (1 + self.failures.get(url, 0))
+        
+        tiers = ([], [], [])
+        for url in urls:
+            if url not in self.last_known:
+                tiers[0].append(url)
+            else:
+                tiers[1 if self.failures.get(url, 0) else 2].append(url)
+        return [tier if i == 0 else sorted(tier, key=value, reverse=True)
+                for i, tier in enumerate(tiers) if tier]
+    
+    def note_run_results(self, results):
+        """Registra el último estado de cada URL en esta ejecución (ver save_failures)."""
+        self.run_results.update(
+            (url, result.alive) for url, result in results.items() if result.error != 'deadline'
+        )
+    
+    def in_grace(self, url, threshold=FAILURE_THRESHOLD):
+        """
+        True si una URL caída debe conservarse todavía: estuvo viva alguna vez
+        y, contando esta ejecución, no acumula `threshold` fallos seguidos.
+        """
+        return url in self.failures and self.failures[url] + 1 < threshold
+    
+    def save_failures(self, now=None):
+        """
+        Actualiza los fallos consecutivos con el estado final de cada URL en
+        la ejecución: se reinician si estuvo viva y se incrementan si no.
+        Las URLs que nunca estuvieron vivas no se registran.
+        """
+        now = now or time.time()
+        alive = [url for url, ok in self.run_results.items() if ok]
+        dead = [url for url, ok in self.run_results.items() if not ok and url in self.failures]
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO url_failures (url, failures, last_alive) VALUES (?, 0, ?)",
+            [(url, now) for url in alive]
+        )
+        self.conn.executemany(
+            "UPDATE url_failures SET failures = failures + 1 WHERE url = ?",
+            [(url,) for url in dead]
+        )
+        self.conn.commit()
+        self.failures.update((url, 0) for url in alive)
+        self.failures.update((url, self.failures[url] + 1) for url in dead)
+        self.run_results = {}
+        return len(dead)
+    
+    def close(self):
+        self.conn.close()
+
+class RemoteSourceCache:
+    """
+    Guarda en SQLite los validadores HTTP (ETag / Last-Modified) de cada
+    fuente remota junto con los canales que pasaron el filtro la última vez,
+    para no descargar ni volver a filtrar una lista que no cambió.
+    """
+    
+    def __init__(self, path=STATE_DB_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS remote_sources ("
+            " url TEXT PRIMARY KEY,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " total_found INTEGER NOT NULL,"
+            " channels TEXT NOT NULL,"
+            " fetched_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+    
+    def get_validators(self, url):
+        """
+        Retorna (etag, last_modified) de la última descarga, o None si la
+        fuente no tiene canales guardados. Sirve también para saber si hay
+        canales que reutilizar sin decodificarlos (get_channels).
+        """
+        return self.conn.execute(
+            "SELECT etag, last_modified FROM remote_sources WHERE url = ?", (url,)
+        ).fetchone()
+    
+    def get_channels(self, url):
+        """Retorna (total_found, [Channel, ...]) guardados para la fuente."""
+        row = self.conn.execute(
+            "SELECT total_found, channels FROM remote_sources WHERE url = ?", (url,)
+        ).fetchone()
+        if not row:
+            return None
+        lines = (line for channel_lines in json.loads(row[1]) for line in channel_lines)
+        return row[0], list(iter_m3u_channels(lines))
+    
+    def store(self, url, etag, last_modified, total_found, channels):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO remote_sources"
+            " (url, etag, last_modified, total_found, channels, fetched_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (url, etag, last_modified, total_found,
+             json.dumps([channel.to_lines() for channel in channels], ensure_ascii=False),
+             time.time())
+        )
+        self.conn.commit()
+    
+    def close(self):
+        self.conn.close()
+
+# --- HISTORIAL POR CANAL ---
+
+class ChannelHistoryStore:
+    """
+    Historial en SQLite de observaciones por canal: en cada ejecución se
+    inserta una fila por canal verificado (URL, tvg-id, archivo, estado,
+    si quedó en la lista, latencia, fase). Los reportes consultan diferencias entre ejecuciones y
+    uptime con consultas indexadas, sin cargar todo el historial.
+    """
+    
+    def __init__(self, path=STATE_DB_FILE):
+        self.path = path
+        self.run_id = None
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            " run_id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " started_at TEXT NOT NULL,"
+            " finished_at TEXT);"
+            "CREATE TABLE IF NOT EXISTS observations ("
+            " run_id INTEGER NOT NULL,"
+            " phase TEXT NOT NULL,"
+            " file TEXT NOT NULL,"
+            " url TEXT NOT NULL,"
+            " tvg_id TEXT,"
+            " name TEXT,"
+            " status INTEGER NOT NULL,"
+            " latency_ms INTEGER);"
+            "CREATE INDEX IF NOT EXISTS idx_observations_run_file"
+            " ON observations (run_id, phase, file, url);"
+            "CREATE INDEX IF NOT EXISTS idx_observations_url"
+            " ON observations (url, run_id);"
+        )
+        # Un canal caído puede seguir en la lista durante el período de gracia
+        ensure_columns(self.conn, 'observations', {'kept': 'INTEGER'})
+        self.conn.commit()
+    
+    def start_run(self):
+        cursor = self.conn.execute(
+            "INSERT INTO runs (started_at) VALUES (?)", (datetime.now().isoformat(timespec='seconds'),)
+        )
+        self.conn.commit()
+        self.run_id = cursor.lastrowid
+        return self.run_id
+    
+    def record(self, phase, filename, channels, url_status, cache=None):
+        """
+        Inserta una observación por canal de `filename` en la ejecución
+        actual (salvo los que quedaron sin verificar por la fecha límite).
+        """
+        if self.run_id is None:
+            return
+        self.conn.executemany(
+            "INSERT INTO observations"
+            " (run_id, phase, file, url, tvg_id, name, status, kept, latency_ms)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (self.run_id, phase, filename, channel.url, channel.tvg_id, channel.name,
+                 int(url_status[channel.url].alive),
+                 int(is_channel_kept(url_status[channel.url], cache)),
+                 url_status[channel.url].ttfb_ms)
+                for channel in channels
+                # Sin verificar por la fecha límite: no es una observación real
+                if url_status[channel.url].error != 'deadline'
+            ]
+        )
+        self.conn.commit()
+    
+    def finish_run(self, keep_runs=HISTORY_RUNS_KEPT):
+        """Cierra la ejecución y elimina las observaciones de ejecuciones antiguas."""
+        self.conn.execute(
+            "UPDATE runs SET finished_at = ? WHERE run_id = ?",
+            (datetime.now().isoformat(timespec='seconds'), self.run_id)
+        )
+        oldest_kept = self.run_id - keep_runs + 1
+        self.conn.execute("DELETE FROM observations WHERE run_id < ?", (oldest_kept,))
+        self.conn.execute("DELETE FROM runs WHERE run_id < ?", (oldest_kept,))
+        self.conn.commit()
+    
+    def close(self):
+        self.conn.close()
+
+# --- DESCARGA DE FUENTES REMOTAS ---
+
+def fetch_source(session, source_url, etag=None, last_modified=None, stream=False):
+    """
+    Descarga una fuente remota enviando los validadores guardados.
+    
+    Retorna un diccionario con 'status' ('updated', 'not_modified' o 'error'),
+    y según el caso 'text', 'etag', 'last_modified' o 'error'. Con
+    `stream=True` el cuerpo no se lee: se retorna la respuesta abierta en
+    'response' para consumirla línea a línea.
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    
+    try:
+        response = session.get(source_url, headers=headers, timeout=DOWNLOAD_TIMEOUT,
+                               stream=stream)
+        if response.status_code == 304:
+            response.close()
+            return {'status': 'not_modified'}
+        response.raise_for_status()
+        if not stream:
+            response.content  # Lee el cuerpo para contar los bytes recibidos
+            run_metrics.count('bytes_downloaded', response.raw.tell())
+        download = {
+            'status': 'updated',
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+        if stream:
+            download['response'] = response
+        else:
+            download['text'] = response.text
+        return download
+    except Exception as e:
+        return {'status': 'error', 'error': str(e)}
+
+def download_sources(source_urls, source_cache=None):
+    """
+    Descarga todas las fuentes remotas en paralelo sobre una sola sesión
+    (conexiones reutilizadas). Las fuentes con canales guardados en
+    `source_cache` se piden de forma condicional.
+    
+    Retorna un diccionario {source_url: resultado de fetch_source}.
+    """
+    source_urls = list(dict.fromkeys(source_urls))
+    if not source_urls:
+        return {}
+    
+    validators = {}
+    for source_url in source_urls:
+        # Solo se pide condicionalmente si hay canales para reutilizar
+        stored = source_cache.get_validators(source_url) if source_cache else None
+        validators[source_url] = stored or (None, None)
+    
+    workers = min(DOWNLOAD_WORKERS, len(source_urls))
+    session = requests.Session()
+    session.verify = False
+    adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    
+    with session, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            source_url: executor.submit(fetch_source, session, source_url, *validators[source_url])
+            for source_url in source_urls
+        }
+        downloads = {source_url: future.result() for source_url, future in futures.items()}
+    
+    not_modified = sum(1 for d in downloads.values() if d['status'] == 'not_modified')
+    print(f"⬇️  Fuentes descargadas: {len(downloads) - not_modified}, sin cambios (304): {not_modified}")
+    return downloads
+
+def channel_destinations(channel):
+    """
+    Fuentes (URL de país o de categoría) que le corresponden a un canal del
+    índice de iptv-org: los países por el sufijo de su tvg-id y su
+    tvg-country, y las categorías por su group-title.
+    """
+    codes = set()
+    match = TVG_ID_COUNTRY_PATTERN.search((channel.tvg_id or '').lower())
+    if match:
+        codes.add(match.group(1))
+    codes.update(code.strip().lower() for code in channel.attributes.get('tvg-country', '').split(';'))
+    
+    destinations = [COUNTRY_SOURCE_TEMPLATE.format(code) for code in sorted(codes) if code in COUNTRY_FILES]
+    for category in (channel.group_title or '').split(';'):
+        source_url = CATEGORY_SOURCES.get(category.strip().lower())
+        if source_url:
+            destinations.append(source_url)
+    return destinations
+
+def download_index_fanout(source_urls, source_cache=None):
+    """
+    Descarga una sola vez el índice completo de iptv-org, lo lee en
+    streaming y reparte sus canales entre `source_urls` (channel_destinations).
+    
+    Retorna {source_url: descarga} con la forma de download_sources(); cada
+    descarga lleva los canales ya repartidos en 'channels'. La descarga es
+    condicional si todas las fuentes se guardaron con los validadores del
+    mismo índice, y en ese caso un 304 reutiliza sus canales guardados.
+    """
+    etag, last_modified = (None, None)
+    if source_cache:
+        validators = {source_cache.get_validators(url) for url in source_urls}
+        if len(validators) == 1 and None not in validators:
+            etag, last_modified = validators.pop()
+    
+    download = fetch_source(get_session(), INDEX_SOURCE_URL, etag, last_modified, stream=True)
+    if download['status'] != 'updated':
+        if download['status'] == 'not_modified':
+            print(f"⬇️  Índice de iptv-org sin cambios (304)")
+        return {source_url: download for source_url in source_urls}
+    
+    routed = {source_url: [] for source_url in source_urls}
+    total_found = 0
+    response = download['response']
+    if response.encoding is None:
+        response.encoding = 'utf-8'
+    with response:
+        for channel in iter_m3u_channels(response.iter_lines(decode_unicode=True)):
+            total_found += 1
+            for source_url in channel_destinations(channel):
+                if source_url in routed:
+                    routed[source_url].append(channel)
+        run_metrics.count('bytes_downloaded', response.raw.tell())
+    
+    print(f"⬇️  Índice de iptv-org: {total_found} canales repartidos entre {len(routed)} listas")
+    return {
+        source_url: {
+            'status': 'updated',
+            'etag': download['etag'],
+            'last_modified': download['last_modified'],
+            'channels': channels,
+        }
+        for source_url, channels in routed.items()
+    }
+
+# --- PARSER M3U ---
+
+def parse_extinf_attributes(extinf_line):
+    """Extrae los atributos clave="valor" de una línea #EXTINF a un diccionario."""
+    return {key.lower(): value for key, value in EXTINF_ATTRIBUTE_PATTERN.findall(extinf_line)}
+
+class Channel:
+    """
+    Un canal de una lista M3U: la línea #EXTINF, las líneas de opciones
+    intermedias (#EXTVLCOPT, #KODIPROP, ...) y la URL del stream.
+    """
+    __slots__ = ('extinf', 'options', 'url', 'attributes', 'name',
+                 'tvg_id', 'tvg_logo', 'group_title')
+    
+    def __init__(self, extinf, url, options=None):
+        self.extinf = extinf
+        self.url = url
+        self.options = options or []
+        self.attributes = parse_extinf_attributes(extinf)
+        self.tvg_id = self.attributes.get('tvg-id', '')
+        self.tvg_logo = self.attributes.get('tvg-logo', '')
+        self.group_title = self.attributes.get('group-title', '')
+        # El nombre va después de la primera coma fuera de comillas: puede
+        # contener comillas ('Canal "Uno" HD') y los atributos, comas
+        prefix = EXTINF_PREFIX_PATTERN.match(extinf)
+        if prefix:
+            self.name = extinf[prefix.end():].strip()
+        else:
+            comma = extinf.find(',')
+            self.name = extinf[comma + 1:].strip() if comma >= 0 else ''
     
-    with lock:
-        url_status_cache[url] = is_valid
-    return is_valid
+    def to_lines(self):
+        """Líneas del canal tal como se escriben en el archivo M3U."""
+        return [self.extinf, *self.options, self.url]
+    
+    def __repr__(self):
+        return f"Channel({self.name!r}, {self.url!r})"
+
+def iter_m3u_channels(lines):
+    """
+    Genera objetos Channel a partir de cualquier iterable de líneas (un
+    archivo abierto, response.iter_lines(), una lista...), sin cargar la
+    lista completa en memoria.
+    
+    Las líneas de comentario entre #EXTINF y la URL se conservan como
+    opciones del canal; un #EXTINF sin URL se descarta.
+    """
+    extinf = None
+    options = []
+    for raw_line in lines:
+        if isinstance(raw_line, bytes):
+            raw_line = raw_line.decode('utf-8', 'replace')
+        line = raw_line.strip()
+        if not line:
+            continue
+        if line.startswith('#EXTINF'):
+            extinf = line
+            options = []
+        elif line.startswith('#'):
+            if extinf is not None:
+                options.append(line)
+        elif extinf is not None:
+            yield Channel(extinf, line, options)
+            extinf = None
+            options = []
 
-def is_latin_channel(extinf_line, url_line):
+def local_playlists(directory='.'):
+    """Nombres de las listas .m3u de `directory`, en orden alfabético."""
+    return sorted(f for f in os.listdir(directory) if f.endswith('.m3u'))
+
+def is_latin_channel(extinf_line, url_line, attributes=None):
     """
     FILTRO MEJORADO: Verifica si un canal es latino/español.
     Analiza tanto la línea #EXTINF como la URL.
     
+    `attributes` permite pasar los atributos tvg-* ya parseados.
     Retorna True si es español/latino, False si no lo es.
     """
     # Combinar ambas líneas para análisis completo
     full_text = (extinf_line + " " + url_line).lower()
     
-    # PASO 1: Rechazar explícitamente si tiene palabras de exclusión
-    for exclude_word in EXCLUDE_KEYWORDS:
-        if exclude_word in full_text:
+    # PASO 1 y 2 en una pasada: rechazar si tiene palabras de exclusión,
+    # aceptar si tiene palabras latinas/españolas
+    # (cada búsqueda sigue desde el inicio de la anterior + 1, para no saltar
+    # una palabra de exclusión que empiece dentro de una latina)
+    latin = False
+    match = KEYWORD_PATTERN.search(full_text)
+    while match:
+        if match.group() in EXCLUDE_KEYWORD_SET:
             return False
-    
-    # PASO 2: Aceptar si tiene palabras latinas/españolas
-    for keyword in LATIN_KEYWORDS:
-        if keyword in full_text:
-            return True
+        latin = True
+        match = KEYWORD_PATTERN.search(full_text, match.start() + 1)
+    if latin:
+        return True
     
     # PASO 3: Buscar atributos TVG específicos de países hispanohablantes
-    spanish_countries = ['es', 'mx', 'ar', 'co', 'cl', 'pe', 've', 'ec', 
-                         'uy', 'py', 'bo', 'cr', 'pa', 'gt', 'hn', 'sv', 
-                         'ni', 'cu', 'pr', 'do']
-    
-    for country_code in spanish_countries:
-        if f'tvg-country="{country_code}"' in full_text:
-            return True
-        if f'tvg-language="{country_code}"' in full_text:
-            return True
+    if attributes is None:
+        attributes = parse_extinf_attributes(extinf_line)
+    if attributes.get('tvg-country', '').lower() in SPANISH_COUNTRY_CODES:
+        return True
+    if attributes.get('tvg-language', '').lower() in SPANISH_COUNTRY_CODES:
+        return True
     
     # PASO 4: Por defecto, RECHAZAR si no hay indicadores claros
     # (Modo estricto: solo acepta canales con marcadores explícitos)
     return False
 
-def save_m3u_content(filepath, content):
-    """Escribe el contenido filtrado en el archivo M3U."""
+# --- ESCRITURA ATÓMICA Y DETECCIÓN DE CAMBIOS ---
+
+def file_sha256(filepath):
+    """Hash SHA-256 del contenido de un archivo, o None si no existe."""
+    digest = hashlib.sha256()
+    try:
+        with open(filepath, 'rb') as f:
+            for block in iter(lambda: f.read(65536), b''):
+                digest.update(block)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+def make_temp_path(filepath):
+    """Crea un archivo temporal vacío junto a `filepath` y retorna su ruta."""
+    directory = os.path.dirname(os.path.abspath(filepath))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(filepath)}.",
+                                     suffix='.tmp')
+    os.close(fd)
+    os.chmod(temp_path, 0o644)
+    return temp_path
+
+def mark_changed(filepath):
+    if filepath not in changed_files:
+        changed_files.append(filepath)
+
+def replace_if_changed(temp_path, filepath):
+    """
+    Reemplaza `filepath` por `temp_path` con os.replace (atómico) solo si el
+    contenido es distinto; si es idéntico se descarta el temporal.
+    Retorna True si el archivo cambió.
+    """
+    if file_sha256(temp_path) == file_sha256(filepath):
+        os.remove(temp_path)
+        return False
+    os.replace(temp_path, filepath)
+    mark_changed(filepath)
+    return True
+
+def write_file_atomic(filepath, content, track=True):
+    """
+    Escribe `content` en `filepath` a través de un temporal + os.replace, de
+    modo que un corte a mitad de escritura nunca deja el archivo truncado.
+    No toca el archivo si su contenido ya es idéntico. Retorna True si cambió.
+    Con track=False no se agrega a changed_files (artefactos fuera de git).
+    """
+    data = content.encode('utf-8') if isinstance(content, str) else content
+    if hashlib.sha256(data).hexdigest() == file_sha256(filepath):
+        return False
+    temp_path = make_temp_path(filepath)
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, filepath)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    if track:
+        mark_changed(filepath)
+    return True
+
+# --- LATENCIA ---
+
+def is_channel_kept(result, cache=None):
+    """
+    Un canal se conserva si está vivo y no supera MAX_LATENCY_MS (si hay
+    umbral), o si está caído pero todavía en período de gracia (ver
+    UrlStatusCache.in_grace).
+    """
+    if not result.alive:
+        return bool(cache) and cache.in_grace(result.url)
+    if MAX_LATENCY_MS and result.ttfb_ms is not None and result.ttfb_ms > MAX_LATENCY_MS:
+        return False
+    return True
+
+def sort_by_latency(channels, url_status):
+    """
+    Ordena los canales por latencia dentro de cada group-title. Los grupos
+    conservan el orden de su primera aparición; los canales sin medición
+    van al final de su grupo, y detrás los caídos en período de gracia
+    (un 404 rápido también tiene latencia).
+    """
+    groups = {}
+    for channel in channels:
+        groups.setdefault(channel.group_title, []).append(channel)
+    
+    def latency(channel):
+        result = url_status[channel.url]
+        return (not result.alive, result.ttfb_ms is None, result.ttfb_ms or 0)
+    
+    return [channel for group in groups.values() for channel in sorted(group, key=latency)]
+
+def with_resolved_urls(channels, cache=None):
+    """
+    Con REWRITE_REDIRECTS, reemplaza la URL de cada canal por su destino
+    final estable (ver UrlStatusCache.stable_target) para que los
+    reproductores no recorran la cadena de redirecciones al iniciar.
+    """
+    if not (REWRITE_REDIRECTS and cache):
+        return channels
+    resolved = []
+    for channel in channels:
+        target = cache.stable_target(channel.url)
+        if target:
+            channel = Channel(channel.extinf, target, channel.options)
+            run_metrics.count('redirects_rewritten')
+        resolved.append(channel)
+    return resolved
+
+def with_logo(channel, tvg_logo):
+    """Copia del canal con otro valor de tvg-logo ('' lo deja vacío)."""
+    old_attribute = f'tvg-logo="{channel.tvg_logo}"'
+    if old_attribute not in channel.extinf:
+        return channel
+    extinf = channel.extinf.replace(old_attribute, f'tvg-logo="{tvg_logo}"', 1)
+    return Channel(extinf, channel.url, channel.options)
+
+def with_cached_logos(channels, logos=None):
+    """
+    Con LOGO_CACHE, escribe cada tvg-logo remoto ya resuelto por la Fase 3
+    de una ejecución anterior como su copia en el almacén (o vacío si está
+    roto), para que la lista se escriba una sola vez con su valor final.
+    Registra en `logos.seen` las URLs originales para revalidarlas.
+    """
+    if logos is None:
+        return channels
+    rendered = []
+    for channel in channels:
+        if channel.tvg_logo.startswith(('http://', 'https://')) and not logo_store_path(channel.tvg_logo):
+            logos.seen.add(channel.tvg_logo)
+            reference = logos.references.get(channel.tvg_logo)
+            if reference is not None:
+                channel = with_logo(channel, reference)
+        rendered.append(channel)
+    return rendered
+
+def with_original_urls(channels, cache=None):
+    """Devuelve a su URL original los canales escritos con un destino de redirección."""
+    if not cache or not cache.originals:
+        return channels
+    return [
+        Channel(channel.extinf, cache.original_url(channel.url), channel.options)
+        if channel.url in cache.originals else channel
+        for channel in channels
+    ]
+
+def collapse_equivalent(channels, url_status, cache=None):
+    """
+    Deja un solo canal por grupo de streams equivalentes: el de la URL viva
+    más rápida (stream_speed), en la posición del primer miembro del grupo.
+    Los caídos en período de gracia no se agrupan y se conservan tal cual.
+    """
+    best = {}
+    alive_urls = (channel.url for channel in channels if url_status[channel.url].alive)
+    for group in stream_groups(alive_urls, cache, url_status):
+        chosen = min(group, key=lambda url: stream_speed(url_status[url]))
+        best.update((url, chosen) for url in group)
+    
+    first_channel = {}
+    for channel in channels:
+        first_channel.setdefault(channel.url, channel)
+    collapsed = []
+    seen = set()
+    for channel in channels:
+        if channel.url not in best:
+            collapsed.append(channel)
+            continue
+        chosen = best[channel.url]
+        if chosen not in seen:
+            seen.add(chosen)
+            collapsed.append(first_channel[chosen])
+    return collapsed
+
+def select_channels(channels, url_status, cache=None):
+    """Canales que se escriben en la lista final, ordenados según la configuración."""
+    kept = [channel for channel in channels if is_channel_kept(url_status[channel.url], cache)]
+    if STREAM_DEDUP:
+        kept = collapse_equivalent(kept, url_status, cache)
+    return sort_by_latency(kept, url_status) if SORT_BY_LATENCY else kept
+
+def percentile(values, fraction):
+    """Percentil por rango más cercano de una lista ya ordenada."""
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * fraction // 1))
+    return values[int(rank) - 1]
+
+def latency_summary(channels, url_status):
+    """Estadísticas de latencia (p50/p95 del tiempo al primer byte) de una lista."""
+    values = sorted(
+        url_status[channel.url].ttfb_ms for channel in channels
+        if url_status[channel.url].ttfb_ms is not None
+    )
+    return {
+        'channels': len(channels),
+        'measured': len(values),
+        'p50_ms': percentile(values, 0.50),
+        'p95_ms': percentile(values, 0.95),
+        'max_ms': values[-1] if values else None,
+    }
+
+def render_m3u(channels):
+    """Genera en memoria el texto M3U de una lista de canales."""
+    return '#EXTM3U' + ''.join('\n' + '\n'.join(channel.to_lines()) for channel in channels)
+
+def save_m3u_content(filepath, channels):
+    """Escribe los canales (objetos Channel) en el archivo M3U si cambiaron."""
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(content))
+        if not write_file_atomic(filepath, render_m3u(channels)):
+            print(f"   ⚪ {filepath} sin cambios, no se reescribe")
         return True
     except Exception as e:
         print(f"❌ Error al guardar {filepath}: {e}")
@@ -159,10 +1956,17 @@ def save_m3u_content(filepath, content):
 
 # --- LÓGICA DE PROCESAMIENTO GENERAL ---
 
-def process_remote_list(source_url, filename, apply_latin_filter=False):
+def process_remote_list(source_url, filename, apply_latin_filter=False, cache=None,
+                        download=None, source_cache=None, history=None, logos=None):
     """
     Descarga una lista remota, la filtra (si se requiere), valida los enlaces 
     y guarda el resultado en el archivo local.
+    
+    `download` es el resultado ya obtenido por download_sources() (o por
+    download_index_fanout(), con los canales ya repartidos); si la fuente no
+    cambió (304) se reutilizan los canales filtrados guardados en
+    `source_cache` en lugar de volver a parsear y filtrar. Con `logos`
+    (LogoCache) los tvg-logo se escriben ya apuntando al almacén.
     """
     print(f"\n{'='*60}")
     print(f"📄 Procesando: {filename}")
@@ -172,54 +1976,61 @@ def process_remote_list(source_url, filename, apply_latin_filter=False):
     print(f"{'='*60}")
     
     # 1. DESCARGA EL CONTENIDO REMOTO
-    try:
-        response = requests.get(source_url, timeout=10, verify=False)
-        response.raise_for_status()
-        raw_m3u_content = response.text
-    except Exception as e:
-        print(f"❌ Error al descargar {filename}: {e}")
+    if download is None:
+        stored = source_cache.get_validators(source_url) if source_cache else None
+        etag, last_modified = stored or (None, None)
+        download = fetch_source(get_session(), source_url, etag, last_modified,
+                                stream=STREAMING_PIPELINE)
+    
+    if download['status'] == 'error':
+        print(f"❌ Error al descargar {filename}: {download['error']}")
         return filename, 0
-
-    lines = raw_m3u_content.split('\n')
-    output_lines = ['#EXTM3U']
-    valid_channels_count = 0
-    validation_threads = []
+    
+    if 'response' in download:
+        return stream_remote_list(source_url, filename, download, apply_latin_filter,
+                                  cache=cache, source_cache=source_cache, history=history,
+                                  logos=logos)
+    
     channels_to_validate = []
     
     total_found = 0
     filtered_out = 0
+    
+    cached = None
+    if download['status'] == 'not_modified':
+        cached = source_cache.get_channels(source_url) if source_cache else None
+        if cached is None:
+            print(f"❌ {filename}: la fuente respondió 304 pero no hay canales guardados")
+            return filename, 0
+    
+    if cached is not None:
+        # La fuente no cambió: se reutilizan los canales ya filtrados
+        total_found, channels_to_validate = cached
+        filtered_out = total_found - len(channels_to_validate)
+        print(f"♻️  Fuente sin cambios (304): se reutilizan {len(channels_to_validate)} canales filtrados")
+        channels = ()
+    elif 'channels' in download:
+        channels = download['channels']
+    else:
+        channels = iter_m3u_channels(download.get('text', '').splitlines())
 
     # PASO 2: Filtrar e identificar canales
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
+    for channel in channels:
+        total_found += 1
         
-        if line.startswith('#EXTINF'):
-            total_found += 1
-            
-            # Obtener la URL (siguiente línea)
-            url = ""
-            if i + 1 < len(lines):
-                url = lines[i+1].strip()
-            
-            # APLICAR FILTRO DE IDIOMA SI SE REQUIERE
-            passes_filter = True
-            if apply_latin_filter:
-                passes_filter = is_latin_channel(line, url)
-                if not passes_filter:
-                    filtered_out += 1
-                    if filtered_out <= 5:  # Mostrar solo los primeros 5 ejemplos
-                        channel_name = line.split(',')[-1] if ',' in line else "Sin nombre"
-                        print(f"  ❌ Filtrado: {channel_name[:60]}")
-            
-            # Si pasa el filtro, añadir a la lista de validación
-            if passes_filter and url:
-                channels_to_validate.append((line, url))
-                i += 2
-            else:
-                i += 2
-        else:
-            i += 1
+        # APLICAR FILTRO DE IDIOMA SI SE REQUIERE
+        if apply_latin_filter and not is_latin_channel(channel.extinf, channel.url, channel.attributes):
+            filtered_out += 1
+            if filtered_out <= 5:  # Mostrar solo los primeros 5 ejemplos
+                print(f"  ❌ Filtrado: {(channel.name or 'Sin nombre')[:60]}")
+            continue
+        
+        # Si pasa el filtro, añadir a la lista de validación
+        channels_to_validate.append(channel)
+    
+    if cached is None and source_cache:
+        source_cache.store(source_url, download.get('etag'), download.get('last_modified'),
+                           total_found, channels_to_validate)
 
     print(f"\n📊 Análisis inicial:")
     print(f"   • Total encontrados: {total_found}")
@@ -230,23 +2041,16 @@ def process_remote_list(source_url, filename, apply_latin_filter=False):
     # PASO 3: Validar enlaces en paralelo
     print(f"\n🔍 Validando {len(channels_to_validate)} canales...")
     
-    for line, url in channels_to_validate:
-        thread = threading.Thread(target=lambda u: check_url_status(u), args=(url,))
-        validation_threads.append(thread)
-        thread.start()
-
-    for thread in validation_threads:
-        thread.join()
+    url_status = validate_urls((channel.url for channel in channels_to_validate), cache=cache)
 
     # PASO 4: Construir la lista final
-    for line, url in channels_to_validate:
-        if url_status_cache.get(url, False):
-            output_lines.append(line)
-            output_lines.append(url)
-            valid_channels_count += 1
+    valid_channels = select_channels(channels_to_validate, url_status, cache)
+    if history:
+        history.record('update', filename, channels_to_validate, url_status, cache)
+    valid_channels_count = len(valid_channels)
     
     # Guardar resultado
-    save_m3u_content(filename, output_lines)
+    save_m3u_content(filename, with_cached_logos(with_resolved_urls(valid_channels, cache), logos))
     
     print(f"\n✅ Resultado final:")
     print(f"   • Canales válidos (vivos): {valid_channels_count}")
@@ -254,12 +2058,209 @@ def process_remote_list(source_url, filename, apply_latin_filter=False):
     
     return filename, valid_channels_count
 
+def stream_remote_list(source_url, filename, download, apply_latin_filter=False,
+                       cache=None, source_cache=None, history=None, logos=None):
+    """
+    Pipeline descarga → filtro → validación → escritura para una fuente.
+    
+    Las líneas se consumen de la respuesta a medida que llegan; cada canal
+    que pasa el filtro se envía de inmediato al pool de validación, y un
+    hilo escritor vuelca los canales vivos en el orden de la fuente en
+    cuanto su verificación termina. La cola entre ambos está acotada, así
+    el parser no se adelanta indefinidamente a la validación.
+    """
+    response = download['response']
+    if response.encoding is None:
+        response.encoding = 'utf-8'
+    
+    total_found = 0
+    filtered_out = 0
+    channels_to_validate = []
+    futures = {}
+    cached_results = {}
+    written = [0]
+    writer_errors = []
+    kept_channels = []  # Solo si hay que ordenar por latencia al final
+    kept_results = {}
+    pending_channels = queue.Queue(maxsize=MAX_WORKERS * 4)
+    temp_path = make_temp_path(filename)
+    
+    def ordered_writer():
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write('#EXTM3U')
+                while True:
+                    item = pending_channels.get()
+                    if item is None:
+                        break
+                    channel, outcome = item
+                    result = outcome.result() if hasattr(outcome, 'result') else outcome
+                    keep_previous_status(result, cache)
+                    if not is_channel_kept(result, cache):
+                        continue
+                    written[0] += 1
+                    if SORT_BY_LATENCY:
+                        kept_channels.append(channel)
+                        kept_results[channel.url] = result
+                    else:
+                        for resolved in with_cached_logos(with_resolved_urls([channel], cache), logos):
+                            f.write('\n' + '\n'.join(resolved.to_lines()))
+                # El orden por latencia exige esperar a tener todos los canales
+                for channel in with_cached_logos(
+                        with_resolved_urls(sort_by_latency(kept_channels, kept_results), cache), logos):
+                    f.write('\n' + '\n'.join(channel.to_lines()))
+        except Exception as e:
+            writer_errors.append(e)
+            # Seguir vaciando la cola para no bloquear al parser
+            while pending_channels.get() is not None:
+                pass
+    
+    print(f"\n🔀 Pipeline en streaming: descarga, filtro y validación en paralelo")
+    writer = threading.Thread(target=ordered_writer)
+    writer.start()
+    try:
+        with response, ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            for channel in iter_m3u_channels(response.iter_lines(decode_unicode=True)):
+                total_found += 1
+                if apply_latin_filter and not is_latin_channel(channel.extinf, channel.url,
+                                                               channel.attributes):
+                    filtered_out += 1
+                    continue
+                channels_to_validate.append(channel)
+                
+                url = channel.url
+                if url not in futures and url not in cached_results:
+                    fresh = cache.get_fresh([url]) if cache else {}
+                    if fresh:
+                        cached_results.update(fresh)
+                    else:
+                        futures[url] = executor.submit(scheduled_probe, url)
+                pending_channels.put((channel, cached_results.get(url) or futures[url]))
+            pending_channels.put(None)
+            writer.join()
+        if writer_errors:
+            raise writer_errors[0]
+    except Exception as e:
+        pending_channels.put(None)
+        writer.join()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        print(f"❌ Error en el pipeline de {filename}: {e}")
+        return filename, 0
+    
+    if not replace_if_changed(temp_path, filename):
+        print(f"   ⚪ {filename} sin cambios, no se reescribe")
+    run_metrics.count('bytes_downloaded', response.raw.tell())
+    run_metrics.count('cache_hits', len(cached_results))
+    probed = {url: future.result() for url, future in futures.items()}
+    record_probe_results(probed, cache)
+    if cache:
+        cache.note_run_results({**cached_results, **probed})
+    if history:
+        history.record('update', filename, channels_to_validate, {**cached_results, **probed}, cache)
+    if source_cache:
+        source_cache.store(source_url, download.get('etag'), download.get('last_modified'),
+                           total_found, channels_to_validate)
+    
+    print(f"\n📊 Análisis:")
+    print(f"   • Total encontrados: {total_found}")
+    if apply_latin_filter:
+        print(f"   • Filtrados (no español): {filtered_out}")
+    print(f"   • Verificados: {len(futures)} (desde caché: {len(cached_results)})")
+    print(f"\n✅ Resultado final:")
+    print(f"   • Canales válidos (vivos): {written[0]}")
+    print(f"   • Guardado en: {filename}")
+    
+    return filename, written[0]
+
 # --- NUEVA FUNCIÓN: LIMPIEZA DE ARCHIVOS LOCALES ---
 
-def clean_local_m3u_files():
+class UrlIndex:
+    """
+    Índice de la ejecución que asocia cada URL con todas sus apariciones
+    (archivo, posición) en las listas locales. Permite verificar cada URL
+    única una sola vez y repartir el resultado a todos los archivos.
+    """
+    
+    def __init__(self):
+        self.files = {}        # archivo -> [Channel, ...]
+        self.file_hashes = {}  # archivo -> SHA-256 del contenido leído
+        self.occurrences = {}  # url -> [(archivo, posición), ...]
+    
+    def add_file(self, filename, channels, file_hash=None):
+        self.files[filename] = channels
+        self.file_hashes[filename] = file_hash
+        for position, channel in enumerate(channels):
+            self.occurrences.setdefault(channel.url, []).append((filename, position))
+    
+    def unique_urls(self):
+        return list(self.occurrences)
+    
+    def total_entries(self):
+        return sum(len(channels) for channels in self.files.values())
+    
+    def duplicate_report(self, limit=20):
+        """Resumen del trabajo y el espacio redundante entre listas."""
+        redundant_bytes = 0
+        overlaps = {}
+        duplicated = []
+        for url, places in self.occurrences.items():
+            if len(places) < 2:
+                continue
+            for filename, position in places[1:]:
+                channel = self.files[filename][position]
+                redundant_bytes += len('\n'.join(channel.to_lines()).encode('utf-8')) + 1
+            files = sorted({filename for filename, _ in places})
+            duplicated.append({'url': url, 'count': len(places), 'files': files})
+            for i, first in enumerate(files):
+                for second in files[i + 1:]:
+                    overlaps[(first, second)] = overlaps.get((first, second), 0) + 1
+        
+        by_hash = {}
+        for filename, file_hash in self.file_hashes.items():
+            if file_hash and self.files[filename]:
+                by_hash.setdefault(file_hash, []).append(filename)
+        
+        duplicated.sort(key=lambda item: (-item['count'], item['url']))
+        top_overlaps = sorted(overlaps.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        total = self.total_entries()
+        return {
+            'total_entries': total,
+            'unique_urls': len(self.occurrences),
+            'duplicate_entries': total - len(self.occurrences),
+            'redundant_bytes': redundant_bytes,
+            'identical_files': sorted(sorted(group) for group in by_hash.values() if len(group) > 1),
+            'file_overlaps': [
+                {'files': list(pair), 'shared_urls': count} for pair, count in top_overlaps
+            ],
+            'top_duplicated_urls': duplicated[:limit],
+        }
+
+def save_duplicate_report(url_index):
+    """Guarda el reporte de duplicados y muestra un resumen."""
+    report = url_index.duplicate_report()
+    print(f"\n🧬 Duplicados entre listas: {report['duplicate_entries']} entradas repetidas "
+          f"({report['redundant_bytes'] / 1024:.1f} KB redundantes)")
+    for group in report['identical_files']:
+        print(f"   • Archivos idénticos: {', '.join(group)}")
+    try:
+        write_file_atomic(DUPLICATES_REPORT_FILE, json.dumps(report, indent=4, ensure_ascii=False))
+    except Exception as e:
+        print(f"❌ Error al guardar {DUPLICATES_REPORT_FILE}: {e}")
+    return report
+
+def clean_local_m3u_files(cache=None, history=None, retry=True, logos=None):
     """
     Lee todos los archivos M3U locales, verifica sus URLs,
     elimina los canales muertos y reescribe los archivos.
+    Las URLs ya verificadas en la Fase 1 se toman de `cache`.
+    
+    Todas las listas se indexan primero (UrlIndex) para verificar cada URL
+    única una sola vez en un único lote, aunque aparezca en varios archivos.
+    Las URLs caídas pasan a la cola de reintentos (retry_failed_urls, salvo
+    con `retry=False`) y un canal que estuvo vivo solo se elimina tras
+    FAILURE_THRESHOLD ejecuciones seguidas caído; los conteos se guardan en
+    `cache`.
     
     Retorna un diccionario con estadísticas de limpieza.
     """
@@ -270,7 +2271,7 @@ def clean_local_m3u_files():
     cleaning_results = {}
     
     # Buscar todos los archivos .m3u en el directorio actual
-    m3u_files = [f for f in os.listdir('.') if f.endswith('.m3u')]
+    m3u_files = local_playlists()
     
     if not m3u_files:
         print("⚠️  No se encontraron archivos M3U locales para limpiar")
@@ -278,37 +2279,48 @@ def clean_local_m3u_files():
     
     print(f"📂 Archivos M3U encontrados: {len(m3u_files)}")
     
+    # Indexar todas las listas
+    url_index = UrlIndex()
     for filename in m3u_files:
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                # Los destinos de redirección escritos se verifican por su URL original
+                channels = with_original_urls(list(iter_m3u_channels(f)), cache)
+                url_index.add_file(filename, channels, file_sha256(filename))
+        except Exception as e:
+            print(f"   ❌ Error leyendo {filename}: {e}")
+            cleaning_results[filename] = {
+                'before': 0,
+                'after': 0,
+                'removed': 0,
+                'error': str(e)
+            }
+    
+    latency_stats = {}
+    unique_urls = url_index.unique_urls()
+    print(f"🔗 Entradas: {url_index.total_entries()}, URLs únicas: {len(unique_urls)}")
+    print(f"🔍 Verificando URLs...")
+    
+    # Validar cada URL única una sola vez (pool de hilos acotado)
+    with run_metrics.phase('clean_probe'):
+        url_status = validate_urls(unique_urls, cache=cache)
+    if retry:
+        with run_metrics.phase('retry'):
+            retry_failed_urls(url_status, cache=cache)
+    if cache:
+        in_grace = sum(1 for result in url_status.values()
+                       if not result.alive and cache.in_grace(result.url))
+        if in_grace:
+            print(f"   ⏳ {in_grace} URLs caídas se conservan hasta fallar "
+                  f"{FAILURE_THRESHOLD} ejecuciones seguidas")
+    
+    for filename, channels in url_index.files.items():
         print(f"\n{'─'*60}")
         print(f"🔍 Verificando: {filename}")
+        file_start = time.monotonic()
         
         try:
-            # Leer el archivo M3U local
-            with open(filename, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            lines = content.split('\n')
-            output_lines = ['#EXTM3U']
-            channels_to_validate = []
-            
-            # Extraer canales del archivo
-            i = 0
-            while i < len(lines):
-                line = lines[i].strip()
-                
-                if line.startswith('#EXTINF'):
-                    url = ""
-                    if i + 1 < len(lines):
-                        url = lines[i+1].strip()
-                    
-                    if url and not url.startswith('#'):
-                        channels_to_validate.append((line, url))
-                    
-                    i += 2
-                else:
-                    i += 1
-            
-            total_before = len(channels_to_validate)
+            total_before = len(channels)
             
             if total_before == 0:
                 print(f"   ⚠️  Archivo vacío o sin canales")
@@ -320,44 +2332,40 @@ def clean_local_m3u_files():
                 continue
             
             print(f"   • Canales totales: {total_before}")
-            print(f"   • Verificando URLs...")
-            
-            # Validar URLs en paralelo
-            validation_threads = []
-            for line, url in channels_to_validate:
-                thread = threading.Thread(target=lambda u: check_url_status(u), args=(url,))
-                validation_threads.append(thread)
-                thread.start()
-            
-            for thread in validation_threads:
-                thread.join()
             
             # Construir el archivo limpio (solo canales vivos)
-            alive_count = 0
-            for line, url in channels_to_validate:
-                if url_status_cache.get(url, False):
-                    output_lines.append(line)
-                    output_lines.append(url)
-                    alive_count += 1
-            
+            alive_channels = select_channels(channels, url_status, cache)
+            if history:
+                history.record('clean', filename, channels, url_status, cache)
+            latency_stats[filename] = latency_summary(alive_channels, url_status)
+            alive_count = len(alive_channels)
             removed_count = total_before - alive_count
+            # Caídos que se conservan por el período de gracia
+            failing_count = sum(1 for channel in alive_channels if not url_status[channel.url].alive)
             
             # Guardar el archivo limpio
-            save_m3u_content(filename, output_lines)
+            save_m3u_content(filename, with_cached_logos(with_resolved_urls(alive_channels, cache), logos))
             
             # Guardar estadísticas
             cleaning_results[filename] = {
                 'before': total_before,
                 'after': alive_count,
-                'removed': removed_count
+                'removed': removed_count,
+                'failing': failing_count
             }
             
             # Mostrar resultado
             if removed_count > 0:
                 print(f"   🔴 Eliminados: {removed_count} canales muertos")
-                print(f"   ✅ Vivos: {alive_count} canales")
-            else:
+                print(f"   ✅ Conservados: {alive_count} canales")
+            elif not failing_count:
                 print(f"   ✅ Todos los canales están vivos ({alive_count})")
+            if failing_count:
+                print(f"   ⏳ Caídos en período de gracia: {failing_count} (se conservan)")
+            run_metrics.record_file(filename, 'clean', time.monotonic() - file_start)
+            if latency_stats[filename]['p50_ms'] is not None:
+                print(f"   ⏱️  Latencia p50: {latency_stats[filename]['p50_ms']} ms, "
+                      f"p95: {latency_stats[filename]['p95_ms']} ms")
         
         except Exception as e:
             print(f"   ❌ Error procesando {filename}: {e}")
@@ -368,6 +2376,14 @@ def clean_local_m3u_files():
                 'error': str(e)
             }
     
+    save_duplicate_report(url_index)
+    
+    # Latencia p50/p95 por archivo (junto a channels_history.json)
+    try:
+        write_file_atomic(LATENCY_STATS_FILE, json.dumps(latency_stats, indent=4, ensure_ascii=False))
+    except Exception as e:
+        print(f"❌ Error al guardar {LATENCY_STATS_FILE}: {e}")
+    
     return cleaning_results
 
 # --- GESTIÓN DEL HISTORIAL ---
@@ -375,26 +2391,606 @@ def clean_local_m3u_files():
 def save_history(filepath, data):
     """Guarda el historial en un archivo JSON."""
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+        write_file_atomic(filepath, json.dumps(data, indent=4, ensure_ascii=False))
         print(f"\n💾 Historial guardado: {filepath}")
         return True
     except Exception as e:
         print(f"❌ Error al guardar {filepath}: {e}")
         return False
 
+# --- CACHÉ DE LOGOS ---
+
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+)
+
+def image_extension(data):
+    """Extensión según la firma del contenido, o None si no parece una imagen."""
+    for signature, extension in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return extension
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return '.webp'
+    if b'<svg' in data[:1024].lower():
+        return '.svg'
+    return None
+
+def make_thumbnail(data, size=LOGO_SIZE):
+    """
+    Reduce la imagen a `size` px por lado y la codifica como PNG. Retorna
+    None si ya es pequeña, si Pillow no está instalado o si no la puede
+    decodificar (p. ej. SVG); en esos casos se guarda el original.
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if max(image.size) <= size:
+                return None
+            if image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+                image = image.convert('RGBA')
+            image.thumbnail((size, size))
+            output = io.BytesIO()
+            image.save(output, format='PNG', optimize=True)
+            return output.getvalue()
+    except Exception:
+        return None
+
+def store_logo(data):
+    """
+    Guarda un logo en el almacén direccionado por contenido y retorna su
+    ruta (LOGO_DIR/ab/abcd....ext). El nombre es el SHA-256 del original, así
+    que el mismo logo servido desde varias URLs se guarda y se reduce una sola vez.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    directory = f"{LOGO_DIR}/{digest[:2]}"
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.startswith(digest):
+                return f"{directory}/{name}"
+    
+    thumbnail = make_thumbnail(data)
+    path = f"{directory}/{digest}{'.png' if thumbnail else image_extension(data)}"
+    os.makedirs(directory, exist_ok=True)
+    write_file_atomic(path, thumbnail or data)
+    return path
+
+def logo_reference(path):
+    """Valor de tvg-logo para un logo del almacén."""
+    return f"{LOGO_BASE_URL.rstrip('/')}/{path}" if LOGO_BASE_URL else path
+
+def logo_store_path(tvg_logo):
+    """Ruta en el almacén a la que apunta un tvg-logo ya reescrito, o None."""
+    prefix = f"{LOGO_BASE_URL.rstrip('/')}/" if LOGO_BASE_URL else ''
+    if tvg_logo.startswith(prefix + LOGO_DIR + '/'):
+        return tvg_logo[len(prefix):]
+    return None
+
+class LogoResult:
+    """
+    Resultado de descargar un logo. `path` es la copia en el almacén si se
+    descargó (o None con `not_modified` si el servidor respondió 304).
+    `error` sigue las categorías de ProbeResult ('timeout', 'connection',
+    'http') más 'not_image' y 'too_large'.
+    """
+    __slots__ = ('url', 'alive', 'error', 'status_code', 'path', 'etag', 'last_modified',
+                 'not_modified')
+    
+    def __init__(self, url):
+        self.url = url
+        self.alive = False
+        self.error = None
+        self.status_code = None
+        self.path = None
+        self.etag = None
+        self.last_modified = None
+        self.not_modified = False
+    
+    def __repr__(self):
+        return f"LogoResult({self.url!r}, path={self.path!r}, error={self.error!r})"
+
+def fetch_logo(url, etag=None, last_modified=None):
+    """Descarga un logo con los validadores guardados, lo verifica y lo guarda en el almacén."""
+    result = LogoResult(url)
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    
+    try:
+        response = get_session().get(url, headers=headers, timeout=DOWNLOAD_TIMEOUT, stream=True)
+        result.status_code = response.status_code
+        if response.status_code == 304:
+            response.close()
+            result.alive = result.not_modified = True
+            return result
+        if response.status_code >= 400:
+            response.close()
+            result.error = 'http'
+            return result
+        result.etag = response.headers.get('ETag')
+        result.last_modified = response.headers.get('Last-Modified')
+        data = read_bounded(response, LOGO_MAX_BYTES + 1)
+    except requests.exceptions.Timeout:
+        result.error = 'timeout'
+        return result
+    except requests.exceptions.RequestException:
+        result.error = 'connection'
+        return result
+    
+    if len(data) > LOGO_MAX_BYTES:
+        result.error = 'too_large'
+    elif not image_extension(data):
+        result.error = 'not_image'
+    else:
+        result.path = store_logo(data)
+        result.alive = True
+    return result
+
+def is_broken_logo(result):
+    """Un logo está roto si el servidor lo niega (4xx) o lo que sirve no es una imagen válida."""
+    if result.error == 'http':
+        return result.status_code is not None and result.status_code < 500
+    return result.error in ('not_image', 'too_large')
+
+class LogoCache:
+    """
+    Guarda en SQLite, por URL de logo, los validadores HTTP (ETag /
+    Last-Modified) y la ruta de su copia en el almacén (vacía si el logo
+    está roto), para volver a pedirlo de forma condicional en las
+    siguientes ejecuciones. `references` es el valor de tvg-logo de cada URL
+    resuelta (ver with_cached_logos) y `seen` las URLs vistas al escribir.
+    """
+    
+    def __init__(self, path=STATE_DB_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS logo_assets ("
+            " url TEXT PRIMARY KEY,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " path TEXT NOT NULL,"
+            " checked_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+        self.references = {
+            url: logo_reference(path) if path else ''
+            for url, (_, _, path) in self.get_entries().items()
+            if not path or os.path.exists(path)
+        }
+        self.seen = set()
+    
+    def get_entries(self):
+        """Retorna {url: (etag, last_modified, path)}."""
+        rows = self.conn.execute("SELECT url, etag, last_modified, path FROM logo_assets")
+        return {url: (etag, last_modified, path) for url, etag, last_modified, path in rows}
+    
+    def store(self, entries, now=None):
+        """Guarda {url: (etag, last_modified, path)}."""
+        now = now if now is not None else time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO logo_assets (url, etag, last_modified, path, checked_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            [(url, etag, last_modified, path, now)
+             for url, (etag, last_modified, path) in entries.items()]
+        )
+        self.conn.commit()
+    
+    def prune(self, max_age=CACHE_MAX_AGE, now=None):
+        """Elimina los logos que no aparecen en ninguna lista desde hace `max_age` segundos."""
+        now = now if now is not None else time.time()
+        self.conn.execute("DELETE FROM logo_assets WHERE checked_at < ?", (now - max_age,))
+        self.conn.commit()
+    
+    def close(self):
+        self.conn.close()
+
+# Planificador propio para los logos: mismos límites por host y breaker que
+# la validación, sin mezclar sus estadísticas con las de los streams
+logo_scheduler = HostScheduler()
+
+def fetch_logos(urls, entries):
+    """Descarga en paralelo los logos de `urls` (condicional si hay copia guardada)."""
+    def fetch(url):
+        etag, last_modified, path = entries.get(url, (None, None, None))
+        if not path or not os.path.exists(path):
+            etag = last_modified = None
+        result = logo_scheduler.run(url, lambda u: fetch_logo(u, etag, last_modified))
+        if isinstance(result, ProbeResult):  # Descartado por el breaker o la fecha límite
+            skipped, result = result, LogoResult(url)
+            result.error = skipped.error
+        return result
+    
+    pending = interleave_by_host(urls)
+    if not pending:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(pending))) as executor:
+        return dict(zip(pending, executor.map(fetch, pending)))
+
+def remove_unreferenced_logos(referenced):
+    """Borra del almacén los archivos que ya no usa ninguna lista. Retorna cuántos borró."""
+    removed = 0
+    for directory, _, names in os.walk(LOGO_DIR):
+        for name in names:
+            path = f"{directory}/{name}".replace(os.sep, '/')
+            if path not in referenced:
+                os.remove(path)
+                mark_changed(path)
+                removed += 1
+    return removed
+
+def cache_logos(logo_cache):
+    """
+    Fase opcional (LOGO_CACHE): descarga los tvg-logo de todas las listas
+    locales (y los que with_cached_logos ya escribió como copia) a través
+    del planificador por host y los guarda en el almacén direccionado por
+    contenido. Las Fases 1 y 2 ya escriben los tvg-logo resueltos; aquí solo
+    se reescriben las listas con logos nuevos o cuya copia cambió.
+    
+    Un logo que no responde (timeout, conexión, 5xx) conserva su copia
+    anterior o su URL original; uno roto (4xx, no es imagen) se quita del
+    canal. Retorna un diccionario con estadísticas.
+    """
+    print("\n" + "="*60)
+    print("🖼️  FASE 3: CACHÉ DE LOGOS")
+    print("="*60)
+    if Image is None:
+        print("   ⚠️  Pillow no está instalado: los logos se guardan sin reducir")
+    
+    playlists = {}
+    for filename in local_playlists():
+        with open(filename, 'r', encoding='utf-8') as f:
+            playlists[filename] = list(iter_m3u_channels(f))
+    
+    urls = list(dict.fromkeys(
+        [channel.tvg_logo for channels in playlists.values() for channel in channels
+         if channel.tvg_logo.startswith(('http://', 'https://')) and not logo_store_path(channel.tvg_logo)]
+        + sorted(logo_cache.seen)
+    ))
+    print(f"   🔗 {len(urls)} URLs de logo únicas en {len(playlists)} listas")
+    
+    entries = logo_cache.get_entries()
+    results = fetch_logos(urls, entries)
+    
+    # URL original → nuevo valor de tvg-logo ('' si el logo está roto)
+    replacements = {}
+    stored = {}
+    stats = {'downloaded': 0, 'not_modified': 0, 'broken': 0, 'unavailable': 0}
+    for url, result in results.items():
+        previous = entries.get(url)
+        if result.path:
+            stats['downloaded'] += 1
+            stored[url] = (result.etag, result.last_modified, result.path)
+        elif result.alive and previous:
+            stats['not_modified'] += 1
+            stored[url] = (result.etag or previous[0], result.last_modified or previous[1], previous[2])
+        elif is_broken_logo(result):
+            # Se recuerda como roto (ruta vacía) para no volver a escribirlo
+            stats['broken'] += 1
+            stored[url] = (None, None, '')
+            replacements[url] = ''
+            continue
+        else:
+            stats['unavailable'] += 1
+            if previous and os.path.exists(previous[2]):
+                stored[url] = previous
+            else:
+                continue
+        replacements[url] = logo_reference(stored[url][2])
+    logo_cache.store(stored)
+    logo_cache.prune()
+    
+    # Las listas ya escritas con una copia que cambió pasan a la nueva, salvo
+    # que otra URL siga usando la anterior (copias compartidas por contenido)
+    previous_references = {url: logo_cache.references[url] for url in replacements
+                           if url in logo_cache.references}
+    still_used = {reference for url, reference in logo_cache.references.items()
+                  if replacements.get(url, reference) == reference}
+    for url, reference in previous_references.items():
+        if reference and reference != replacements[url] and reference not in still_used:
+            replacements[reference] = replacements[url]
+    run_metrics.count('logos_downloaded', stats['downloaded'])
+    run_metrics.count('logos_not_modified', stats['not_modified'])
+    
+    referenced = set(path for _, _, path in logo_cache.get_entries().values() if path)
+    for filename, channels in playlists.items():
+        rewritten = []
+        updated = False
+        for channel in channels:
+            new_logo = replacements.get(channel.tvg_logo)
+            if new_logo is not None and new_logo != channel.tvg_logo:
+                channel = with_logo(channel, new_logo)
+                updated = True
+            path = logo_store_path(channel.tvg_logo)
+            if path:
+                referenced.add(path)
+            rewritten.append(channel)
+        if updated:
+            save_m3u_content(filename, rewritten)
+    stats['removed'] = remove_unreferenced_logos(referenced)
+    
+    print(f"   ✅ {stats['downloaded']} descargados, {stats['not_modified']} sin cambios (304), "
+          f"{stats['broken']} rotos quitados, {stats['unavailable']} sin respuesta, "
+          f"{stats['removed']} copias sin uso borradas")
+    return stats
+
+# --- SALIDAS DERIVADAS ---
+
+def group_slug(group_title):
+    """Nombre de archivo para un group-title ("Películas" → "peliculas")."""
+    text = unicodedata.normalize('NFKD', group_title).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-') or 'sin-grupo'
+
+def index_m3u_bytes(data):
+    """
+    Recorre el contenido de una lista y retorna [(Channel, offset, length)],
+    donde offset/length delimitan en bytes el bloque del canal (desde su
+    #EXTINF hasta el final de su URL), para pedirlo con un Range.
+    """
+    entries = []
+    offset = 0
+    start = extinf = None
+    options = []
+    for raw_line in data.splitlines(keepends=True):
+        line = raw_line.decode('utf-8', 'replace').strip()
+        if line.startswith('#EXTINF'):
+            start, extinf, options = offset, line, []
+        elif line.startswith('#'):
+            if extinf is not None:
+                options.append(line)
+        elif line and extinf is not None:
+            end = offset + len(raw_line.rstrip(b'\r\n'))
+            entries.append((Channel(extinf, line, options), start, end - start))
+            extinf = None
+        offset += len(raw_line)
+    return entries
+
+def compressed_variants(data):
+    """Variantes comprimidas de una lista: {extensión: bytes} (.br solo si hay brotli)."""
+    buffer = io.BytesIO()
+    # mtime=0 y sin nombre: mismo contenido → mismo .gz (no se reescribe)
+    with gzip.GzipFile(filename='', mode='wb', fileobj=buffer, compresslevel=9, mtime=0) as gz:
+        gz.write(data)
+    variants = {'.gz': buffer.getvalue()}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, mode=brotli.MODE_TEXT, quality=11)
+    return variants
+
+def write_derived_outputs(m3u_files=None):
+    """
+    Escribe, para cada lista local, sus salidas derivadas (DERIVED_OUTPUTS):
+    las variantes .m3u.gz/.m3u.br, una lista por group-title en
+    GROUPS_DIR/<lista>/<grupo>.m3u (un canal con "A;B" va a ambos grupos)
+    y su entrada en CHANNEL_INDEX_FILE. Solo se reescribe lo que cambió y se
+    borran las listas de grupo que ya no existen. Retorna la cantidad de
+    archivos modificados.
+    """
+    print("\n" + "="*60)
+    print("📦 SALIDAS DERIVADAS (comprimidas, índice y listas por grupo)")
+    print("="*60)
+    if brotli is None:
+        print("   ⚠️  Módulo brotli no instalado: solo se generan variantes .gz")
+    
+    if m3u_files is None:
+        m3u_files = local_playlists()
+    changed_before = len(changed_files)
+    index = {'fields': ['name', 'group', 'tvg_id', 'offset', 'length'], 'files': {}}
+    group_files = set()
+    
+    for filename in m3u_files:
+        with open(filename, 'rb') as f:
+            data = f.read()
+        for extension, content in compressed_variants(data).items():
+            write_file_atomic(filename + extension, content)
+        
+        entries = index_m3u_bytes(data)
+        index['files'][filename] = {
+            'bytes': len(data),
+            'sha256': hashlib.sha256(data).hexdigest(),
+            'channels': [[channel.name, channel.group_title, channel.tvg_id, offset, length]
+                         for channel, offset, length in entries],
+        }
+        
+        groups = {}
+        for channel, _, _ in entries:
+            titles = [title.strip() for title in channel.group_title.split(';') if title.strip()]
+            for slug in dict.fromkeys(group_slug(title) for title in titles or ['']):
+                groups.setdefault(slug, []).append(channel)
+        directory = f"{GROUPS_DIR}/{os.path.splitext(filename)[0]}"
+        if groups:
+            os.makedirs(directory, exist_ok=True)
+        for slug, channels in groups.items():
+            path = f"{directory}/{slug}.m3u"
+            write_file_atomic(path, render_m3u(channels))
+            group_files.add(path)
+    
+    write_file_atomic(CHANNEL_INDEX_FILE,
+                      json.dumps(index, ensure_ascii=False, separators=(',', ':')))
+    
+    # Listas de grupo que ya no corresponden a ningún canal
+    removed = 0
+    for directory, _, names in os.walk(GROUPS_DIR):
+        for name in names:
+            path = f"{directory}/{name}".replace(os.sep, '/')
+            if path not in group_files:
+                os.remove(path)
+                mark_changed(path)
+                removed += 1
+    
+    changed = len(changed_files) - changed_before
+    total = sum(len(entry['channels']) for entry in index['files'].values())
+    print(f"   ✅ {len(m3u_files)} listas, {total} canales indexados, "
+          f"{len(group_files)} listas por grupo; {changed} archivos modificados "
+          f"({removed} listas de grupo borradas)")
+    return changed
+
+# --- EJECUCIÓN EN SHARDS ---
+#
+# La validación puede repartirse entre varios procesos o máquinas (por
+# ejemplo, una matriz de jobs de GitHub Actions) en tres pasos:
+#
+#   python check_m3u.py --plan                               # descarga las fuentes
+#   python check_m3u.py --shard-index I --shard-count N      # en cada shard
+#   python check_m3u.py --merge --shard-count N              # arma los resultados
+#
+# El plan congela el contenido de las fuentes y las URLs a verificar; cada
+# shard verifica su partición determinista de URLs; el merge ejecuta el flujo
+# normal con esas descargas y esos resultados (incluida la histéresis de
+# fallos), y suma las estadísticas por host de los shards a las métricas.
+#
+# Diferencias con una ejecución de un solo proceso, por diseño:
+#   • cada shard tiene sus propios circuit breakers: un host caído se
+#     descarta por separado en cada shard que tenga URLs suyas
+#   • los shards reintentan (retry_failed_urls) todas sus URLs caídas, también
+#     las que en un solo proceso solo se verificarían en la Fase 1, y el merge
+#     no reintenta nada
+#   • cada shard tiene su propio presupuesto de tiempo (RUN_BUDGET)
+
+SHARD_DIR = os.environ.get('IPTV_SHARD_DIR', 'shards')
+SHARD_PLAN_FILE = 'plan.json'
+
+def remote_source_urls():
+    """URLs de todas las fuentes remotas, en el orden en que se procesan."""
+    return [MOVIES_SOURCE_URL, MUSIC_SOURCE_URL, RELIGION_SOURCE_URL] + list(COUNTRY_SOURCES)
+
+def shard_of(url, shard_count):
+    """Shard al que pertenece una URL (estable entre procesos y máquinas)."""
+    return zlib.crc32(url.encode('utf-8')) % shard_count
+
+def shard_result_path(shard_dir, shard_index, shard_count):
+    return os.path.join(shard_dir, f"shard-{shard_index}-of-{shard_count}.json")
+
+def build_shard_plan(shard_dir=SHARD_DIR):
+    """
+    Descarga las fuentes remotas y guarda en `shard_dir` su contenido junto
+    con todas las URLs que verificaría una ejecución completa: las de los
+    canales que pasan el filtro de cada fuente y las de las listas locales.
+    """
+    if FANOUT_MODE:
+        downloads = download_index_fanout(remote_source_urls())
+        for download in downloads.values():
+            if 'channels' in download:
+                download['text'] = render_m3u(download.pop('channels'))
+    else:
+        downloads = download_sources(remote_source_urls())
+    urls = {}
+    for source_url, download in downloads.items():
+        if download['status'] != 'updated':
+            continue
+        for channel in iter_m3u_channels(download['text'].splitlines()):
+            if source_url == MOVIES_SOURCE_URL and not is_latin_channel(
+                    channel.extinf, channel.url, channel.attributes):
+                continue
+            urls[channel.url] = None
+    for filename in local_playlists():
+        with open(filename, 'r', encoding='utf-8') as f:
+            urls.update((channel.url, None) for channel in iter_m3u_channels(f))
+    
+    os.makedirs(shard_dir, exist_ok=True)
+    plan = {'downloads': downloads, 'urls': list(urls)}
+    write_file_atomic(os.path.join(shard_dir, SHARD_PLAN_FILE), json.dumps(plan, ensure_ascii=False),
+                      track=False)
+    print(f"🗺️  Plan guardado en {shard_dir}: {len(downloads)} fuentes, {len(urls)} URLs únicas")
+
+def load_shard_plan(shard_dir=SHARD_DIR):
+    with open(os.path.join(shard_dir, SHARD_PLAN_FILE), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def run_shard(shard_index, shard_count, shard_dir=SHARD_DIR):
+    """Verifica (con reintentos) la partición de URLs del shard y guarda sus resultados."""
+    plan = load_shard_plan(shard_dir)
+    urls = [url for url in plan['urls'] if shard_of(url, shard_count) == shard_index]
+    print(f"🧩 Shard {shard_index + 1}/{shard_count}: {len(urls)} de {len(plan['urls'])} URLs")
+    
+    run_deadline.start(RUN_BUDGET)
+    cache = UrlStatusCache()
+    cache.load_local_urls(local_playlists())
+    url_status = validate_urls(urls, cache=cache)
+    retry_failed_urls(url_status, cache=cache)
+    cache.close()
+    
+    partial = {
+        'results': {url: result.to_dict() for url, result in url_status.items()},
+        'hosts': host_scheduler.stats,  # Para las métricas del merge
+    }
+    write_file_atomic(shard_result_path(shard_dir, shard_index, shard_count),
+                      json.dumps(partial, ensure_ascii=False), track=False)
+    alive = sum(1 for result in url_status.values() if result.alive)
+    print(f"✅ Shard {shard_index + 1}/{shard_count}: {alive} vivas, {len(url_status) - alive} caídas")
+
+def load_shard_results(shard_count, shard_dir=SHARD_DIR):
+    """
+    Une los resultados parciales de todos los shards. Retorna
+    ({url: ProbeResult}, [estadísticas por host de cada shard]).
+    """
+    results = {}
+    host_stats = []
+    for shard_index in range(shard_count):
+        path = shard_result_path(shard_dir, shard_index, shard_count)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Faltan los resultados del shard {shard_index + 1}/{shard_count}: {path}")
+        with open(path, 'r', encoding='utf-8') as f:
+            partial = json.load(f)
+        results.update((url, ProbeResult.from_dict(data)) for url, data in partial['results'].items())
+        host_stats.append(partial['hosts'])
+    return results, host_stats
+
 # --- FLUJO PRINCIPAL ---
 
-def main():
-    global url_status_cache
-    url_status_cache = {}
+def print_host_health():
+    """Muestra los hosts con problemas detectados durante la ejecución."""
+    hosts = host_scheduler.unhealthy_hosts()
+    if not hosts:
+        print("🌐 Todos los hosts respondieron sin fallos")
+        return
+    print("🌐 Hosts con problemas:")
+    for host, stats in hosts:
+        status = "⛔ breaker abierto:" if stats['tripped'] else "⚠️  con fallos:"
+        print(f"   {status} {host}: {stats['alive']} vivos, {stats['dead']} caídos, "
+              f"{stats['skipped']} descartados")
+
+def main(downloads=None, shard_results=None, shard_hosts=()):
+    """
+    Ejecución completa. En el merge de shards se pasan las descargas del plan
+    (`downloads`), los resultados de los shards (`shard_results`) y sus
+    estadísticas por host (`shard_hosts`, para las métricas): las URLs ya
+    verificadas no se vuelven a verificar ni a reintentar.
+    """
+    host_scheduler.reset()
+    for stats in shard_hosts:
+        host_scheduler.add_stats(stats)
+    logo_scheduler.reset()
+    run_metrics.reset()
+    run_deadline.start(RUN_BUDGET)
+    changed_files.clear()
     
     print("="*60)
     print("🚀 SISTEMA DE ACTUALIZACIÓN Y LIMPIEZA DE LISTAS IPTV")
     print("="*60)
     print(f"⏰ Inicio: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    if RUN_BUDGET:
+        print(f"⌛ Presupuesto de tiempo: {RUN_BUDGET}s")
     print("="*60)
     
+    # Caché persistente: evita volver a verificar en la Fase 2 lo que ya se
+    # verificó en la Fase 1, y entre ejecuciones lo que aún está vigente
+    cache = UrlStatusCache()
+    cache.prune()
+    cache.load_local_urls(local_playlists())
+    if shard_results:
+        cache.add_preset(shard_results)
+        cache.store({url: r for url, r in shard_results.items() if r.error not in ('circuit_open', 'deadline')})
+    source_cache = RemoteSourceCache()
+    history = ChannelHistoryStore()
+    history.start_run()
+    # Con la caché de logos las listas se escriben ya con sus copias (Fase 3)
+    logo_cache = LogoCache() if LOGO_CACHE else None
+    
     # ========================================
     # FASE 1: ACTUALIZAR DESDE FUENTES REMOTAS
     # ========================================
@@ -405,43 +3001,83 @@ def main():
     
     remote_channels_data = {}
     
+    # Descargar todas las fuentes en paralelo (condicional con ETag/Last-Modified).
+    # En modo pipeline cada fuente se descarga en streaming al procesarla, y
+    # en modo índice único (IPTV_FANOUT) se descarga solo el índice de iptv-org.
+    if downloads is None:
+        downloads = {}
+        if FANOUT_MODE:
+            with run_metrics.phase('download'):
+                downloads = download_index_fanout(remote_source_urls(), source_cache=source_cache)
+        elif not STREAMING_PIPELINE:
+            with run_metrics.phase('download'):
+                downloads = download_sources(remote_source_urls(), source_cache=source_cache)
+    update_start = time.monotonic()
+    
     # 1. 🎬 PROCESAR CINE.M3U (CON FILTRO DE ESPAÑOL/LATINO)
     print("\n🎬 Procesando lista de CINE (con filtro de español)")
-    filename, count = process_remote_list(
-        MOVIES_SOURCE_URL, 
-        CINE_FILENAME, 
-        apply_latin_filter=True
-    )
+    with run_metrics.file(CINE_FILENAME, 'update'):
+        filename, count = process_remote_list(
+            MOVIES_SOURCE_URL, 
+            CINE_FILENAME, 
+            apply_latin_filter=True,
+            cache=cache,
+            download=downloads.get(MOVIES_SOURCE_URL),
+            source_cache=source_cache,
+            history=history,
+            logos=logo_cache
+        )
     remote_channels_data[filename] = count
     
     # 2. 🎵 PROCESAR MÚSICA.M3U (SIN FILTRO - TODOS LOS IDIOMAS)
     print("\n🎵 Procesando lista de MÚSICA (todos los idiomas)")
-    filename, count = process_remote_list(
-        MUSIC_SOURCE_URL, 
-        MUSIC_FILENAME, 
-        apply_latin_filter=False
-    )
+    with run_metrics.file(MUSIC_FILENAME, 'update'):
+        filename, count = process_remote_list(
+            MUSIC_SOURCE_URL, 
+            MUSIC_FILENAME, 
+            apply_latin_filter=False,
+            cache=cache,
+            download=downloads.get(MUSIC_SOURCE_URL),
+            source_cache=source_cache,
+            history=history,
+            logos=logo_cache
+        )
     remote_channels_data[filename] = count
     
     # 3. 🙏 PROCESAR RELIGIÓN.M3U (SIN FILTRO - Pluto TV España)
     print("\n🙏 Procesando lista de RELIGIÓN (Pluto TV España)")
-    filename, count = process_remote_list(
-        RELIGION_SOURCE_URL, 
-        RELIGION_FILENAME, 
-        apply_latin_filter=False
-    )
+    with run_metrics.file(RELIGION_FILENAME, 'update'):
+        filename, count = process_remote_list(
+            RELIGION_SOURCE_URL, 
+            RELIGION_FILENAME, 
+            apply_latin_filter=False,
+            cache=cache,
+            download=downloads.get(RELIGION_SOURCE_URL),
+            source_cache=source_cache,
+            history=history,
+            logos=logo_cache
+        )
     remote_channels_data[filename] = count
     
     # 4. 🌎 PROCESAR LISTAS DE PAÍSES (SIN FILTRO)
     print("\n🌎 Procesando listas de países")
     for source_url, filename in COUNTRY_SOURCES.items():
-        filename, count = process_remote_list(
-            source_url, 
-            filename, 
-            apply_latin_filter=False
-        )
+        with run_metrics.file(filename, 'update'):
+            filename, count = process_remote_list(
+                source_url, 
+                filename, 
+                apply_latin_filter=False,
+                cache=cache,
+                download=downloads.get(source_url),
+                source_cache=source_cache,
+                history=history,
+                logos=logo_cache
+            )
         remote_channels_data[filename] = count
     
+    source_cache.close()
+    run_metrics.record_phase('update', time.monotonic() - update_start)
+    
     # Guardar historial de actualización remota
     save_history(HISTORY_FILE, remote_channels_data)
     
@@ -449,15 +3085,32 @@ def main():
     # FASE 2: LIMPIAR ARCHIVOS M3U LOCALES
     # ========================================
     
-    # Limpiar el caché de URLs para la fase de limpieza
-    url_status_cache.clear()
-    
-    cleaning_results = clean_local_m3u_files()
+    with run_metrics.phase('clean'):
+        cleaning_results = clean_local_m3u_files(cache=cache, history=history,
+                                                 retry=shard_results is None, logos=logo_cache)
+    failing = cache.save_failures()
+    cache.close()
+    history.finish_run()
+    history.close()
     
     # Guardar historial de limpieza
     if cleaning_results:
         save_history(CLEANING_HISTORY_FILE, cleaning_results)
     
+    # ========================================
+    # FASE 3 (OPCIONAL): CACHÉ DE LOGOS
+    # ========================================
+    
+    if logo_cache:
+        with run_metrics.phase('logos'):
+            cache_logos(logo_cache)
+            logo_cache.close()
+    
+    # Variantes comprimidas, índice y listas por grupo de las listas finales
+    if DERIVED_OUTPUTS:
+        with run_metrics.phase('outputs'):
+            write_derived_outputs()
+    
     # ========================================
     # RESUMEN FINAL
     # ========================================
@@ -468,7 +3121,53 @@ def main():
     print(f"⏰ Finalizado: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"📊 Archivos actualizados: {len(remote_channels_data)}")
     print(f"🧹 Archivos limpiados: {len(cleaning_results)}")
+    print(f"📝 Archivos modificados: {len(changed_files)}")
+    metrics = run_metrics.save(host_scheduler)
+    if metrics['counters'].get('deadline_skipped'):
+        print(f"⌛ Presupuesto de {RUN_BUDGET}s agotado: {metrics['counters']['deadline_skipped']} "
+              f"URLs quedaron sin verificar y conservaron su estado previo")
+    print(f"⏱️  Duración: {metrics['duration_s']:.0f}s "
+          f"({', '.join(f'{name} {seconds:.0f}s' for name, seconds in metrics['phases'].items())}); "
+          f"{metrics['counters']['probes']} verificaciones, {metrics['counters']['cache_hits']} desde caché, "
+          f"{metrics['counters']['timeouts']} timeouts")
+    if failing:
+        print(f"⏳ URLs conocidas caídas en esta ejecución: {failing} "
+              f"(se eliminan tras {FAILURE_THRESHOLD} ejecuciones seguidas)")
+    print_host_health()
+    
+    # Lista de archivos modificados para los pasos siguientes (Telegram, git)
+    with open(CHANGED_FILES_FILE, 'w', encoding='utf-8') as f:
+        json.dump(changed_files, f, indent=4, ensure_ascii=False)
     print("="*60)
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Actualización y limpieza de listas IPTV")
+    parser.add_argument('--plan', action='store_true',
+                        help="descargar las fuentes y preparar la ejecución en shards")
+    parser.add_argument('--shard-index', type=int, help="índice del shard (desde 0)")
+    parser.add_argument('--shard-count', type=int, help="cantidad total de shards")
+    parser.add_argument('--merge', action='store_true',
+                        help="armar listas e historiales con los resultados de todos los shards")
+    parser.add_argument('--shard-dir', default=SHARD_DIR, help="directorio del plan y resultados parciales")
+    args = parser.parse_args(argv)
+    
+    if args.shard_index is not None and not args.shard_count:
+        parser.error("--shard-index requiere --shard-count")
+    if args.shard_index is not None and not 0 <= args.shard_index < args.shard_count:
+        parser.error("--shard-index debe estar entre 0 y --shard-count - 1")
+    if args.merge and not args.shard_count:
+        parser.error("--merge requiere --shard-count")
+    return args
+
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.plan:
+        build_shard_plan(args.shard_dir)
+    elif args.merge:
+        plan = load_shard_plan(args.shard_dir)
+        shard_results, shard_hosts = load_shard_results(args.shard_count, args.shard_dir)
+        main(downloads=plan['downloads'], shard_results=shard_results, shard_hosts=shard_hosts)
+    elif args.shard_index is not None:
+        run_shard(args.shard_index, args.shard_count, args.shard_dir)
+    else:
+        main()
@@ -9,19 +9,45 @@ VERSIÓN MEJORADA: Envía dos reportes diferenciados
 """
 
 import os
+import re
 import json
+import time
+import sqlite3
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
 # Configuración desde variables de entorno
 BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
-CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID')
+# Uno o varios chats separados por comas o espacios
+CHAT_IDS = [chat for chat in re.split(r'[,\s]+', os.environ.get('TELEGRAM_CHAT_ID', '')) if chat]
 HISTORY_FILE = 'channels_history.json'
 CLEANING_HISTORY_FILE = 'cleaning_history.json'
+CHANGED_FILES_FILE = 'changed_files.json'
+METRICS_FILE = 'run_metrics.json'
+MAX_HOSTS_LENTOS = 5       # Hosts más lentos mostrados en el reporte
+# Historial por canal que escribe check_m3u.py (tablas runs / observations)
+STATE_DB_FILE = os.environ.get('IPTV_STATE_DB', 'iptv_state.db')
+UPTIME_RUNS = 10           # Ejecuciones consideradas para el uptime
+MAX_CANALES_INESTABLES = 15  # Canales de menor uptime mostrados en el reporte de limpieza
 
-def cargar_historial(filepath):
-    """Carga un historial desde archivo JSON (con manejo de errores)"""
+# Entrega: Telegram corta los mensajes en 4096 caracteres y responde 429 con
+# `retry_after` al superar su límite de envíos
+TELEGRAM_MAX_CHARS = 4096
+TELEGRAM_REINTENTOS = 5
+TELEGRAM_ESPERA = 2        # Segundos de espera base entre reintentos (se duplica)
+
+def cargar_historial(filepath, conn=None, run_id=None):
+    """
+    Carga un historial. Si se indica una ejecución del historial SQLite
+    (conn + run_id) se consulta la base; si no, se lee el archivo JSON
+    (con manejo de errores)
+    """
+    if conn is not None and run_id is not None:
+        fase = 'clean' if filepath == CLEANING_HISTORY_FILE else 'update'
+        return historial_desde_db(conn, run_id, fase)
+    
     if not Path(filepath).exists():
         return {}
     
@@ -49,6 +75,142 @@ def cargar_historial(filepath):
         print(f"⚠️  Error cargando {filepath}: {e}")
         return {}
 
+# ========================================
+# HISTORIAL POR CANAL (SQLite)
+# ========================================
+
+def abrir_historial_db():
+    """Abre el historial por canal si existe y tiene el esquema esperado (o None)"""
+    if not Path(STATE_DB_FILE).exists():
+        return None
+    try:
+        conn = sqlite3.connect(STATE_DB_FILE)
+        conn.execute("SELECT 1 FROM runs JOIN observations USING (run_id) LIMIT 1")
+        return conn
+    except sqlite3.Error as e:
+        print(f"⚠️  Historial por canal no disponible: {e}")
+        return None
+
+def ultimas_ejecuciones(conn, cantidad=2):
+    """IDs de las últimas ejecuciones terminadas, de la más reciente a la más antigua"""
+    filas = conn.execute(
+        "SELECT run_id FROM runs WHERE finished_at IS NOT NULL ORDER BY run_id DESC LIMIT ?",
+        (cantidad,)
+    )
+    return [fila[0] for fila in filas]
+
+def historial_desde_db(conn, run_id, fase):
+    """Conteos por archivo de una ejecución, con el mismo formato que los JSON"""
+    filas = conn.execute(
+        "SELECT file, COUNT(*), SUM(COALESCE(kept, status)), SUM(kept = 1 AND status = 0)"
+        " FROM observations WHERE run_id = ? AND phase = ? GROUP BY file",
+        (run_id, fase)
+    )
+    if fase == 'update':
+        return {archivo: vivos for archivo, _, vivos, _ in filas}
+    return {
+        archivo: {'before': total, 'after': vivos, 'removed': total - vivos, 'failing': caidos or 0}
+        for archivo, total, vivos, caidos in filas
+    }
+
+def diferencias_canales(conn, run_actual, run_previo, fase='update'):
+    """
+    Canales vivos que aparecieron o desaparecieron entre dos ejecuciones.
+    Retorna {archivo: {'nuevos': [nombres], 'caidos': [nombres]}}
+    """
+    consulta = (
+        "SELECT o.file, o.name FROM observations o"
+        " WHERE o.run_id = ? AND o.phase = ? AND COALESCE(o.kept, o.status) = 1 AND NOT EXISTS ("
+        "  SELECT 1 FROM observations p WHERE p.run_id = ? AND p.phase = o.phase"
+        "  AND p.file = o.file AND p.url = o.url AND COALESCE(p.kept, p.status) = 1)"
+        " ORDER BY o.file, o.name"
+    )
+    cambios = {}
+    for clave, (run_a, run_b) in (('nuevos', (run_actual, run_previo)),
+                                  ('caidos', (run_previo, run_actual))):
+        for archivo, nombre in conn.execute(consulta, (run_a, fase, run_b)):
+            entrada = cambios.setdefault(archivo, {'nuevos': [], 'caidos': []})
+            entrada[clave].append(nombre or 'Sin nombre')
+    return cambios
+
+def canales_eliminados(conn, run_id):
+    """Nombres de los canales caídos en la limpieza de una ejecución, por archivo"""
+    eliminados = {}
+    filas = conn.execute(
+        "SELECT file, name FROM observations"
+        " WHERE run_id = ? AND phase = 'clean' AND COALESCE(kept, status) = 0 ORDER BY file, name",
+        (run_id,)
+    )
+    for archivo, nombre in filas:
+        eliminados.setdefault(archivo, []).append(nombre or 'Sin nombre')
+    return eliminados
+
+def canales_inestables(conn, ejecuciones=UPTIME_RUNS, limite=MAX_CANALES_INESTABLES):
+    """Canales con menor uptime (fracción de verificaciones vivas) en las últimas ejecuciones"""
+    filas = conn.execute(
+        "SELECT MAX(name), MIN(file), AVG(status) AS uptime FROM observations"
+        " WHERE run_id IN (SELECT run_id FROM runs WHERE finished_at IS NOT NULL"
+        "                  ORDER BY run_id DESC LIMIT ?)"
+        " GROUP BY url HAVING uptime > 0 AND uptime < 1"
+        " ORDER BY uptime ASC LIMIT ?",
+        (ejecuciones, limite)
+    )
+    return [(nombre or 'Sin nombre', archivo, uptime) for nombre, archivo, uptime in filas]
+
+def lineas_nombres(nombres, prefijo):
+    """Líneas de detalle con los nombres de canales (todos: el envío se divide en partes)"""
+    return ''.join(f"   {prefijo} {nombre[:50]}\n" for nombre in nombres)
+
+def cargar_archivos_modificados():
+    """Carga la lista de archivos que check_m3u.py realmente reescribió (o None)"""
+    if not Path(CHANGED_FILES_FILE).exists():
+        return None
+    try:
+        with open(CHANGED_FILES_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"⚠️  Error cargando {CHANGED_FILES_FILE}: {e}")
+        return None
+
+def cargar_metricas():
+    """Carga las métricas de la ejecución que escribe check_m3u.py (o None)"""
+    if not Path(METRICS_FILE).exists():
+        return None
+    try:
+        with open(METRICS_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"⚠️  Error cargando {METRICS_FILE}: {e}")
+        return None
+
+def generar_seccion_rendimiento(metricas):
+    """Duración de la ejecución, por fase, y hosts más lentos (desde run_metrics.json)"""
+    if not metricas:
+        return ""
+    
+    duracion = metricas.get('duration_s', 0)
+    contadores = metricas.get('counters', {})
+    seccion = "⏱️ *RENDIMIENTO*\n"
+    seccion += f"• Duración: {int(duracion // 60)}m {int(duracion % 60)}s\n"
+    fases = metricas.get('phases', {})
+    if fases:
+        seccion += "• Fases: " + ", ".join(f"{fase} {segundos:.0f}s" for fase, segundos in fases.items()) + "\n"
+    seccion += (f"• Verificaciones: {contadores.get('probes', 0)} "
+                f"(caché: {contadores.get('cache_hits', 0)}, timeouts: {contadores.get('timeouts', 0)})\n")
+    if contadores.get('deadline_skipped'):
+        seccion += (f"• ⌛ Tiempo agotado: {contadores['deadline_skipped']} URLs sin verificar "
+                    f"(conservan su estado previo)\n")
+    
+    hosts_lentos = [
+        (host, datos) for host, datos in metricas.get('hosts', {}).items()
+        if datos.get('avg_ms') is not None
+    ][:MAX_HOSTS_LENTOS]
+    if hosts_lentos:
+        seccion += "🐢 Hosts más lentos:\n"
+        for host, datos in hosts_lentos:
+            seccion += f"   • `{host}`: {datos['avg_ms']} ms ({datos['probes']} verif., {datos['timeouts']} timeouts)\n"
+    return seccion + "\n"
+
 def guardar_historial(filepath, historial):
     """Guarda el historial actualizado"""
     try:
@@ -63,8 +225,14 @@ def guardar_historial(filepath, historial):
 # REPORTE 1: ACTUALIZACIÓN (canales nuevos)
 # ========================================
 
-def generar_reporte_actualizacion(canales_actuales, historial_previo):
-    """Genera reporte de canales nuevos desde fuentes remotas"""
+def generar_reporte_actualizacion(canales_actuales, historial_previo, archivos_modificados=None,
+                                  cambios_canales=None, metricas=None):
+    """
+    Genera reporte de canales nuevos desde fuentes remotas. Con
+    `cambios_canales` (del historial SQLite) se nombran los canales que
+    aparecieron o cayeron en cada lista; con `metricas` se agrega la
+    duración de la ejecución y los hosts más lentos
+    """
     total_actual = sum(canales_actuales.values())
     total_previo = sum(historial_previo.values()) if historial_previo else 0
     diferencia = total_actual - total_previo
@@ -85,6 +253,14 @@ def generar_reporte_actualizacion(canales_actuales, historial_previo):
     else:
         reporte += f"• ⚪ Sin cambios\n"
     
+    # Listas que realmente se reescribieron en esta ejecución
+    if archivos_modificados is not None:
+        listas = [a for a in archivos_modificados if a.endswith('.m3u')]
+        if listas:
+            reporte += f"• 📝 {len(listas)} listas reescritas\n"
+        else:
+            reporte += f"• 📝 Ninguna lista cambió de contenido\n"
+    
     reporte += "\n"
     
     # Detalles por archivo
@@ -97,26 +273,32 @@ def generar_reporte_actualizacion(canales_actuales, historial_previo):
         for archivo, count_actual in sorted(canales_actuales.items()):
             count_previo = historial_previo.get(archivo, 0)
             diff = count_actual - count_previo
+            # Con el historial por canal también cuentan los reemplazos (mismo total)
+            reemplazos = bool(cambios_canales and archivo in cambios_canales)
             
-            if diff != 0:
+            if diff != 0 or reemplazos:
                 if diff > 0:
                     emoji = "🟢"
                     texto = f"+{diff}"
-                else:
+                elif diff < 0:
                     emoji = "🔴"
                     texto = str(diff)
+                else:
+                    emoji = "🔄"
+                    texto = "±0"
                 
-                cambios_importantes.append(f"{emoji} `{archivo}`: {count_actual} ({texto})")
+                linea = f"{emoji} `{archivo}`: {count_actual} ({texto})"
+                if reemplazos:
+                    linea += "\n" + lineas_nombres(cambios_canales[archivo]['nuevos'], "➕")
+                    linea += lineas_nombres(cambios_canales[archivo]['caidos'], "➖")
+                    linea = linea.rstrip("\n")
+                cambios_importantes.append(linea)
             else:
                 sin_cambios.append(archivo)
         
         # Mostrar archivos con cambios
-        if cambios_importantes:
-            for linea in cambios_importantes[:10]:
-                reporte += linea + "\n"
-            
-            if len(cambios_importantes) > 10:
-                reporte += f"... y {len(cambios_importantes) - 10} más con cambios\n"
+        for linea in cambios_importantes:
+            reporte += linea + "\n"
         
         # Resumen de archivos sin cambios
         if sin_cambios:
@@ -127,6 +309,9 @@ def generar_reporte_actualizacion(canales_actuales, historial_previo):
         reporte += f"• Total archivos: {len(canales_actuales)}\n"
         reporte += f"• Total canales: {total_actual}\n"
     
+    if metricas:
+        reporte += "\n" + generar_seccion_rendimiento(metricas).rstrip("\n") + "\n"
+    
     reporte += "\n━━━━━━━━━━━━━━━━━━━━━\n"
     reporte += "🤖 Actualización automática"
     
@@ -136,14 +321,18 @@ def generar_reporte_actualizacion(canales_actuales, historial_previo):
 # REPORTE 2: LIMPIEZA (canales eliminados)
 # ========================================
 
-def generar_reporte_limpieza(cleaning_results):
-    """Genera reporte de limpieza de canales muertos"""
+def generar_reporte_limpieza(cleaning_results, eliminados=None, inestables=None):
+    """
+    Genera reporte de limpieza de canales muertos. `eliminados` nombra los
+    canales caídos por lista e `inestables` lista los de menor uptime
+    """
     
     # Calcular totales
     total_archivos = len(cleaning_results)
     total_before = sum(r.get('before', 0) for r in cleaning_results.values())
     total_after = sum(r.get('after', 0) for r in cleaning_results.values())
     total_removed = sum(r.get('removed', 0) for r in cleaning_results.values())
+    total_failing = sum(r.get('failing', 0) for r in cleaning_results.values())
     
     # Header
     reporte = f"🧹 *REPORTE IPTV - LIMPIEZA LOCAL*\n"
@@ -157,10 +346,14 @@ def generar_reporte_limpieza(cleaning_results):
     
     if total_removed > 0:
         reporte += f"• 🔴 *{total_removed} canales eliminados* (muertos)\n"
-        reporte += f"• ✅ {total_after} canales vivos\n"
-    else:
+        reporte += f"• ✅ {total_after - total_failing} canales vivos\n"
+    elif total_failing == 0:
         reporte += f"• ✅ *Todos los canales están vivos*\n"
         reporte += f"• Total vivos: {total_after}\n"
+    else:
+        reporte += f"• ✅ {total_after - total_failing} canales vivos\n"
+    if total_failing > 0:
+        reporte += f"• ⏳ {total_failing} caídos que se conservan (período de gracia)\n"
     
     reporte += "\n"
     
@@ -172,25 +365,33 @@ def generar_reporte_limpieza(cleaning_results):
         removed = stats.get('removed', 0)
         before = stats.get('before', 0)
         after = stats.get('after', 0)
+        failing = stats.get('failing', 0)
         
         if removed > 0:
-            archivos_con_cambios.append(f"🔴 `{archivo}`: -{removed} canales ({after} vivos)")
+            linea = f"🔴 `{archivo}`: -{removed} canales ({after - failing} vivos)"
+            if failing:
+                linea += f", ⏳ {failing} en gracia"
+            if eliminados and archivo in eliminados:
+                linea += "\n" + lineas_nombres(eliminados[archivo], "✖️").rstrip("\n")
+            archivos_con_cambios.append(linea)
+        elif failing:
+            archivos_con_cambios.append(f"⏳ `{archivo}`: {failing} caídos en gracia ({after - failing} vivos)")
         else:
             archivos_sin_cambios.append(archivo)
     
     if archivos_con_cambios:
-        reporte += "📋 *CANALES ELIMINADOS POR LISTA*\n"
-        
-        # Mostrar máximo 15 archivos con cambios
-        for linea in archivos_con_cambios[:15]:
+        reporte += "📋 *CANALES ELIMINADOS O CAÍDOS POR LISTA*\n"
+        for linea in archivos_con_cambios:
             reporte += linea + "\n"
-        
-        if len(archivos_con_cambios) > 15:
-            reporte += f"... y {len(archivos_con_cambios) - 15} archivos más con cambios\n"
     
     if archivos_sin_cambios:
         reporte += f"\n✅ {len(archivos_sin_cambios)} listas sin canales muertos\n"
     
+    if inestables:
+        reporte += f"\n📉 *CANALES INESTABLES* (últimas {UPTIME_RUNS} ejecuciones)\n"
+        for nombre, archivo, uptime in inestables:
+            reporte += f"• {nombre[:40]} (`{archivo}`): {uptime:.0%} uptime\n"
+    
     reporte += "\n━━━━━━━━━━━━━━━━━━━━━\n"
     reporte += "🤖 Verificación automática"
     
@@ -200,32 +401,127 @@ def generar_reporte_limpieza(cleaning_results):
 # FUNCIÓN DE ENVÍO A TELEGRAM
 # ========================================
 
-def enviar_telegram(mensaje, tipo="info"):
-    """Envía mensaje a Telegram"""
-    if not BOT_TOKEN or not CHAT_ID:
-        print("⚠️  Variables de Telegram no configuradas")
-        print("   Configura TELEGRAM_BOT_TOKEN y TELEGRAM_CHAT_ID en GitHub Secrets")
-        return False
+_sesion = None
+
+def obtener_sesion():
+    """Sesión HTTP compartida por todos los envíos (reutiliza la conexión con la API)"""
+    global _sesion
+    if _sesion is None:
+        _sesion = requests.Session()
+    return _sesion
+
+def longitud_telegram(texto):
+    """Longitud como la cuenta Telegram (unidades UTF-16: un emoji puede valer 2)"""
+    return len(texto.encode('utf-16-le')) // 2
+
+def dividir_mensaje(mensaje, limite=TELEGRAM_MAX_CHARS):
+    """
+    Divide un reporte en partes de como máximo `limite` caracteres, cortando
+    entre líneas para no romper el formato Markdown (que nunca cruza líneas).
+    Con más de una parte, cada una lleva su numeración (📄 1/3).
+    """
+    reserva = longitud_telegram("📄 99/99\n")
+    lineas = []
+    for linea in mensaje.split("\n"):
+        # Una línea más larga que el límite se corta a la fuerza
+        while longitud_telegram(linea) > limite - reserva:
+            corte = (limite - reserva) // 2  # Peor caso: todo en pares sustitutos
+            lineas.append(linea[:corte])
+            linea = linea[corte:]
+        lineas.append(linea)
     
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+    partes = []
+    actual = ""
+    for linea in lineas:
+        candidata = f"{actual}\n{linea}" if actual else linea
+        if longitud_telegram(candidata) > limite - reserva and actual:
+            partes.append(actual)
+            actual = linea
+        else:
+            actual = candidata
+    partes.append(actual)
     
+    if len(partes) == 1:
+        return partes
+    return [f"📄 {i}/{len(partes)}\n{parte}" for i, parte in enumerate(partes, 1)]
+
+def enviar_mensaje(chat_id, texto, reintentos=TELEGRAM_REINTENTOS, espera=TELEGRAM_ESPERA):
+    """
+    Envía un mensaje a un chat. Ante un 429 espera el `retry_after` que indica
+    Telegram; ante errores de red o 5xx reintenta con espera creciente. Si el
+    Markdown no se puede interpretar (p. ej. un nombre de canal con "_"), se
+    reenvía como texto plano. Retorna True si se entregó.
+    """
+    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
     payload = {
-        'chat_id': CHAT_ID,
-        'text': mensaje,
+        'chat_id': chat_id,
+        'text': texto,
         'parse_mode': 'Markdown',
         'disable_web_page_preview': True
     }
     
-    try:
-        response = requests.post(url, json=payload, timeout=10)
-        response.raise_for_status()
-        print(f"✅ Reporte de {tipo} enviado a Telegram")
-        return True
-    except Exception as e:
-        print(f"❌ Error enviando reporte de {tipo} a Telegram: {e}")
-        if hasattr(e, 'response') and e.response:
-            print(f"   Respuesta: {e.response.text}")
+    for intento in range(reintentos):
+        demora = espera * 2 ** intento
+        try:
+            response = obtener_sesion().post(url, json=payload, timeout=10)
+        except requests.exceptions.RequestException as e:
+            print(f"   ⚠️  Error de red enviando a {chat_id} ({e.__class__.__name__}), reintento en {demora}s")
+            time.sleep(demora)
+            continue
+        
+        if response.ok:
+            return True
+        
+        try:
+            datos = response.json()
+        except ValueError:
+            datos = {}
+        descripcion = datos.get('description', response.text)
+        
+        if response.status_code == 429:
+            demora = datos.get('parameters', {}).get('retry_after', demora)
+            print(f"   ⏳ Límite de Telegram en {chat_id}, esperando {demora}s")
+        elif response.status_code == 400 and 'parse' in descripcion and 'parse_mode' in payload:
+            print(f"   ⚠️  Markdown no válido, se reenvía como texto plano a {chat_id}")
+            del payload['parse_mode']
+            payload['text'] = texto.replace('*', '').replace('`', '')
+            continue
+        elif response.status_code < 500:
+            print(f"❌ Telegram rechazó el mensaje para {chat_id}: {descripcion}")
+            return False
+        else:
+            print(f"   ⚠️  Telegram respondió {response.status_code} a {chat_id}, reintento en {demora}s")
+        time.sleep(demora)
+    
+    print(f"❌ No se pudo entregar el mensaje a {chat_id} tras {reintentos} intentos")
+    return False
+
+def enviar_a_chat(chat_id, partes):
+    """Envía las partes de un reporte en orden; se detiene en la primera que falle"""
+    return all(enviar_mensaje(chat_id, parte) for parte in partes)
+
+def enviar_telegram(mensaje, tipo="info"):
+    """
+    Envía un reporte a todos los chats de TELEGRAM_CHAT_ID: se divide en
+    partes de hasta 4096 caracteres que cada chat recibe en orden, y los
+    chats se atienden en paralelo. Retorna True si todos lo recibieron.
+    """
+    if not BOT_TOKEN or not CHAT_IDS:
+        print("⚠️  Variables de Telegram no configuradas")
+        print("   Configura TELEGRAM_BOT_TOKEN y TELEGRAM_CHAT_ID en GitHub Secrets")
         return False
+    
+    partes = dividir_mensaje(mensaje)
+    with ThreadPoolExecutor(max_workers=len(CHAT_IDS)) as executor:
+        entregas = dict(zip(CHAT_IDS, executor.map(lambda chat: enviar_a_chat(chat, partes), CHAT_IDS)))
+    
+    enviados = sum(entregas.values())
+    detalle = f"{len(partes)} parte(s), {enviados}/{len(CHAT_IDS)} chat(s)"
+    if enviados == len(CHAT_IDS):
+        print(f"✅ Reporte de {tipo} enviado a Telegram ({detalle})")
+        return True
+    print(f"❌ Reporte de {tipo} no entregado a todos los chats ({detalle})")
+    return False
 
 def guardar_reporte_local(reporte, filename):
     """Guarda el reporte en un archivo de texto"""
@@ -251,26 +547,39 @@ def main():
     
     reportes_enviados = 0
     
+    # Historial por canal (SQLite); si no existe se usan los JSON de conteos
+    conn = abrir_historial_db()
+    ejecuciones = ultimas_ejecuciones(conn) if conn else []
+    run_actual = ejecuciones[0] if ejecuciones else None
+    run_previo = ejecuciones[1] if len(ejecuciones) > 1 else None
+    
     # ========================================
     # REPORTE 1: ACTUALIZACIÓN (si existe)
     # ========================================
     
-    if Path(HISTORY_FILE).exists():
+    if Path(HISTORY_FILE).exists() or run_actual:
         print("\n📺 Procesando reporte de ACTUALIZACIÓN...")
         
         # Cargar historial actual (recién generado por check_m3u.py)
-        canales_actuales = cargar_historial(HISTORY_FILE)
+        canales_actuales = cargar_historial(HISTORY_FILE, conn, run_actual)
         
-        # Intentar cargar historial previo (si existe backup)
+        # Historial previo: ejecución anterior en SQLite o backup JSON
         historial_previo_file = HISTORY_FILE + '.old'
-        if Path(historial_previo_file).exists():
+        cambios_canales = None
+        if run_previo:
+            historial_previo = cargar_historial(HISTORY_FILE, conn, run_previo)
+            cambios_canales = diferencias_canales(conn, run_actual, run_previo)
+        elif Path(historial_previo_file).exists():
             historial_previo = cargar_historial(historial_previo_file)
         else:
             # Primera ejecución, usar datos actuales como referencia
             historial_previo = {}
         
         # Generar y enviar reporte de actualización
-        reporte_update = generar_reporte_actualizacion(canales_actuales, historial_previo)
+        reporte_update = generar_reporte_actualizacion(
+            canales_actuales, historial_previo, cargar_archivos_modificados(), cambios_canales,
+            cargar_metricas()
+        )
         
         print("\n" + "=" * 60)
         print(reporte_update.replace('*', '').replace('`', ''))
@@ -288,14 +597,16 @@ def main():
     # REPORTE 2: LIMPIEZA (si existe)
     # ========================================
     
-    if Path(CLEANING_HISTORY_FILE).exists():
+    if Path(CLEANING_HISTORY_FILE).exists() or run_actual:
         print("\n🧹 Procesando reporte de LIMPIEZA...")
         
-        cleaning_results = cargar_historial(CLEANING_HISTORY_FILE)
+        cleaning_results = cargar_historial(CLEANING_HISTORY_FILE, conn, run_actual)
         
         if cleaning_results:
             # Generar y enviar reporte de limpieza
-            reporte_cleaning = generar_reporte_limpieza(cleaning_results)
+            eliminados = canales_eliminados(conn, run_actual) if run_actual else None
+            inestables = canales_inestables(conn) if run_actual else None
+            reporte_cleaning = generar_reporte_limpieza(cleaning_results, eliminados, inestables)
             
             print("\n" + "=" * 60)
             print(reporte_cleaning.replace('*', '').replace('`', ''))
@@ -306,6 +617,9 @@ def main():
             if enviar_telegram(reporte_cleaning, tipo="limpieza"):
                 reportes_enviados += 1
     
+    if conn:
+        conn.close()
+    
     # ========================================
     # RESUMEN FINAL
     # ========================================
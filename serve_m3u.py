@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Servidor HTTP de las listas generadas (opcional)
+
+Expone las listas que escribe check_m3u.py, vistas combinadas y filtradas y
+el índice JSON de canales, pensado para muchos clientes (decodificadores,
+reproductores) que consultan periódicamente:
+
+    • ETag fuerte por representación y 304 Not Modified con If-None-Match
+    • compresión gzip (o brotli si está instalado) según Accept-Encoding
+    • peticiones Range (y If-Range) sobre el contenido sin comprimir
+    • cada vista se genera y comprime una sola vez y queda en memoria hasta
+      que alguno de sus archivos de origen se reescribe (el validador los
+      reemplaza con os.replace, lo que cambia su inodo y mtime)
+
+Rutas:
+    /                     catálogo JSON de listas y vistas
+    /index.json           índice de canales (mismo formato que channels_index.json)
+    /playlist.m3u         vista combinada; parámetros opcionales (separados por comas):
+                            file=chile.m3u,peru.m3u   listas a combinar (por defecto todas)
+                            country=cl,ar             país por tvg-id, tvg-country o lista
+                            group=news,kids           group-title (sin acentos ni mayúsculas)
+                            max_latency=800           descarta canales medidos por encima (ms)
+    /<archivo>            listas .m3u, groups/…/*.m3u, guías .xml.gz, logos/… y .m3u.gz/.m3u.br
+
+Uso:
+    python serve_m3u.py [--host 0.0.0.0] [--port 8080] [--root .] [--verbose]
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import check_m3u
+from check_m3u import (
+    COUNTRY_FILES, GROUPS_DIR, TVG_ID_COUNTRY_PATTERN, brotli, group_slug,
+    index_m3u_bytes, local_playlists, render_m3u,
+)
+
+SERVE_HOST = os.environ.get('IPTV_SERVE_HOST', '0.0.0.0')
+SERVE_PORT = int(os.environ.get('IPTV_SERVE_PORT', '8080'))
+SERVE_MAX_AGE = int(os.environ.get('IPTV_SERVE_MAX_AGE', '60'))  # Cache-Control para los clientes
+VIEW_CACHE_SIZE = 128  # Vistas generadas que se conservan en memoria
+
+# Archivos servibles tal cual (además de las listas .m3u)
+STATIC_SUFFIXES = ('.m3u', '.m3u.gz', '.m3u.br', '.xml.gz', '.json',
+                   '.png', '.jpg', '.gif', '.webp', '.svg')
+STATIC_DIRS = (GROUPS_DIR, check_m3u.LOGO_DIR)
+M3U_TYPE = 'audio/x-mpegurl; charset=utf-8'
+JSON_TYPE = 'application/json; charset=utf-8'
+COMPRESSIBLE_TYPES = (M3U_TYPE, JSON_TYPE, 'image/svg+xml')
+FILE_COUNTRIES = {filename: code for code, filename in COUNTRY_FILES.items()}
+RANGE_PATTERN = re.compile(r'bytes=(\d*)-(\d*)')
+
+class NotFound(Exception):
+    pass
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+class Rendered:
+    """
+    Una vista ya generada: el cuerpo, su ETag fuerte y las variantes
+    comprimidas, que se calculan la primera vez que un cliente las pide.
+    `signature` identifica la versión de los archivos de origen.
+    """
+
+    def __init__(self, body, content_type, signature):
+        self.body = body
+        self.content_type = content_type
+        self.signature = signature
+        self.etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        self.compressible = content_type in COMPRESSIBLE_TYPES
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def representation(self, encoding=None):
+        """(cuerpo, ETag) de la representación pedida: None, 'gzip' o 'br'."""
+        if encoding is None:
+            return self.body, self.etag
+        with self._lock:
+            if encoding not in self._encoded:
+                if encoding == 'br':
+                    data = brotli.compress(self.body, quality=11)
+                else:
+                    data = gzip.compress(self.body, compresslevel=9, mtime=0)
+                # Cada codificación es otra representación: ETag fuerte propio
+                self._encoded[encoding] = (data, f'{self.etag[:-1]}-{encoding}"')
+            return self._encoded[encoding]
+
+class ViewCache:
+    """Vistas generadas en memoria (LRU), válidas mientras no cambie su firma."""
+
+    def __init__(self, size=VIEW_CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, signature, render):
+        """Retorna la vista `key`; la genera con render() -> (cuerpo, tipo) si cambió su origen."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.signature == signature:
+                self._entries.move_to_end(key)
+                return entry
+
+        body, content_type = render()
+        entry = Rendered(body, content_type, signature)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return entry
+
+def file_signature(paths):
+    """Versión de un conjunto de archivos: (ruta, inodo, mtime, tamaño) de cada uno."""
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            signature.append((path, None))
+            continue
+        signature.append((path, stat.st_ino, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+def split_param(query, name):
+    """Valores de un parámetro de la consulta, admitiendo repeticiones y comas."""
+    return [value.strip() for raw in query.get(name, []) for value in raw.split(',') if value.strip()]
+
+def channel_countries(channel, filename):
+    """Códigos de país de un canal: sufijo del tvg-id, tvg-country y país de su lista."""
+    codes = {code.strip().lower() for code in channel.attributes.get('tvg-country', '').split(';')}
+    match = TVG_ID_COUNTRY_PATTERN.search((channel.tvg_id or '').lower())
+    if match:
+        codes.add(match.group(1))
+    if filename in FILE_COUNTRIES:
+        codes.add(FILE_COUNTRIES[filename])
+    codes.discard('')
+    return codes
+
+def channel_groups(channel):
+    """Grupos de un canal normalizados como en las listas por grupo ("A;B" → dos grupos)."""
+    titles = [title.strip() for title in channel.group_title.split(';') if title.strip()]
+    return {group_slug(title) for title in titles or ['']}
+
+def load_latencies(db_path):
+    """
+    Tiempo al primer byte medido de cada URL ({url: ms}) desde la base de
+    estado, incluidos los destinos de redirección escritos en las listas.
+    """
+    if not os.path.exists(db_path):
+        return {}
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        latencies = dict(conn.execute("SELECT url, ttfb_ms FROM url_status WHERE ttfb_ms IS NOT NULL"))
+        try:
+            for final_url, url in conn.execute("SELECT final_url, url FROM redirects"):
+                if url in latencies:
+                    latencies.setdefault(final_url, latencies[url])
+        except sqlite3.OperationalError:
+            pass  # Base de una versión sin tabla de redirecciones
+    finally:
+        conn.close()
+    return latencies
+
+class PlaylistServer(ThreadingHTTPServer):
+    """Servidor de listas con caché de vistas; `root` es el directorio de las listas."""
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, address, root='.', verbose=False):
+        super().__init__(address, PlaylistHandler)
+        self.root = os.path.realpath(root)
+        self.verbose = verbose
+        self.views = ViewCache()
+
+    def handle_error(self, request, client_address):
+        # Clientes que cortan la conexión a mitad de respuesta
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def playlists(self):
+        return local_playlists(self.root)
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as f:
+            return f.read()
+
+    # --- Vistas ---
+
+    def static_file(self, name):
+        """Un archivo servible tal cual, dentro de `root` y sin rutas ocultas."""
+        parts = name.split('/')
+        allowed = name.endswith(STATIC_SUFFIXES) and (len(parts) == 1 or parts[0] in STATIC_DIRS)
+        if not allowed or any(not part or part.startswith('.') for part in parts):
+            raise NotFound(name)
+        path = os.path.realpath(self.path(name))
+        if not path.startswith(self.root + os.sep) or not os.path.isfile(path):
+            raise NotFound(name)
+
+        def render():
+            if name.endswith('.m3u'):
+                content_type = M3U_TYPE
+            elif name.endswith('.json'):
+                content_type = JSON_TYPE
+            else:
+                content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            return self.read(name), content_type
+
+        return self.views.get(('file', name), file_signature([path]), render)
+
+    def index(self):
+        """Índice de canales de todas las listas, generado desde su contenido actual."""
+        playlists = self.playlists()
+
+        def render():
+            index = {'fields': ['name', 'group', 'tvg_id', 'offset', 'length'], 'files': {}}
+            for filename in playlists:
+                data = self.read(filename)
+                index['files'][filename] = {
+                    'bytes': len(data),
+                    'sha256': hashlib.sha256(data).hexdigest(),
+                    'channels': [[channel.name, channel.group_title, channel.tvg_id, offset, length]
+                                 for channel, offset, length in index_m3u_bytes(data)],
+                }
+            return json.dumps(index, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), JSON_TYPE
+
+        return self.views.get(('index',), file_signature(map(self.path, playlists)), render)
+
+    def catalog(self):
+        """Listas disponibles con su cantidad de canales, y los filtros de /playlist.m3u."""
+        playlists = self.playlists()
+
+        def render():
+            catalog = {
+                'playlists': {
+                    filename: {'channels': len(index_m3u_bytes(self.read(filename))),
+                               'country': FILE_COUNTRIES.get(filename)}
+                    for filename in playlists
+                },
+                'views': {
+                    'index': '/index.json',
+                    'playlist': '/playlist.m3u?file=&country=&group=&max_latency=',
+                },
+            }
+            return json.dumps(catalog, ensure_ascii=False, indent=2).encode('utf-8'), JSON_TYPE
+
+        return self.views.get(('catalog',), file_signature(map(self.path, playlists)), render)
+
+    def filtered_playlist(self, query):
+        """Vista combinada de varias listas filtrada por país, grupo y latencia."""
+        available = self.playlists()
+        files = split_param(query, 'file') or available
+        missing = [filename for filename in files if filename not in available]
+        if missing:
+            raise NotFound(', '.join(missing))
+        countries = {code.lower() for code in split_param(query, 'country')}
+        groups = {group_slug(group) for group in split_param(query, 'group')}
+        max_latency = split_param(query, 'max_latency')
+        max_latency = int(max_latency[0]) if max_latency else None  # ValueError → 400
+
+        sources = [self.path(filename) for filename in files]
+        db_path = self.path(check_m3u.STATE_DB_FILE)
+        if max_latency is not None:
+            sources.append(db_path)
+        key = ('playlist', tuple(files), tuple(sorted(countries)), tuple(sorted(groups)), max_latency)
+
+        def render():
+            latencies = load_latencies(db_path) if max_latency is not None else {}
+            seen = set()
+            channels = []
+            for filename in files:
+                for channel, _, _ in index_m3u_bytes(self.read(filename)):
+                    if channel.url in seen:
+                        continue
+                    if countries and not countries & channel_countries(channel, filename):
+                        continue
+                    if groups and not groups & channel_groups(channel):
+                        continue
+                    if max_latency is not None and latencies.get(channel.url, 0) > max_latency:
+                        continue
+                    seen.add(channel.url)
+                    channels.append(channel)
+            return render_m3u(channels).encode('utf-8'), M3U_TYPE
+
+        return self.views.get(key, file_signature(sources), render)
+
+def accepted_encoding(header):
+    """Mejor codificación aceptada por el cliente ('br', 'gzip' o None) según Accept-Encoding."""
+    accepted = {}
+    for item in header.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        match = re.search(r'q=([0-9.]+)', params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in (('br', 'gzip') if brotli is not None else ('gzip',)):
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+def etag_matches(header, etag):
+    """True si If-None-Match incluye la ETag (o es "*")."""
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+def parse_range(header, size):
+    """
+    Rango (inicio, fin) inclusivo de un header Range de un solo rango, o
+    None si no se entiende (se responde completo). Lanza
+    RangeNotSatisfiable si cae fuera del contenido.
+    """
+    match = RANGE_PATTERN.fullmatch(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if not start:
+        suffix = int(end)
+        if suffix == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - suffix), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if end < start:
+        return None
+    return start, end
+
+class PlaylistHandler(BaseHTTPRequestHandler):
+    server_version = 'IPTVServe/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_HEAD(self):
+        self.handle_request()
+
+    def handle_request(self):
+        parts = urlsplit(self.path)
+        path = unquote(parts.path)
+        query = parse_qs(parts.query)
+        try:
+            if path == '/':
+                entry = self.server.catalog()
+            elif path == '/index.json':
+                entry = self.server.index()
+            elif path == '/playlist.m3u':
+                entry = self.server.filtered_playlist(query)
+            else:
+                entry = self.server.static_file(path.lstrip('/'))
+        except NotFound as e:
+            self.send_plain(404, f"No encontrado: {e}\n")
+            return
+        except ValueError as e:
+            self.send_plain(400, f"Parámetro inválido: {e}\n")
+            return
+        self.send_entry(entry)
+
+    def send_plain(self, status, text, headers=None):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_entry(self, entry):
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        use_range = bool(range_header) and (not if_range or if_range.strip() == entry.etag)
+
+        # Los rangos se sirven sobre el contenido sin comprimir
+        encoding = None
+        if entry.compressible and not use_range:
+            encoding = accepted_encoding(self.headers.get('Accept-Encoding', ''))
+        body, etag = entry.representation(encoding)
+
+        headers = {
+            'ETag': etag,
+            'Cache-Control': f'public, max-age={SERVE_MAX_AGE}',
+            'Accept-Ranges': 'bytes',
+        }
+        if entry.compressible:
+            headers['Vary'] = 'Accept-Encoding'
+
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match and etag_matches(if_none_match, etag):
+            self.send_response(304)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+
+        status = 200
+        if use_range:
+            try:
+                byte_range = parse_range(range_header, len(body))
+            except RangeNotSatisfiable:
+                self.send_plain(416, "Rango fuera del contenido\n",
+                                {**headers, 'Content-Range': f'bytes */{len(body)}'})
+                return
+            if byte_range:
+                start, end = byte_range
+                headers['Content-Range'] = f'bytes {start}-{end}/{len(body)}'
+                body = body[start:end + 1]
+                status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', entry.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor HTTP de las listas IPTV generadas")
+    parser.add_argument('--host', default=SERVE_HOST, help="dirección de escucha (IPTV_SERVE_HOST)")
+    parser.add_argument('--port', type=int, default=SERVE_PORT, help="puerto (IPTV_SERVE_PORT)")
+    parser.add_argument('--root', default='.', help="directorio de las listas")
+    parser.add_argument('--verbose', action='store_true', help="registrar cada petición")
+    args = parser.parse_args(argv)
+
+    server = PlaylistServer((args.host, args.port), root=args.root, verbose=args.verbose)
+    print(f"🌐 Sirviendo {len(server.playlists())} listas de {server.root} "
+          f"en http://{args.host}:{server.server_address[1]}/")
+    if brotli is None:
+        print("   ⚠️  Módulo brotli no instalado: solo compresión gzip")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Servidor detenido")
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,33 @@
+import gzip
+
+import build_epg
+import check_m3u
+
+PLAYLIST = '#EXTM3U\n#EXTINF:-1 tvg-id="A.cl" group-title="News",A\nhttp://origin.invalid/a.m3u8\n'
+
+def guide(programmes):
+    items = ''.join(
+        f'<programme channel="A.cl" start="2026010100{i:02d}00 +0000" stop="2026010100{i:02d}30 +0000">'
+        f'<title>P{i}</title></programme>'
+        for i in range(programmes)
+    )
+    return f'<?xml version="1.0"?><tv><channel id="A.cl"><display-name>A</display-name></channel>{items}</tv>'
+
+def programmes_in(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return f.read().count('<programme ')
+
+def test_truncated_gzip_guide_keeps_previous_guide(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    check_m3u.changed_files.clear()
+    (tmp_path / 'chile.m3u').write_text(PLAYLIST, encoding='utf-8')
+    (tmp_path / 'good.xml').write_text(guide(50), encoding='utf-8')
+    data = gzip.compress(guide(50).encode('utf-8'))
+    (tmp_path / 'cut.xml.gz').write_bytes(data[:len(data) // 2])
+
+    assert build_epg.main(['good.xml']) == 0
+    assert programmes_in('chile.xml.gz') == 50
+
+    # Un gzip truncado (EOFError) no detiene el job ni reemplaza la guía anterior
+    assert build_epg.main(['cut.xml.gz']) == 0
+    assert programmes_in('chile.xml.gz') == 50
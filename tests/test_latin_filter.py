@@ -0,0 +1,15 @@
+from check_m3u import EXCLUDE_KEYWORDS, LATIN_KEYWORDS, is_latin_channel
+
+def test_keyword_lists_do_not_contain_each_other():
+    # is_latin_channel clasifica la coincidencia más larga de un solo trie
+    assert not [(a, b) for a in LATIN_KEYWORDS for b in EXCLUDE_KEYWORDS if a in b or b in a]
+
+def test_exclude_keyword_takes_precedence():
+    assert is_latin_channel('#EXTINF:-1,Cine Latino', 'http://x.invalid/a.m3u8')
+    assert not is_latin_channel('#EXTINF:-1,Cine Latino English', 'http://x.invalid/a.m3u8')
+    # Palabra de exclusión que empieza dentro de una latina ("band[a]rabic")
+    assert not is_latin_channel('#EXTINF:-1,Bandarabic', 'http://x.invalid/a.m3u8')
+
+def test_spanish_tvg_country_without_keywords():
+    assert is_latin_channel('#EXTINF:-1 tvg-country="MX",Canal 5', 'http://x.invalid/a.m3u8')
+    assert not is_latin_channel('#EXTINF:-1,Canal 5', 'http://x.invalid/a.m3u8')
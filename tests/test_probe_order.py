@@ -0,0 +1,25 @@
+import time
+
+from check_m3u import UrlStatusCache, probe_order
+
+def test_host_interleaving_stays_within_priority_tiers(tmp_path):
+    cache = UrlStatusCache(str(tmp_path / 'state.db'))
+    try:
+        now = time.time()
+        # Verificadas hace poco y sin fallos: lo menos urgente, en varios hosts
+        cache.last_known.update({f'http://h{i}.invalid/ok.m3u8': (True, now - 60) for i in range(4)})
+        # Estuvo viva y ahora falla
+        cache.last_known['http://h0.invalid/failing.m3u8'] = (False, now - 60)
+        cache.failures['http://h0.invalid/failing.m3u8'] = 1
+        urls = [f'http://h{i}.invalid/ok.m3u8' for i in range(4)] + [
+            'http://h0.invalid/failing.m3u8',
+            'http://h0.invalid/new-1.m3u8',
+            'http://h0.invalid/new-2.m3u8',
+        ]
+        assert probe_order(urls, cache)[:3] == [
+            'http://h0.invalid/new-1.m3u8',
+            'http://h0.invalid/new-2.m3u8',
+            'http://h0.invalid/failing.m3u8',
+        ]
+    finally:
+        cache.close()
@@ -0,0 +1,38 @@
+import check_m3u
+from check_m3u import FAILURE_THRESHOLD, ProbeResult
+
+URL = 'http://origin.invalid/live/1/index.m3u8'
+PLAYLIST = f'#EXTM3U\n#EXTINF:-1 tvg-id="Uno.cl" group-title="News",Uno\n{URL}\n'
+
+def merge_run(alive):
+    """Un merge de shards (main con descargas y resultados ya listos) sin red."""
+    result = ProbeResult(URL, alive=alive, status_code=200 if alive else 404,
+                         stage='manifest' if alive else None, ttfb_ms=40)
+    downloads = {url: {'status': 'error', 'error': 'sin red'} for url in check_m3u.remote_source_urls()}
+    hosts = {'origin.invalid': {'probes': 1, 'alive': int(alive), 'dead': int(not alive), 'skipped': 0,
+                                'consecutive_failures': 0, 'tripped': False, 'timeouts': 0,
+                                'probe_seconds': 0.04, 'max_ms': 40}}
+    check_m3u.main(downloads=downloads, shard_results={URL: result}, shard_hosts=[hosts])
+    with open('local.m3u', encoding='utf-8') as f:
+        return URL in f.read()
+
+def test_merge_removes_a_dead_channel_after_the_failure_threshold(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(check_m3u, 'LOGO_CACHE', False)
+    monkeypatch.setattr(check_m3u, 'DERIVED_OUTPUTS', False)
+    (tmp_path / 'local.m3u').write_text(PLAYLIST, encoding='utf-8')
+
+    assert merge_run(alive=True)
+    # Se conserva mientras no acumule FAILURE_THRESHOLD caídas seguidas
+    for _ in range(FAILURE_THRESHOLD - 1):
+        assert merge_run(alive=False)
+    assert not merge_run(alive=False)
+
+def test_merge_metrics_include_shard_probes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(check_m3u, 'LOGO_CACHE', False)
+    monkeypatch.setattr(check_m3u, 'DERIVED_OUTPUTS', False)
+    (tmp_path / 'local.m3u').write_text(PLAYLIST, encoding='utf-8')
+
+    merge_run(alive=True)
+    assert check_m3u.run_metrics.snapshot(check_m3u.host_scheduler)['counters']['probes'] == 1
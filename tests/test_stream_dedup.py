@@ -0,0 +1,34 @@
+import check_m3u
+from check_m3u import ProbeResult, collapse_equivalent, iter_m3u_channels
+
+def channels(*entries):
+    lines = ['#EXTM3U']
+    for name, url in entries:
+        lines += [f'#EXTINF:-1 group-title="N",{name}', url]
+    return list(iter_m3u_channels(lines))
+
+def test_dead_channels_redirecting_to_the_same_slate_are_not_collapsed():
+    slate = 'http://cdn.invalid/offline.m3u8'
+    url_status = {
+        url: ProbeResult(url, alive=False, status_code=404, redirects=1, redirect_chain=[slate])
+        for url in ('http://a.invalid/news.m3u8', 'http://b.invalid/sports.m3u8')
+    }
+    kept = channels(('News', 'http://a.invalid/news.m3u8'), ('Sports', 'http://b.invalid/sports.m3u8'))
+    assert [c.name for c in collapse_equivalent(kept, url_status)] == ['News', 'Sports']
+
+def test_alive_channels_redirecting_to_the_same_stream_are_collapsed():
+    target = 'http://cdn.invalid/live/index.m3u8'
+    url_status = {
+        'http://a.invalid/1.m3u8': ProbeResult('http://a.invalid/1.m3u8', alive=True, ttfb_ms=300,
+                                              redirects=1, redirect_chain=[target]),
+        'http://b.invalid/2.m3u8': ProbeResult('http://b.invalid/2.m3u8', alive=True, ttfb_ms=100,
+                                              redirects=1, redirect_chain=[target]),
+    }
+    kept = channels(('Uno', 'http://a.invalid/1.m3u8'), ('Dos', 'http://b.invalid/2.m3u8'))
+    assert [c.name for c in collapse_equivalent(kept, url_status)] == ['Dos']
+
+def test_stream_keys_of_a_dead_result_ignore_its_redirect():
+    url = 'http://a.invalid/news.m3u8'
+    result = ProbeResult(url, alive=False, redirect_chain=['http://cdn.invalid/offline.m3u8'],
+                         fingerprint='abc')
+    assert check_m3u.stream_keys(url, url_status={url: result}) == [check_m3u.normalize_stream_url(url)]